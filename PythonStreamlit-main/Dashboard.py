@@ -1,4 +1,5 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
@@ -7,6 +8,10 @@ import pycountry
 import random
 import string
 import os
+import json
+import hashlib
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 
 # --- Configuration & Styles ---
@@ -157,45 +162,146 @@ PRODUCTS = ["AI Assistant", "Smart Prototype", "Analytics Suite"]
 YEARLY_TARGET = 120000  # Per salesperson
 TEAM_YEARLY_TARGET = YEARLY_TARGET * 5  # For 5 salespeople
 DATA_CSV_PATH = os.path.join(os.path.dirname(__file__), "combined_data.csv")
+DATA_CACHE_PATH = os.path.join(os.path.dirname(__file__), "combined_data.parquet")
+CACHE_FINGERPRINT_KEY = b"pd_dashboard.source"
+CACHE_SCHEMA_VERSION = 2
+# Low-cardinality dimensions are held as categoricals; summed money columns stay float64
+CATEGORY_COLUMNS = [
+    'event_type', 'country', 'product', 'channel', 'job_type',
+    'url', 'salesperson_id', 'salesperson_name'
+]
+FLOAT32_COLUMNS = ['price', 'unit_cost', 'profit_margin']
+TARGET_URLS = ['/request-demo', '/promotional-event', '/ai-assistant']
 
 
 
 # --- Data Processing Functions ---
+def preprocess(df):
+    # Ensure numeric types
+    df['price'] = pd.to_numeric(df['price'], errors='coerce').fillna(0)
+    df['unit_cost'] = pd.to_numeric(df['unit_cost'], errors='coerce').fillna(0)
+    df['quantity'] = pd.to_numeric(df['quantity'], errors='coerce').fillna(0)
+    # Compute P&L
+    df['revenue'] = df['price'] * df['quantity']
+    df['cost'] = df['unit_cost'] * df['quantity']
+    df['profit'] = df['revenue'] - df['cost']
+    df['profit_margin'] = df['profit'] / df['revenue'].replace({0: 1})
+    # Optimize with index
+    df.set_index('timestamp', inplace=True)
+    # filter_df relies on a sorted index to slice date windows
+    return df.sort_index(kind='stable')
+
+def apply_schema(df):
+    for col in CATEGORY_COLUMNS:
+        df[col] = df[col].astype('category')
+    for col in FLOAT32_COLUMNS:
+        df[col] = df[col].astype('float32')
+    if (df['quantity'] % 1 == 0).all():
+        df['quantity'] = df['quantity'].astype('int32')
+    df['status'] = pd.to_numeric(df['status'], errors='coerce').round().astype('Int16')
+    return df
+
+def file_digest(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_cached_frame(csv_path, cache_path):
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        metadata = pq.read_schema(cache_path).metadata or {}
+        source = json.loads(metadata.get(CACHE_FINGERPRINT_KEY, b'{}'))
+        stat = os.stat(csv_path)
+        if source.get('schema') != CACHE_SCHEMA_VERSION or source.get('size') != stat.st_size:
+            return None
+        if source.get('mtime_ns') != stat.st_mtime_ns and source.get('digest') != file_digest(csv_path):
+            return None
+        return pq.read_table(cache_path).to_pandas()
+    except Exception:
+        return None
+
+def write_cached_frame(df, csv_path, cache_path, stat):
+    source = {
+        'schema': CACHE_SCHEMA_VERSION,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'digest': file_digest(csv_path),
+    }
+    table = pa.Table.from_pandas(df)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        CACHE_FINGERPRINT_KEY: json.dumps(source).encode('utf-8'),
+    })
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except Exception:
+        # A read-only deploy just keeps parsing the CSV
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
 @st.cache_data
 def load_data():
     try:
-        df = pd.read_csv(DATA_CSV_PATH, parse_dates=["timestamp"], encoding='utf-8')
-        # Ensure numeric types
-        df['price'] = pd.to_numeric(df['price'], errors='coerce').fillna(0)
-        df['unit_cost'] = pd.to_numeric(df['unit_cost'], errors='coerce').fillna(0)
-        df['quantity'] = pd.to_numeric(df['quantity'], errors='coerce').fillna(0)
-        # Compute P&L
-        df['revenue'] = df['price'] * df['quantity']
-        df['cost'] = df['unit_cost'] * df['quantity']
-        df['profit'] = df['revenue'] - df['cost']
-        df['profit_margin'] = df['profit'] / df['revenue'].replace({0: 1})
-        # Optimize with index
-        df.set_index('timestamp', inplace=True)
+        df = read_cached_frame(DATA_CSV_PATH, DATA_CACHE_PATH)
+        if df is not None:
+            return df
+        stat = os.stat(DATA_CSV_PATH)
+        df = apply_schema(preprocess(pd.read_csv(DATA_CSV_PATH, parse_dates=["timestamp"], encoding='utf-8')))
+        write_cached_frame(df, DATA_CSV_PATH, DATA_CACHE_PATH, stat)
         return df
     except Exception as e:
         st.error(f"Failed to load data: {e}")
         return pd.DataFrame()
 
-def filter_df(data, start_date, end_date, countries, product=None):
+def build_country_index(df):
+    # Row positions grouped by country code, ascending within each country;
+    # rows without a country sort first and belong to no code
+    codes = df['country'].cat.codes.to_numpy()
+    positions = np.argsort(codes, kind='stable')
+    counts = np.bincount(codes[codes >= 0], minlength=len(df['country'].cat.categories))
+    offsets = np.concatenate([[0], np.cumsum(counts)]) + int((codes < 0).sum())
+    return df['country'].cat.categories, positions, offsets
+
+@st.cache_resource
+def load_country_index():
+    df = load_data()
+    return build_country_index(df) if not df.empty else None
+
+def country_rows(country_index, countries, lo, hi):
+    categories, positions, offsets = country_index
+    codes = categories.get_indexer(pd.Index(countries).unique())
+    runs = []
+    for code in codes[codes >= 0]:
+        run = positions[offsets[code]:offsets[code + 1]]
+        runs.append(run[run.searchsorted(lo):run.searchsorted(hi)])
+    return np.sort(np.concatenate(runs)) if runs else positions[:0]
+
+def filter_df(data, start_date, end_date, countries, product=None, country_index=None):
     try:
-        filtered = data.copy()
+        # Sorted index: slice the date window by binary search (a view, not a copy)
+        lo, hi = 0, len(data)
         if start_date:
             start_date = pd.to_datetime(start_date, errors='coerce')
             if pd.isna(start_date):
                 return pd.DataFrame()
-            filtered = filtered[filtered.index >= start_date]
+            lo = data.index.searchsorted(start_date, side='left')
         if end_date:
             end_date = pd.to_datetime(end_date, errors='coerce')
             if pd.isna(end_date):
                 return pd.DataFrame()
-            filtered = filtered[filtered.index <= end_date]
-        if countries:
-            filtered = filtered[filtered['country'].isin(countries)]
+            hi = data.index.searchsorted(end_date, side='right')
+        if countries and country_index is not None:
+            # Union of the selected countries' rows inside the date slice
+            filtered = data.iloc[country_rows(country_index, countries, lo, max(lo, hi))]
+        else:
+            filtered = data.iloc[lo:max(lo, hi)]
+            if countries:
+                filtered = filtered[filtered['country'].isin(countries)]
         if product:
             filtered = filtered[filtered['product'] == product]
         return filtered
@@ -209,61 +315,47 @@ def get_countries(df):
     except Exception:
         return []
 
-def get_sales(df, start_date, end_date, countries):
+def group_country_product(sales):
+    # Shared by the sales and profit margin panels
+    return (
+        sales
+        .groupby(['country', 'product'], observed=True)
+        .agg(
+            sales_count=('quantity', 'sum'),
+            revenue=('revenue', 'sum'),
+            profit=('profit', 'sum'),
+            profit_margin=('profit_margin', 'mean')
+        )
+        .reset_index()
+    )
+
+def get_sales(by_country_product):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, countries)
-        if filtered.empty:
+        if by_country_product.empty:
             return []
-        grouped = (
-            filtered
-            .reset_index()
-            .groupby(['country', 'product'])
-            .agg(
-                sales_count=('quantity', 'sum'),
-                revenue=('revenue', 'sum'),
-                profit=('profit', 'sum')
-            )
-            .reset_index()
-        )
+        grouped = by_country_product[['country', 'product', 'sales_count', 'revenue', 'profit']]
         return grouped.to_dict(orient='records')
     except Exception:
         return []
 
-def get_web_events(df, start_date, end_date, countries):
+def get_web_events(web, events):
     try:
-        web_df = df[df['event_type'] == 'web']
-        filtered = filter_df(web_df, start_date, end_date, countries)
-        if filtered.empty:
+        if web.empty:
             return []
-        target_urls = ['/request-demo', '/promotional-event', '/ai-assistant']
-        events = filtered[filtered['url'].isin(target_urls)]
-        grouped = events.reset_index().groupby(['country', 'url']).size().reset_index(name='count')
+        grouped = events.groupby(['country', 'url'], observed=True).size().reset_index(name='count')
         return grouped.to_dict(orient='records')
     except Exception:
         return []
 
-def get_metrics(df, start_date, end_date, countries):
+def get_metrics(sales, url_counts):
     try:
-        filtered = filter_df(df, start_date, end_date, countries)
-        if filtered.empty:
-            return {
-                "total_sales": 0,
-                "total_revenue": 0.0,
-                "total_profit": 0.0,
-                "demo_requests": 0,
-                "promo_requests": 0,
-                "ai_requests": 0
-            }
-        sales = filtered[filtered['event_type'] == 'sale']
-        web = filtered[filtered['event_type'] == 'web']
         return {
             "total_sales": int(sales.shape[0]),
             "total_revenue": float(sales['revenue'].sum()),
             "total_profit": float(sales['profit'].sum()),
-            "demo_requests": int(web[web['url'] == '/request-demo'].shape[0]),
-            "promo_requests": int(web[web['url'] == '/promotional-event'].shape[0]),
-            "ai_requests": int(web[web['url'] == '/ai-assistant'].shape[0])
+            "demo_requests": int(url_counts.get('/request-demo', 0)),
+            "promo_requests": int(url_counts.get('/promotional-event', 0)),
+            "ai_requests": int(url_counts.get('/ai-assistant', 0))
         }
     except Exception:
         return {
@@ -275,15 +367,14 @@ def get_metrics(df, start_date, end_date, countries):
             "ai_requests": 0
         }
 
-def get_stats(df, start_date, end_date, countries):
+def get_stats(filtered):
     try:
-        filtered = filter_df(df, start_date, end_date, countries)
         if filtered.empty:
             return []
         stats = (
             filtered
             .reset_index()
-            .groupby('event_type')
+            .groupby('event_type', observed=True)
             .agg(
                 mean_price=('price', 'mean'),
                 std_price=('price', 'std'),
@@ -297,11 +388,10 @@ def get_stats(df, start_date, end_date, countries):
     except Exception:
         return []
 
-def get_software_sales(df, start_date, end_date, countries):
+def get_software_sales(sales):
     try:
         products = ["AI Assistant", "Smart Prototype", "Analytics Suite"]
-        sales_df = df[(df['event_type'] == 'sale') & df['product'].isin(products)]
-        filtered = filter_df(sales_df, start_date, end_date, countries)
+        filtered = sales[sales['product'].isin(products)]
         if filtered.empty:
             return {"software_sales_count": 0, "software_revenue": 0.0}
         return {
@@ -311,29 +401,21 @@ def get_software_sales(df, start_date, end_date, countries):
     except Exception:
         return {"software_sales_count": 0, "software_revenue": 0.0}
 
-def get_conversion_funnel(df, start_date, end_date, countries):
+def get_conversion_funnel(sales, web, url_counts):
     try:
-        filtered = filter_df(df, start_date, end_date, countries)
-        if filtered.empty:
-            return {"web_visits": 0, "demo_requests": 0, "sales": 0, "conversion_rate": 0.0}
-        visits = filtered[filtered['event_type'] == 'web']
-        demos = visits[visits['url'] == '/request-demo']
-        sales = filtered[filtered['event_type'] == 'sale']
-        web_count = int(visits.shape[0])
+        web_count = int(web.shape[0])
         sales_count = int(sales.shape[0])
         return {
             "web_visits": web_count,
-            "demo_requests": int(demos.shape[0]),
+            "demo_requests": int(url_counts.get('/request-demo', 0)),
             "sales": sales_count,
             "conversion_rate": float(sales_count / web_count * 100) if web_count > 0 else 0
         }
     except Exception:
         return {"web_visits": 0, "demo_requests": 0, "sales": 0, "conversion_rate": 0.0}
 
-def get_trends(df, start_date, end_date, countries):
+def get_trends(filtered):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, countries)
         if filtered.empty:
             return []
         grouped = (
@@ -350,16 +432,14 @@ def get_trends(df, start_date, end_date, countries):
     except Exception:
         return []
 
-def get_sales_by_channel(df, start_date, end_date, countries):
+def get_sales_by_channel(filtered):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, countries)
         if filtered.empty:
             return []
         grouped = (
             filtered
             .reset_index()
-            .groupby(['product', 'channel'])
+            .groupby(['product', 'channel'], observed=True)
             .agg(
                 sales_count=('quantity', 'sum'),
                 revenue=('revenue', 'sum')
@@ -370,35 +450,23 @@ def get_sales_by_channel(df, start_date, end_date, countries):
     except Exception:
         return []
 
-def get_profit_margin(df, start_date, end_date, countries):
+def get_profit_margin(by_country_product):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, countries)
-        if filtered.empty:
+        if by_country_product.empty:
             return []
-        grouped = (
-            filtered
-            .reset_index()
-            .groupby(['country', 'product'])
-            .agg(
-                profit_margin=('profit_margin', 'mean')
-            )
-            .reset_index()
-        )
+        grouped = by_country_product[['country', 'product', 'profit_margin']]
         return grouped.to_dict(orient='records')
     except Exception:
         return []
 
-def get_top_customers(df, start_date, end_date, countries):
+def get_top_customers(filtered):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, countries)
         if filtered.empty:
             return []
         grouped = (
             filtered
             .reset_index()
-            .groupby(['customer_id', 'country'])
+            .groupby(['customer_id', 'country'], observed=True)
             .agg(
                 sales_count=('quantity', 'sum'),
                 revenue=('revenue', 'sum')
@@ -410,14 +478,10 @@ def get_top_customers(df, start_date, end_date, countries):
     except Exception:
         return []
 
-def get_web_trends(df, start_date, end_date, countries):
+def get_web_trends(filtered, events, start_date, end_date):
     try:
-        web_df = df[df['event_type'] == 'web']
-        filtered = filter_df(web_df, start_date, end_date, countries)
         if filtered.empty:
             return []
-        target_urls = ['/request-demo', '/promotional-event', '/ai-assistant']
-        events = filtered[filtered['url'].isin(target_urls)]
         if events.empty:
             return []
         date_range = pd.date_range(
@@ -427,14 +491,14 @@ def get_web_trends(df, start_date, end_date, countries):
         )
         grouped = (
             events
-            .groupby([pd.Grouper(freq='W'), 'url'])
+            .groupby([pd.Grouper(freq='W'), 'url'], observed=True)
             .size()
             .unstack(fill_value=0)
             .reindex(date_range, fill_value=0)
             .reset_index()
             .rename(columns={'index': 'timestamp'})
         )
-        for url in target_urls:
+        for url in TARGET_URLS:
             col_name = url
             if col_name not in grouped.columns:
                 grouped[col_name] = 0
@@ -447,36 +511,33 @@ def get_web_trends(df, start_date, end_date, countries):
     except Exception:
         return []
 
-def get_sales_stats(df, start_date, end_date, countries):
+def get_sales_stats(filtered):
     try:
-        sales_df = df[df['event_type'] == 'sale'].copy()
-        filtered = filter_df(sales_df, start_date, end_date, countries)
         if filtered.empty:
             return []
-        filtered['job_type'] = filtered.get('job_type', 'Unknown').fillna('Unknown')
-        stats = (
-            filtered
-            .reset_index()
-            .groupby(['country', 'product', 'job_type'])
-            .agg(
-                mean_sales_count=('quantity', lambda x: x.mean() if len(x) > 0 else 0),
-                std_sales_count=('quantity', lambda x: x.std() if len(x) > 1 else 0),
-                mean_revenue=('revenue', lambda x: x.mean() if len(x) > 0 else 0),
-                std_revenue=('revenue', lambda x: x.std() if len(x) > 1 else 0),
-                mean_profit=('profit', lambda x: x.mean() if len(x) > 0 else 0),
-                std_profit=('profit', lambda x: x.std() if len(x) > 1 else 0)
-            )
-            .round(2)
-            .reset_index()
+        job_type = filtered['job_type']
+        if 'Unknown' not in job_type.cat.categories:
+            job_type = job_type.cat.add_categories('Unknown')
+        filtered = filtered.assign(job_type=job_type.fillna('Unknown'))
+        # Built-in mean/std run vectorized; single-row groups report a std of 0
+        grouped = filtered.groupby(['country', 'product', 'job_type'], observed=True)
+        stats = grouped.agg(
+            mean_sales_count=('quantity', 'mean'),
+            std_sales_count=('quantity', 'std'),
+            mean_revenue=('revenue', 'mean'),
+            std_revenue=('revenue', 'std'),
+            mean_profit=('profit', 'mean'),
+            std_profit=('profit', 'std')
         )
+        single = grouped.size() < 2
+        stats.loc[single, ['std_sales_count', 'std_revenue', 'std_profit']] = 0
+        stats = stats.round(2).reset_index()
         return stats.to_dict(orient='records')
     except Exception:
         return []
 
-def get_salesperson_performance(df, start_date, end_date, countries):
+def get_salesperson_performance(filtered):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, countries)
         if filtered.empty:
             return []
         YEARLY_TARGET = 120000
@@ -484,7 +545,7 @@ def get_salesperson_performance(df, start_date, end_date, countries):
         grouped = (
             filtered
             .reset_index()
-            .groupby(['salesperson_id', 'salesperson_name', 'country'])
+            .groupby(['salesperson_id', 'salesperson_name', 'country'], observed=True)
             .agg(
                 sales_count=('quantity', 'sum'),
                 revenue=('revenue', 'sum'),
@@ -493,11 +554,11 @@ def get_salesperson_performance(df, start_date, end_date, countries):
             .reset_index()
         )
         grouped['yearly_target_achieved'] = (grouped['revenue'] / YEARLY_TARGET * 100).round(2)
-        filtered['month'] = filtered.index.to_period('M')
+        filtered = filtered.assign(month=filtered.index.to_period('M'))
         monthly = (
             filtered
             .reset_index()
-            .groupby(['salesperson_id', 'salesperson_name', 'month'])
+            .groupby(['salesperson_id', 'salesperson_name', 'month'], observed=True)
             .agg(
                 monthly_sales_count=('quantity', 'sum'),
                 monthly_revenue=('revenue', 'sum')
@@ -507,7 +568,7 @@ def get_salesperson_performance(df, start_date, end_date, countries):
         monthly['monthly_target_achieved'] = (monthly['monthly_revenue'] / MONTHLY_TARGET * 100).round(2)
         monthly_stats = (
             monthly
-            .groupby(['salesperson_id', 'salesperson_name'])
+            .groupby(['salesperson_id', 'salesperson_name'], observed=True)
             .agg(
                 mean_monthly_sales=('monthly_sales_count', 'mean'),
                 std_monthly_sales=('monthly_sales_count', 'std'),
@@ -517,7 +578,7 @@ def get_salesperson_performance(df, start_date, end_date, countries):
             .round(2)
             .reset_index()
         )
-        latest_month = monthly.groupby('salesperson_id')['month'].max().reset_index()
+        latest_month = monthly.groupby('salesperson_id', observed=True)['month'].max().reset_index()
         monthly_latest = monthly.merge(latest_month, on=['salesperson_id', 'month'])
         grouped = grouped.merge(
             monthly_latest[['salesperson_id', 'monthly_target_achieved']],
@@ -539,19 +600,17 @@ def get_salesperson_performance(df, start_date, end_date, countries):
     except Exception:
         return []
 
-def get_salesperson_comparison(df, start_date, end_date, countries):
+def get_salesperson_comparison(filtered):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, countries)
         if filtered.empty:
             return {"individuals": [], "team": [], "team_stats": []}
         YEARLY_TARGET = 120000
         TEAM_YEARLY_TARGET = YEARLY_TARGET * 10
-        filtered['year'] = filtered.index.year
+        filtered = filtered.assign(year=filtered.index.year)
         individual = (
             filtered
             .reset_index()
-            .groupby(['year', 'salesperson_id', 'salesperson_name', 'country'])
+            .groupby(['year', 'salesperson_id', 'salesperson_name', 'country'], observed=True)
             .agg(
                 sales_count=('quantity', 'sum'),
                 revenue=('revenue', 'sum'),
@@ -575,7 +634,7 @@ def get_salesperson_comparison(df, start_date, end_date, countries):
         team_stats = (
             filtered
             .reset_index()
-            .groupby(['year', 'salesperson_id'])
+            .groupby(['year', 'salesperson_id'], observed=True)
             .agg(
                 sales_count=('quantity', 'sum'),
                 revenue=('revenue', 'sum')
@@ -599,6 +658,35 @@ def get_salesperson_comparison(df, start_date, end_date, countries):
     except Exception:
         return {"individuals": [], "team": [], "team_stats": []}
 
+def compute_dashboard_snapshot(df, start_date, end_date, countries, country_index=None):
+    # Filter once per rerun and let every panel share the sale/web partitions
+    filtered = filter_df(df, start_date, end_date, countries, country_index=country_index)
+    if filtered.empty:
+        sales = web = filtered = df.iloc[0:0]
+    else:
+        event_type = filtered['event_type']
+        sales = filtered[event_type == 'sale']
+        web = filtered[event_type == 'web']
+    events = web[web['url'].isin(TARGET_URLS)]
+    url_counts = events['url'].value_counts()
+    by_country_product = group_country_product(sales)
+    return {
+        "sales": get_sales(by_country_product),
+        "web_events": get_web_events(web, events),
+        "metrics": get_metrics(sales, url_counts),
+        "stats": get_stats(filtered),
+        "software_sales": get_software_sales(sales),
+        "conversion_funnel": get_conversion_funnel(sales, web, url_counts),
+        "trends": get_trends(sales),
+        "sales_by_channel": get_sales_by_channel(sales),
+        "profit_margin": get_profit_margin(by_country_product),
+        "top_customers": get_top_customers(sales),
+        "web_trends": get_web_trends(web, events, start_date, end_date),
+        "sales_stats": get_sales_stats(sales),
+        "salesperson_performance": get_salesperson_performance(sales),
+        "salesperson_comparison": get_salesperson_comparison(sales),
+    }
+
 # --- Helpers ---
 def country_to_iso3(name):
     try:
@@ -732,26 +820,29 @@ with st.sidebar:
     }
 
 # --- Data Loading ---
-sales = get_sales(df, params["start_date"], params["end_date"], params["countries"]) or []
+snapshot = compute_dashboard_snapshot(
+    df, params["start_date"], params["end_date"], params["countries"], load_country_index()
+)
+sales = snapshot["sales"] or []
 df_sales = pd.DataFrame(sales)
 if not df_sales.empty:
     df_sales = df_sales[df_sales["product"].isin(sel_products)]
 
-web = get_web_events(df, params["start_date"], params["end_date"], params["countries"]) or []
+web = snapshot["web_events"] or []
 df_web = pd.DataFrame(web)
 
-metrics = get_metrics(df, params["start_date"], params["end_date"], params["countries"]) or {}
-stats_data = get_stats(df, params["start_date"], params["end_date"], params["countries"]) or []
-software_sales = get_software_sales(df, params["start_date"], params["end_date"], params["countries"]) or {}
-funnel = get_conversion_funnel(df, params["start_date"], params["end_date"], params["countries"]) or {}
-trends = get_trends(df, params["start_date"], params["end_date"], params["countries"]) or []
-sales_by_channel = get_sales_by_channel(df, params["start_date"], params["end_date"], params["countries"]) or []
-profit_margin = get_profit_margin(df, params["start_date"], params["end_date"], params["countries"]) or []
-top_customers = get_top_customers(df, params["start_date"], params["end_date"], params["countries"]) or []
-web_trends = get_web_trends(df, params["start_date"], params["end_date"], params["countries"]) or []
-sales_stats = get_sales_stats(df, params["start_date"], params["end_date"], params["countries"]) or []
-salesperson_performance = get_salesperson_performance(df, params["start_date"], params["end_date"], params["countries"]) or []
-salesperson_comparison = get_salesperson_comparison(df, params["start_date"], params["end_date"], params["countries"]) or {}
+metrics = snapshot["metrics"] or {}
+stats_data = snapshot["stats"] or []
+software_sales = snapshot["software_sales"] or {}
+funnel = snapshot["conversion_funnel"] or {}
+trends = snapshot["trends"] or []
+sales_by_channel = snapshot["sales_by_channel"] or []
+profit_margin = snapshot["profit_margin"] or []
+top_customers = snapshot["top_customers"] or []
+web_trends = snapshot["web_trends"] or []
+sales_stats = snapshot["sales_stats"] or []
+salesperson_performance = snapshot["salesperson_performance"] or []
+salesperson_comparison = snapshot["salesperson_comparison"] or {}
 
 # --- Main App ---
 st.title(f"AI Solutions Analytics Dashboard - {st.session_state.user_role}")
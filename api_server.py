@@ -1,10 +1,41 @@
-from fastapi import FastAPI, Query, HTTPException
+from fastapi import FastAPI, Query, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Match
+from typing import List, Optional, Tuple
+from cachetools import TTLCache
+from dataclasses import dataclass, replace
 from datetime import datetime
+import asyncio
+import base64
+import collections
+import contextvars
+import csv
+import functools
+import gc
+import glob
+import hashlib
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+import weakref
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 import uvicorn
 import logging
+try:
+    import orjson
+except ImportError:  # optional; JSON encoding falls back to the json module
+    orjson = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -12,38 +43,1293 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI()
 DATA_CSV_PATH = "combined_data.csv"
+# Preprocessed columnar copy of DATA_CSV_PATH, rebuilt when the CSV changes
+DATA_CACHE_PATH = "combined_data.parquet"
+CACHE_FINGERPRINT_KEY = b"pd_dashboard.source"
+# Bump whenever preprocess/apply_schema change what the cache holds
+CACHE_SCHEMA_VERSION = 2
 
-# Enable CORS for frontend
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+# In-memory schema applied at load. Dimension columns are low-cardinality and
+# become categoricals; per-row prices and ratios fit in float32, while the
+# revenue/cost/profit columns that get summed stay float64.
+CATEGORY_COLUMNS = [
+    'event_type', 'country', 'product', 'channel', 'job_type',
+    'url', 'salesperson_id', 'salesperson_name'
+]
+FLOAT32_COLUMNS = ['price', 'unit_cost', 'profit_margin']
+
+# "memory" keeps every event row. "streaming" reads the CSV in chunks and keeps
+# only day-grain aggregates, for exports that no longer fit in RAM.
+DATA_LOAD_MODE = os.environ.get("DATA_LOAD_MODE", "memory")
+STREAM_CHUNK_ROWS = int(os.environ.get("STREAM_CHUNK_ROWS", "500000"))
+# Customers kept per day and country for /api/top_customers in streaming mode
+STREAM_TOP_CUSTOMERS = int(os.environ.get("STREAM_TOP_CUSTOMERS", "20"))
+# Customers kept per day and country in memory mode. /api/top_customers ranks
+# these partial totals and only falls back to a scan of every sale when they
+# cannot settle the top N.
+TOP_CUSTOMERS_PER_DAY = int(os.environ.get("TOP_CUSTOMERS_PER_DAY", "50"))
+# HyperLogLog sketches of customer_id behind /api/unique_customers and
+# /api/unique_visitors use 2**HLL_PRECISION registers; counts have a relative
+# standard error of about 1.04 / sqrt(2**HLL_PRECISION), 1.6% at 12.
+HLL_PRECISION = int(os.environ.get("HLL_PRECISION", "12"))
+# Seconds between checks for rows appended to DATA_CSV_PATH; 0 disables live reload
+DATA_RELOAD_INTERVAL = float(os.environ.get("DATA_RELOAD_INTERVAL", "5"))
+# Leading bytes hashed to tell an appended file from a replaced one
+SOURCE_HEAD_BYTES = 64 * 1024
+# When set (memory mode), the preprocessed rows live in this uncompressed Arrow
+# IPC file and every worker memory-maps it read-only instead of holding its own
+# copy. The first worker to ingest appended rows writes just them to a segment
+# file next to it, and every worker maps that as well (see extend_shared_dataset).
+SHARED_DATASET_PATH = os.environ.get("SHARED_DATASET_PATH", "")
+SHARED_LAYOUT_KEY = b"pd_dashboard.partitions"
+SHARED_SEGMENT_KEY = b"pd_dashboard.segment"
+# Segment rows are copied into each worker, so past this many segments an
+# append merges them back into the base file, which maps without copying
+SHARED_MAX_SEGMENTS = int(os.environ.get("SHARED_MAX_SEGMENTS", "8"))
+# Worker processes forked by serve() after the master loads the data once
+SERVER_WORKERS = int(os.environ.get("SERVER_WORKERS", "1"))
+SERVER_HOST = os.environ.get("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.environ.get("SERVER_PORT", "8000"))
+# A worker that dies within WORKER_MIN_UPTIME seconds of starting is replaced
+# after WORKER_RESTART_DELAY, doubling with each such death in a row up to
+# WORKER_RESTART_MAX_DELAY; after WORKER_MAX_FAILURES in a row serve() gives up
+WORKER_MIN_UPTIME = float(os.environ.get("WORKER_MIN_UPTIME", "10"))
+WORKER_RESTART_DELAY = float(os.environ.get("WORKER_RESTART_DELAY", "0.5"))
+WORKER_RESTART_MAX_DELAY = float(os.environ.get("WORKER_RESTART_MAX_DELAY", "30"))
+WORKER_MAX_FAILURES = int(os.environ.get("WORKER_MAX_FAILURES", "5"))
+# Arrow-backed strings stay in the mapped buffers instead of becoming Python objects
+ARROW_STRING_TYPES = {
+    pa.string(): pd.ArrowDtype(pa.string()),
+    pa.large_string(): pd.ArrowDtype(pa.large_string()),
+}
+
+# Endpoint results are cached per data version and normalized filter. The
+# cache is bounded by the approximate JSON size of its entries; 0 disables it.
+RESPONSE_CACHE_BYTES = int(os.environ.get("RESPONSE_CACHE_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", "300"))
+# Opt-in per-request profiling: ?profile=1 or an X-Profile: 1 header returns a
+# Server-Timing stage breakdown; "sample" also writes a sampled stack profile
+# (collapsed-stack format) to PROFILE_DIR. Ignored unless PROFILING_ENABLED.
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "") == "1"
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.005"))
+# Rows per page when a paginated endpoint gets a cursor but no limit
+DEFAULT_PAGE_SIZE = 1000
+# Admission control for the pandas-heavy handlers, per worker process. Requests
+# take ENDPOINT_WEIGHTS units (default 1) out of COMPUTE_CAPACITY while they
+# run; at most COMPUTE_QUEUE_LIMIT wait, and the rest get a 503.
+COMPUTE_CAPACITY = int(os.environ.get("COMPUTE_CAPACITY", str(os.cpu_count() or 4)))
+COMPUTE_QUEUE_LIMIT = int(os.environ.get("COMPUTE_QUEUE_LIMIT", "32"))
+COMPUTE_RETRY_AFTER = int(os.environ.get("COMPUTE_RETRY_AFTER", "1"))
+# Weight 0 bypasses admission entirely
+ENDPOINT_WEIGHTS = {
+    '/api/countries': 0,
+    '/api/cache': 0,
+    '/api/sales_stats': 2,
+    '/api/salesperson_performance': 3,
+    '/api/salesperson_comparison': 3,
+    '/api/batch': 4,
+}
+
+@dataclass(frozen=True)
+class KpiIndex:
+    """Running KPI_MEASURES totals per country over the sorted day axis.
+
+    sums[c, d] holds country c's totals over days[:d], so the totals of any
+    run of whole days are sums[c, hi] - sums[c, lo]. The last row holds
+    events without a country.
+    """
+    days: pd.DatetimeIndex
+    countries: pd.Index
+    sums: np.ndarray
+
+@dataclass(frozen=True)
+class Dataset:
+    """One published version of the data.
+
+    Endpoints read the per-event-type partitions rather than masking the full
+    frame on every request. A new version is built off to the side and swapped
+    in with a single assignment, so a handler that reads `dataset` once sees a
+    consistent snapshot.
+    """
+    version: str
+    sales: pd.DataFrame
+    web: pd.DataFrame
+    # True in streaming mode, where sales and web are the day-grain cubes:
+    # a window then selects every whole day it touches (see day_window)
+    day_grain: bool
+    # Source for /api/top_customers: the largest customer totals per day and
+    # country (see top_customers_per_day), and per day and country a bound on
+    # the revenue of any customer left out
+    customers: pd.DataFrame
+    customer_residuals: pd.DataFrame
+    # Day-grain HyperLogLog sketches of customer_id (hll_sketch) in sales and
+    # in web events, for the distinct-count endpoints
+    customer_sketch: pd.DataFrame
+    visitor_sketch: pd.DataFrame
+    # Built from the cubes; answers the KPI endpoints for whole days
+    kpi_index: KpiIndex
+    # Per-country trend measures summed per period, one frame per
+    # TREND_GRANULARITIES entry; also built from the cubes
+    sale_rollups: dict
+    web_rollups: dict
+    # Day-grain cubes (aggregate_sales/aggregate_web) answering the aggregate
+    # endpoints; in streaming mode they are the partitions themselves
+    sale_cube: pd.DataFrame
+    web_cube: pd.DataFrame
+    # CSV header, and how many bytes of DATA_CSV_PATH have been ingested
+    columns: Tuple[str, ...]
+    source_offset: int
+    source_head: str
+
+# Load and preprocess data once on startup; the watcher publishes appended rows
+dataset: Dataset
+# Serializes writers of `dataset` (startup and the reload watcher)
+_publish_lock = threading.Lock()
+_reload_stop = threading.Event()
+# Set by serve() once the master has published `dataset` before forking
+_preloaded = False
+
+# Per-process instrumentation, served at /metrics in the Prometheus text format
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def metric_sample(name: str, label_names: Tuple[str, ...], labels: Tuple, value) -> str:
+    if not label_names:
+        return f"{name} {value}"
+    pairs = ','.join(f'{label}="{value}"' for label, value in zip(label_names, labels))
+    return f"{name}{{{pairs}}} {value}"
+
+class Counter:
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, labels: Tuple, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def expose(self) -> List[str]:
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"] + [
+            metric_sample(self.name, self.label_names, labels, value) for labels, value in values
+        ]
+
+class Histogram:
+    """Cumulative-bucket histogram per label combination."""
+    def __init__(self, name: str, help_text: str, label_names: Tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        # labels -> [per-bucket counts, count, sum]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels: Tuple, value: float) -> None:
+        with self.lock:
+            state = self.series.setdefault(labels, [[0] * len(self.buckets), 0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += 1
+            state[2] += value
+
+    def expose(self) -> List[str]:
+        with self.lock:
+            series = sorted((labels, (list(counts), count, total)) for labels, (counts, count, total) in self.series.items())
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        bucket_labels = self.label_names + ('le',)
+        for labels, (counts, count, total) in series:
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(metric_sample(f"{self.name}_bucket", bucket_labels, labels + (bound,), bucket_count))
+            lines.append(metric_sample(f"{self.name}_bucket", bucket_labels, labels + ('+Inf',), count))
+            lines.append(metric_sample(f"{self.name}_sum", self.label_names, labels, total))
+            lines.append(metric_sample(f"{self.name}_count", self.label_names, labels, count))
+        return lines
+
+REQUEST_SECONDS = Histogram('pd_dashboard_request_seconds', 'Request latency by endpoint.', ('endpoint',))
+REQUESTS = Counter('pd_dashboard_requests_total', 'Requests by endpoint and status code.', ('endpoint', 'status'))
+STAGE_SECONDS = Histogram(
+    'pd_dashboard_stage_seconds',
+    'Time per computed request in filter_df, in aggregation (everything else) and in serialization.',
+    ('endpoint', 'stage')
+)
+ROWS_SCANNED = Counter('pd_dashboard_rows_scanned_total', 'Rows inside the date slices read by filter_df.', ('endpoint',))
+ROWS_RETURNED = Counter('pd_dashboard_rows_returned_total', 'Result rows produced by computed requests.', ('endpoint',))
+LOAD_SECONDS = Histogram(
+    'pd_dashboard_load_seconds', 'Duration of full loads and appended-row ingests.', ('kind',),
+    buckets=(0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
 )
+# filter_df time and rows, accumulated for the compute running on this thread
+_stage_local = threading.local()
+# Stage timings of a profiled request. Context variables follow the request
+# into the threadpool that runs its handler.
+profile_trace = contextvars.ContextVar('profile_trace', default=None)
+
+def record_stage(name: str, seconds: float) -> None:
+    trace = profile_trace.get()
+    if trace is not None:
+        trace['stages'].append((name, seconds))
+
+class StackSampler:
+    """Samples the stacks of a few threads until stopped.
+
+    Each sample becomes one line of the collapsed-stack format
+    ('role;outer;...;inner count') read by flame graph tools.
+    """
+    def __init__(self, threads: dict, interval: float):
+        # role -> thread ident
+        self.threads = threads
+        self.interval = interval
+        self.counts = collections.Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for role, ident in self.threads.items():
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.counts[';'.join([role] + stack[::-1])] += 1
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def dump(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'w') as fh:
+            for stack, count in self.counts.most_common():
+                fh.write(f"{stack} {count}\n")
+
+# Column projections kept for each partition
+SALE_COLUMNS = [
+    'country', 'product', 'price', 'unit_cost', 'quantity', 'channel', 'job_type',
+    'customer_id', 'salesperson_id', 'salesperson_name',
+    'revenue', 'cost', 'profit', 'profit_margin'
+]
+WEB_COLUMNS = ['country', 'job_type', 'url', 'status', 'user_agent', 'customer_id']
+# Dimensions kept by the day-grain aggregates (see aggregate_events)
+SALE_KEYS = ['country', 'product', 'channel', 'job_type', 'salesperson_id', 'salesperson_name']
+WEB_KEYS = ['country', 'job_type', 'url']
+# Dimensions of the distinct-customer sketches of sales and of web events
+CUSTOMER_SKETCH_KEYS = ['country', 'product']
+VISITOR_SKETCH_KEYS = ['country']
+# Totals behind /api/metrics, /api/software_sales and /api/conversion_funnel,
+# kept as running sums per country and day (see KpiIndex)
+SOFTWARE_PRODUCTS = ["AI Assistant", "Smart Prototype", "Analytics Suite"]
+KPI_URLS = {
+    'demo_requests': '/request-demo',
+    'promo_requests': '/promotional-event',
+    'ai_requests': '/ai-assistant',
+}
+KPI_MEASURES = ['sales', 'revenue', 'profit', 'software_sales', 'software_revenue', 'web_visits', *KPI_URLS]
+# Period frequencies of the rollups behind /api/trends and /api/web_trends.
+# Periods are labelled with their last day, as resample labels them.
+TREND_GRANULARITIES = {'day': 'D', 'week': 'W-SUN', 'month': 'M', 'quarter': 'Q-DEC', 'year': 'Y-DEC'}
+SALE_TREND_MEASURES = ['revenue', 'profit']
+# Web trend columns and the URL each one counts
+WEB_TREND_URLS = {
+    'ai_assistant': '/ai-assistant',
+    'promotional_event': '/promotional-event',
+    'request_demo': '/request-demo',
+}
+
+def preprocess(raw: pd.DataFrame) -> pd.DataFrame:
+    # Ensure numeric types
+    raw['price'] = pd.to_numeric(raw['price'], errors='coerce').fillna(0)
+    raw['unit_cost'] = pd.to_numeric(raw['unit_cost'], errors='coerce').fillna(0)
+    raw['quantity'] = pd.to_numeric(raw['quantity'], errors='coerce').fillna(0)
+    # Compute P&L
+    raw['revenue'] = raw['price'] * raw['quantity']
+    raw['cost'] = raw['unit_cost'] * raw['quantity']
+    raw['profit'] = raw['revenue'] - raw['cost']
+    raw['profit_margin'] = raw['profit'] / raw['revenue'].replace({0: 1})
+    # Optimize with index
+    raw.set_index('timestamp', inplace=True)
+    # filter_df relies on a sorted index to slice date windows
+    return raw.sort_index(kind='stable')
+
+def apply_schema(data: pd.DataFrame) -> pd.DataFrame:
+    for col in CATEGORY_COLUMNS:
+        data[col] = data[col].astype('category')
+    for col in FLOAT32_COLUMNS:
+        data[col] = data[col].astype('float32')
+    # int32 rather than int8/int16: groupby sums keep the column dtype
+    if (data['quantity'] % 1 == 0).all():
+        data['quantity'] = data['quantity'].astype('int32')
+    data['status'] = pd.to_numeric(data['status'], errors='coerce').round().astype('Int16')
+    return data
+
+def memory_report(before: pd.Series, after: pd.Series) -> pd.DataFrame:
+    """Bytes per column before/after apply_schema, from DataFrame.memory_usage(deep=True)."""
+    report = pd.DataFrame({'before_bytes': before, 'after_bytes': after}).fillna(0).astype('int64')
+    report.loc['total'] = report.sum()
+    report['ratio'] = (report['after_bytes'] / report['before_bytes'].replace({0: 1})).round(3)
+    return report
+
+def file_digest(path: str, limit: Optional[int] = None, start: int = 0) -> str:
+    """blake2b of `limit` bytes of path from offset `start` (the rest of the file by default)."""
+    digest = hashlib.blake2b(digest_size=16)
+    remaining = os.path.getsize(path) - start if limit is None else limit
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        while remaining > 0:
+            block = fh.read(min(1 << 20, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+def is_complete_row(tail: bytes, fields: int) -> bool:
+    """True if `tail`, the bytes after the last newline, hold a whole row."""
+    return bool(tail.strip()) and len(next(csv.reader([tail.decode('utf-8', errors='replace')]))) >= fields
+
+def complete_size(path: str, fields: int) -> int:
+    """Size of path up to the end of its last complete row, ignoring a partly written one.
+
+    A final row without a newline counts as complete once it has all `fields`
+    fields; with fewer it is still being written and is left to the watcher.
+    """
+    with open(path, 'rb') as fh:
+        size = end = fh.seek(0, os.SEEK_END)
+        last = 0
+        while end > 0:
+            start = max(0, end - (1 << 16))
+            fh.seek(start)
+            newline = fh.read(end - start).rfind(b'\n')
+            if newline >= 0:
+                last = start + newline + 1
+                break
+            end = start
+        fh.seek(last)
+        tail = fh.read(size - last)
+    return size if is_complete_row(tail, fields) else last
+
+class PrefixReader(io.RawIOBase):
+    """Read-only view of the first `limit` bytes of a binary file."""
+
+    def __init__(self, fh, limit: int):
+        self._fh = fh
+        self._remaining = limit
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self._remaining <= 0:
+            return 0
+        count = self._fh.readinto(memoryview(buffer)[:self._remaining]) or 0
+        self._remaining -= count
+        return count
+
+def read_csv_prefix(path: str, size: int, **kwargs):
+    """pd.read_csv over the first `size` bytes, leaving rows appended meanwhile to the watcher."""
+    fh = open(path, 'rb')
+    try:
+        result = pd.read_csv(io.BufferedReader(PrefixReader(fh, size)), encoding='utf-8', **kwargs)
+    except Exception:
+        fh.close()
+        raise
+    if kwargs.get('chunksize') is None:
+        fh.close()
+        return result
+    return _close_after(result, fh)
+
+def _close_after(chunks, fh):
+    with fh, chunks:
+        yield from chunks
+
+def read_rows(columns: Tuple[str, ...], start: int, end: int) -> pd.DataFrame:
+    """Preprocessed rows of DATA_CSV_PATH between byte offsets `start` and `end`, which fall on row boundaries."""
+    with open(DATA_CSV_PATH, 'rb') as fh:
+        fh.seek(start)
+        block = fh.read(end - start)
+    rows = pd.read_csv(
+        io.BytesIO(block), names=list(columns), header=None, parse_dates=["timestamp"], encoding='utf-8'
+    )
+    return apply_schema(preprocess(rows))
+
+def source_fingerprint(csv_path: str, size: int, mtime_ns: int) -> dict:
+    return {
+        'schema': CACHE_SCHEMA_VERSION,
+        'size': size,
+        'mtime_ns': mtime_ns,
+        'digest': file_digest(csv_path, size),
+    }
+
+def source_matches(csv_path: str, metadata: Optional[dict], size: int) -> bool:
+    """True if schema metadata written by source_fingerprint describes the first `size` bytes of csv_path."""
+    source = json.loads((metadata or {}).get(CACHE_FINGERPRINT_KEY, b'{}'))
+    if source.get('schema') != CACHE_SCHEMA_VERSION or source.get('size') != size:
+        return False
+    # A touched or copied file keeps its content hash; only re-hash when mtime moved
+    return (source.get('mtime_ns') == os.stat(csv_path).st_mtime_ns
+            or source.get('digest') == file_digest(csv_path, size))
+
+def read_cached_frame(csv_path: str, cache_path: str, size: int) -> Optional[pd.DataFrame]:
+    """Return the cached frame if it was built from the first `size` bytes of the CSV, else None."""
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        if not source_matches(csv_path, pq.read_schema(cache_path).metadata, size):
+            return None
+        return pq.read_table(cache_path).to_pandas()
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable data cache {cache_path}: {str(e)}")
+        return None
+
+def write_cached_frame(data: pd.DataFrame, csv_path: str, cache_path: str, size: int, mtime_ns: int) -> None:
+    source = source_fingerprint(csv_path, size, mtime_ns)
+    table = pa.Table.from_pandas(data)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        CACHE_FINGERPRINT_KEY: json.dumps(source).encode('utf-8'),
+    })
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        logger.warning(f"Could not write data cache {cache_path}: {str(e)}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def partition_events(data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Split the preprocessed frame into column-projected sale and web frames.
+
+    Boolean selection keeps row order, so both partitions stay sorted by timestamp.
+    """
+    event_type = data['event_type']
+    return (
+        data.loc[event_type == 'sale', SALE_COLUMNS],
+        data.loc[event_type == 'web', WEB_COLUMNS],
+    )
+
+def shared_table(data: pd.DataFrame, metadata: dict) -> pa.Table:
+    """The preprocessed rows as one record batch, grouped by event type.
+
+    A stable sort keeps each event type in time order, so each partition is a
+    contiguous slice that maps without copying; SHARED_LAYOUT_KEY records where.
+    """
+    ordered = data.sort_values('event_type', kind='stable')
+    event_type = ordered['event_type'].to_numpy()
+    layout = {}
+    for name in ('sale', 'web'):
+        positions = np.flatnonzero(event_type == name)
+        layout[name] = [int(positions[0]), len(positions)] if len(positions) else [0, 0]
+    # A single record batch keeps every column in one contiguous buffer
+    table = pa.Table.from_pandas(ordered).combine_chunks()
+    return table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        **metadata,
+        SHARED_LAYOUT_KEY: json.dumps(layout).encode('utf-8'),
+    })
+
+def write_ipc_file(table: pa.Table, path: str) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, path)
+
+def segment_path(start: int) -> str:
+    """The segment of SHARED_DATASET_PATH holding the rows appended from byte `start` of the CSV."""
+    return f"{SHARED_DATASET_PATH}.{start}.seg"
+
+def remove_segments() -> None:
+    for path in glob.glob(f"{glob.escape(SHARED_DATASET_PATH)}.*.seg"):
+        os.remove(path)
+
+def write_shared_dataset(data: pd.DataFrame, csv_path: str, path: str, size: int, mtime_ns: int) -> None:
+    """Write the preprocessed rows as the uncompressed Arrow IPC base file for memory-mapping."""
+    write_ipc_file(shared_table(data, {
+        CACHE_FINGERPRINT_KEY: json.dumps(source_fingerprint(csv_path, size, mtime_ns)).encode('utf-8'),
+    }), path)
+
+def write_shared_segment(rows: pd.DataFrame, start: int, end: int) -> None:
+    """Write the rows of CSV bytes `start` to `end` as a segment extending SHARED_DATASET_PATH."""
+    segment = {'start': start, 'size': end, 'digest': file_digest(DATA_CSV_PATH, end - start, start)}
+    write_ipc_file(shared_table(rows, {SHARED_SEGMENT_KEY: json.dumps(segment).encode('utf-8')}), segment_path(start))
+
+def shared_covered(table: pa.Table) -> int:
+    """How many CSV bytes a mapped base file or segment takes the rows up to."""
+    metadata = table.schema.metadata
+    return json.loads(metadata.get(SHARED_SEGMENT_KEY) or metadata[CACHE_FINGERPRINT_KEY])['size']
+
+def open_shared_files() -> List[pa.Table]:
+    """The mapped base file followed by the chain of segments that extends it."""
+    tables = [pa.ipc.open_file(pa.memory_map(SHARED_DATASET_PATH, 'r')).read_all()]
+    while os.path.exists(segment_path(shared_covered(tables[-1]))):
+        tables.append(pa.ipc.open_file(pa.memory_map(segment_path(shared_covered(tables[-1])), 'r')).read_all())
+    return tables
+
+def shared_partition(tables: List[pa.Table], name: str) -> pa.Table:
+    """Every row of one event type across the mapped files, in time order."""
+    pieces = []
+    for table in tables:
+        start, length = json.loads(table.schema.metadata[SHARED_LAYOUT_KEY])[name]
+        pieces.append(table.slice(start, length))
+    # Files written apart can widen a dictionary's index type differently
+    return pa.concat_tables(pieces, promote_options='permissive')
+
+def map_shared_dataset(tables: List[pa.Table]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Sale and web partitions backed by read-only memory maps of the shared files.
+
+    With the base file alone, numeric, timestamp and string columns stay in
+    the mapped pages and only the small categorical codes are copied into the
+    process. Rows from segments are concatenated to it in process memory.
+    """
+    def partition(name: str, columns: List[str]) -> pd.DataFrame:
+        frame = (
+            shared_partition(tables, name)
+            .select([*columns, 'timestamp'])
+            .to_pandas(split_blocks=True, types_mapper=ARROW_STRING_TYPES.get)
+        )
+        # The CSV is appended in time order, but a late row must not break the sort
+        return frame if frame.index.is_monotonic_increasing else frame.sort_index(kind='stable')
+    return partition('sale', SALE_COLUMNS), partition('web', WEB_COLUMNS)
+
+def compact_shared_dataset(tables: List[pa.Table]) -> None:
+    """Merge the base file and its segments into a new base file and drop the segments.
+
+    Rows go from the mapped files straight into the new file, without a
+    pandas copy of the whole dataset.
+    """
+    partitions = []
+    for name in ('sale', 'web'):
+        partition = shared_partition(tables, name)
+        timestamps = partition.column('timestamp')
+        if len(partition) > 1 and pc.any(pc.less(timestamps[1:], timestamps[:-1])).as_py():
+            partition = partition.take(pc.sort_indices(partition, [('timestamp', 'ascending')]))
+        partitions.append(partition)
+    size = shared_covered(tables[-1])
+    sales = len(partitions[0])
+    table = pa.concat_tables(partitions, promote_options='permissive').combine_chunks()
+    table = table.replace_schema_metadata({
+        **tables[0].schema.metadata,
+        CACHE_FINGERPRINT_KEY: json.dumps(source_fingerprint(
+            DATA_CSV_PATH, size, os.stat(DATA_CSV_PATH).st_mtime_ns
+        )).encode('utf-8'),
+        SHARED_LAYOUT_KEY: json.dumps({'sale': [0, sales], 'web': [sales, len(table) - sales]}).encode('utf-8'),
+    })
+    write_ipc_file(table, SHARED_DATASET_PATH)
+    remove_segments()
+    logger.info(f"Compacted shared dataset {SHARED_DATASET_PATH} ({len(tables) - 1} segments)")
+
+def shared_files_match(tables: List[pa.Table], size: int) -> bool:
+    """True if the base file and segments hold exactly the first `size` bytes of the CSV as it is now."""
+    if shared_covered(tables[-1]) != size:
+        return False
+    if not source_matches(DATA_CSV_PATH, tables[0].schema.metadata, shared_covered(tables[0])):
+        return False
+    for table in tables[1:]:
+        segment = json.loads(table.schema.metadata[SHARED_SEGMENT_KEY])
+        if segment['digest'] != file_digest(DATA_CSV_PATH, segment['size'] - segment['start'], segment['start']):
+            return False
+    return True
+
+def shared_dataset_lock():
+    """The lock file serializing writers of SHARED_DATASET_PATH, locked; closing it unlocks."""
+    import fcntl
+    lock = open(f"{SHARED_DATASET_PATH}.lock", 'a')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+def load_shared_partitions(size: int, mtime_ns: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Map SHARED_DATASET_PATH and its segments, rebuilding the base file first if the CSV changed.
+
+    Workers starting together serialize on a lock file: the first one builds
+    the file and the rest map it as soon as it is in place.
+    """
+    with shared_dataset_lock():
+        try:
+            tables = open_shared_files() if os.path.exists(SHARED_DATASET_PATH) else None
+            fresh = tables is not None and shared_files_match(tables, size)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable shared dataset {SHARED_DATASET_PATH}: {str(e)}")
+            fresh = False
+        if not fresh:
+            write_shared_dataset(read_preprocessed(size, mtime_ns), DATA_CSV_PATH, SHARED_DATASET_PATH, size, mtime_ns)
+            remove_segments()
+            logger.info(f"Wrote shared dataset {SHARED_DATASET_PATH}")
+            tables = open_shared_files()
+        return map_shared_dataset(tables)
+
+def extend_shared_dataset(columns: Tuple[str, ...], size: int) -> Tuple[int, Tuple[pd.DataFrame, pd.DataFrame]]:
+    """Map the shared files once they hold at least the first `size` bytes of the CSV.
+
+    The first worker to get here writes only the appended rows, as a segment
+    next to the base file; the rest find the segment and map it too. Once
+    there would be more than SHARED_MAX_SEGMENTS, that worker compacts them
+    into the base file instead. Returns how many bytes the mapped files hold,
+    which is more than `size` if another worker already ingested further.
+    """
+    with shared_dataset_lock():
+        tables = open_shared_files()
+        covered = shared_covered(tables[-1])
+        if covered < size:
+            write_shared_segment(read_rows(columns, covered, size), covered, size)
+            logger.info(f"Extended shared dataset {SHARED_DATASET_PATH} to {size} bytes")
+            tables = open_shared_files()
+            if len(tables) - 1 > SHARED_MAX_SEGMENTS:
+                compact_shared_dataset(tables)
+                tables = open_shared_files()
+            covered = size
+        return covered, map_shared_dataset(tables)
+
+def sum_by_day(frame: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Sum the non-key columns per calendar day and key combination.
+
+    The result keeps the day as a sorted 'timestamp' index so filter_df works on it.
+    """
+    frame = frame.set_axis(frame.index.normalize().rename('timestamp'))
+    summed = frame.groupby(['timestamp', *keys], observed=True, dropna=False, sort=False).sum()
+    return summed.reset_index(level=keys).sort_index(kind='stable')
+
+def summable_quantity(sales: pd.DataFrame) -> pd.Series:
+    quantity = sales['quantity']
+    return quantity.astype('int64' if pd.api.types.is_integer_dtype(quantity) else 'float64')
+
+def aggregate_sales(sales: pd.DataFrame) -> pd.DataFrame:
+    """Day-grain sale cube: one row per day and SALE_KEYS combination.
+
+    Every measure is a plain sum ('rows' counts events, *_sq are sums of squares
+    for mean/std), so cubes over disjoint rows combine with sum_by_day.
+    """
+    quantity = summable_quantity(sales)
+    price = sales['price'].astype('float64')
+    return sum_by_day(sales[SALE_KEYS].assign(
+        rows=1,
+        quantity=quantity,
+        revenue=sales['revenue'],
+        cost=sales['cost'],
+        profit=sales['profit'],
+        profit_margin=sales['profit_margin'].astype('float64'),
+        price=price,
+        price_sq=price ** 2,
+        quantity_sq=quantity ** 2,
+        revenue_sq=sales['revenue'] ** 2,
+        profit_sq=sales['profit'] ** 2
+    ), SALE_KEYS)
+
+def aggregate_web(web: pd.DataFrame) -> pd.DataFrame:
+    """Day-grain web cube: event counts per day and WEB_KEYS combination."""
+    return sum_by_day(web[WEB_KEYS].assign(rows=1), WEB_KEYS)
+
+def aggregate_customers(sales: pd.DataFrame) -> pd.DataFrame:
+    customers = sales[['country', 'customer_id']].assign(quantity=summable_quantity(sales), revenue=sales['revenue'])
+    return sum_by_day(customers, ['country', 'customer_id'])
+
+def leading_zeros(values: np.ndarray) -> np.ndarray:
+    """Leading zero bits of each uint64, by binary search over the word."""
+    count = np.zeros(len(values), dtype=np.uint8)
+    values = values.copy()
+    for width in (32, 16, 8, 4, 2, 1):
+        clear = (values >> np.uint64(64 - width)) == 0
+        count[clear] += width
+        values[clear] <<= np.uint64(width)
+    return count + (values == 0)
+
+def hll_registers(rows: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """The HyperLogLog register and rank each row's customer_id sets, with `keys`.
+
+    Any set of these rows is a valid, if redundant, sketch: distinct_counts
+    keeps the largest rank per register.
+    """
+    rows = rows[rows['customer_id'].notna()]
+    hashed = pd.util.hash_array(rows['customer_id'].to_numpy(dtype=object))
+    # The top bits pick the register; the rank is the position of the first
+    # set bit in the rest
+    register = (hashed >> np.uint64(64 - HLL_PRECISION)).astype(np.uint16)
+    rank = np.minimum(leading_zeros(hashed << np.uint64(HLL_PRECISION)), 64 - HLL_PRECISION) + 1
+    return rows[keys].assign(register=register, rank=rank.astype(np.uint8))
+
+def hll_sketch(rows: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Sparse HyperLogLog sketch of customer_id per day and `keys` combination.
 
-# Load and preprocess data once on startup
-df: pd.DataFrame
+    One row per register that any customer set, holding the largest rank seen.
+    Sketches of any rows merge by taking the largest rank per register
+    (merge_sketches), so the day-grain sketches answer any window of days.
+    """
+    registers = hll_registers(rows, keys)
+    return merge_sketches(registers.set_axis(registers.index.normalize().rename('timestamp')), keys)
+
+def merge_sketches(sketch: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    merged = sketch.groupby(['timestamp', *keys, 'register'], observed=True, dropna=False, sort=False)['rank'].max()
+    return merged.reset_index(level=[*keys, 'register']).sort_index(kind='stable')
+
+def sketch_events(sales: pd.DataFrame, web: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Distinct-customer sketches of the sale and web partitions."""
+    return hll_sketch(sales, CUSTOMER_SKETCH_KEYS), hll_sketch(web, VISITOR_SKETCH_KEYS)
+
+def max_ranks(keys: np.ndarray, rank: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """The distinct register keys and the largest rank seen for each."""
+    order = np.lexsort((rank, keys))
+    keys, rank = keys[order], rank[order]
+    last = np.append(keys[1:] != keys[:-1], True)
+    return keys[last], rank[last]
+
+def hll_estimate(group: np.ndarray, rank: np.ndarray, groups: int) -> np.ndarray:
+    """Distinct counts per group from its set registers (max_ranks output).
+
+    Registers no row set hold 0 and are never materialized. Uses linear
+    counting while a sketch is sparse; with 64-bit hashes no large-range
+    correction is needed.
+    """
+    m = 1 << HLL_PRECISION
+    alpha = 0.7213 / (1 + 1.079 / m)
+    zeros = m - np.bincount(group, minlength=groups)
+    harmonic = zeros + np.bincount(group, weights=np.exp2(-rank.astype('float64')), minlength=groups)
+    raw = alpha * m * m / harmonic
+    with np.errstate(divide='ignore'):
+        linear = m * np.log(m / zeros)
+    return np.where((raw <= 2.5 * m) & (zeros > 0), linear, raw)
+
+def kpi_measures(sales: pd.DataFrame, web: pd.DataFrame) -> pd.DataFrame:
+    """KPI_MEASURES of each sale and web row, raw or cube, with its country."""
+    sale_count = sales['rows'].astype('float64') if is_aggregated(sales) else pd.Series(1.0, index=sales.index)
+    web_count = web['rows'].astype('float64') if is_aggregated(web) else pd.Series(1.0, index=web.index)
+    software = sales['product'].isin(SOFTWARE_PRODUCTS)
+    measures = [
+        pd.DataFrame({
+            'country': sales['country'].astype(object),
+            'sales': sale_count,
+            'revenue': sales['revenue'],
+            'profit': sales['profit'],
+            'software_sales': sale_count.where(software, 0.0),
+            'software_revenue': sales['revenue'].where(software, 0.0),
+        }),
+        pd.DataFrame({
+            'country': web['country'].astype(object),
+            'web_visits': web_count,
+            **{name: web_count.where(web['url'] == url, 0.0) for name, url in KPI_URLS.items()},
+        }),
+    ]
+    measures = pd.concat([frame for frame in measures if len(frame)] or measures[:1])
+    return measures.fillna({name: 0.0 for name in KPI_MEASURES}).reindex(columns=['country', *KPI_MEASURES], fill_value=0.0)
+
+def kpi_totals(sales: pd.DataFrame, web: pd.DataFrame) -> np.ndarray:
+    """KPI_MEASURES summed over raw sale and web rows."""
+    software = sales['product'].isin(SOFTWARE_PRODUCTS).to_numpy()
+    revenue = sales['revenue'].to_numpy()
+    return np.array([
+        len(sales), revenue.sum(), sales['profit'].sum(), software.sum(), revenue[software].sum(),
+        len(web), *((web['url'] == url).sum() for url in KPI_URLS.values())
+    ], dtype='float64')
+
+def kpi_grid(measures: pd.DataFrame, days: pd.DatetimeIndex, countries: pd.Index) -> np.ndarray:
+    """kpi_measures rows summed per country and day, laid out like KpiIndex.sums but not accumulated."""
+    codes = countries.get_indexer(measures['country'])
+    codes = np.where(codes < 0, len(countries), codes)
+    cells = codes * len(days) + days.get_indexer(measures.index)
+    shape = (len(countries) + 1, len(days))
+    grid = np.empty((*shape, len(KPI_MEASURES)))
+    for i, name in enumerate(KPI_MEASURES):
+        grid[:, :, i] = np.bincount(cells, weights=measures[name].to_numpy(), minlength=shape[0] * shape[1]).reshape(shape)
+    return grid
+
+def build_kpi_index(sale_cube: pd.DataFrame, web_cube: pd.DataFrame) -> KpiIndex:
+    measures = kpi_measures(sale_cube, web_cube)
+    days = measures.index.unique().sort_values()
+    countries = pd.Index(pd.factorize(measures['country'], sort=True)[1])
+    sums = np.zeros((len(countries) + 1, len(days) + 1, len(KPI_MEASURES)))
+    sums[:, 1:] = kpi_grid(measures, days, countries)
+    np.cumsum(sums, axis=1, out=sums)
+    return KpiIndex(days=days, countries=countries, sums=sums)
+
+def extend_kpi_index(index: KpiIndex, sale_cube: pd.DataFrame, web_cube: pd.DataFrame,
+                     first_day: Optional[pd.Timestamp]) -> KpiIndex:
+    """`index` with the running totals from `first_day` on summed again from the cubes.
+
+    Totals of earlier days are kept, so an append costs the days it touches.
+    """
+    if first_day is None:
+        return index
+    first_day = first_day.normalize()
+    measures = kpi_measures(
+        sale_cube.iloc[sale_cube.index.searchsorted(first_day):],
+        web_cube.iloc[web_cube.index.searchsorted(first_day):]
+    )
+    keep = index.days.searchsorted(first_day)
+    days = index.days[:keep].append(measures.index.unique().sort_values())
+    added = pd.Index(measures['country'].dropna().unique()).difference(index.countries)
+    countries = index.countries.append(added)
+    # Rows of new countries start at zero, ahead of the last row for events without a country
+    prefix = np.insert(index.sums[:, :keep + 1], [len(index.countries)] * len(added), 0.0, axis=0)
+    tail = kpi_grid(measures, days[keep:], countries)
+    # Carried in before accumulating, so the sums add up in the order a rebuild would
+    tail[:, 0] += prefix[:, -1]
+    np.cumsum(tail, axis=1, out=tail)
+    return KpiIndex(days=days, countries=countries, sums=np.concatenate([prefix, tail], axis=1))
+
+def period_labels(index: pd.DatetimeIndex, freq: str) -> pd.DatetimeIndex:
+    """The label of the period each timestamp falls in: its last day."""
+    return index.to_period(freq).end_time.normalize()
+
+def period_range(first: pd.Timestamp, last: pd.Timestamp, freq: str) -> pd.DatetimeIndex:
+    """Labels of every period from the one holding `first` to the one holding `last`."""
+    return pd.period_range(first.to_period(freq), last.to_period(freq), freq=freq).end_time.normalize().rename('timestamp')
+
+def sale_trend_measures(sales: pd.DataFrame) -> pd.DataFrame:
+    return sales[['country', *SALE_TREND_MEASURES]]
+
+def web_trend_measures(web: pd.DataFrame) -> pd.DataFrame:
+    """Web event count and target URL counts of web cube rows, with their country."""
+    return web[['country', 'rows']].assign(**{
+        name: web['rows'].where(web['url'] == url, 0) for name, url in WEB_TREND_URLS.items()
+    })
+
+def sum_by_period(frame: pd.DataFrame, freq: str) -> pd.DataFrame:
+    """Sum the measures per period and country, indexed by period label like sum_by_day."""
+    frame = frame.set_axis(period_labels(frame.index, freq).rename('timestamp'))
+    summed = frame.groupby(['timestamp', 'country'], observed=True, dropna=False, sort=False).sum()
+    return summed.reset_index(level='country').sort_index(kind='stable')
+
+def build_rollups(measures: pd.DataFrame) -> dict:
+    """Rollups of day-grain measures; coarser periods are summed from the day rollup, which is smaller."""
+    day = sum_by_period(measures, TREND_GRANULARITIES['day'])
+    return {name: day if name == 'day' else sum_by_period(day, freq) for name, freq in TREND_GRANULARITIES.items()}
+
+def extend_rollups(rollups: dict, cube: pd.DataFrame, measures, first_day: Optional[pd.Timestamp]) -> dict:
+    """`rollups` with every period from the one holding `first_day` on summed again from `cube`.
+
+    `measures` turns cube rows into the trend measures. Earlier periods are
+    kept as they are, so an append costs the periods it touches.
+    """
+    if first_day is None:
+        return rollups
+
+    def extend(name: str, source: pd.DataFrame) -> pd.DataFrame:
+        freq = TREND_GRANULARITIES[name]
+        start = first_day.to_period(freq).start_time
+        old = rollups[name]
+        touched = sum_by_period(source.iloc[source.index.searchsorted(start):], freq)
+        return concat_events(old.iloc[:old.index.searchsorted(start)], touched)
+
+    # As in build_rollups, coarser periods are summed from the day rollup
+    day = extend('day', measures(cube.iloc[cube.index.searchsorted(first_day.normalize()):]))
+    return {name: day if name == 'day' else extend(name, day) for name in TREND_GRANULARITIES}
+
+def aggregate_events(data: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, Tuple[pd.DataFrame, pd.DataFrame]]:
+    """Sale cube, web cube, per-day customer totals and distinct-customer sketches for a preprocessed frame."""
+    sales, web = partition_events(data)
+    return aggregate_sales(sales), aggregate_web(web), aggregate_customers(sales), sketch_events(sales, web)
+
+def apply_cube_schema(cube: pd.DataFrame, keys: List[str]) -> pd.DataFrame:
+    """Categorical key columns, whichever dtype the summed keys came back with."""
+    return cube.astype({key: 'category' for key in keys})
+
+def top_customers_per_day(customers: pd.DataFrame, limit: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """The `limit` largest customer totals per day and country, and the residuals.
+
+    The residual of a day and country is the revenue of the largest total left
+    out, so no customer dropped there lost more than that. Only days and
+    countries that dropped anyone have a residual row.
+    """
+    ranked = customers.sort_values('revenue', ascending=False, kind='stable')
+    rank = ranked.groupby([ranked.index, 'country'], observed=True, dropna=False).cumcount().to_numpy()
+    kept = ranked[rank < limit].sort_index(kind='stable')
+    residuals = ranked.loc[rank == limit, ['country', 'revenue']].rename(columns={'revenue': 'residual'})
+    residuals['residual'] = residuals['residual'].clip(lower=0)
+    return kept, residuals.sort_index(kind='stable')
+
+def merge_residuals(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """Residuals of successive trims add up: each trim can only drop up to its residual."""
+    return sum_by_day(pd.concat([old, new]), ['country'])
+
+def stream_aggregates(csv_path: str, size: int):
+    """Read the first `size` bytes of csv_path in chunks and keep only day-grain aggregates.
+
+    Returns the sale cube, the web cube, the (customer totals, residuals) pair
+    and the (customer, visitor) sketch pair, as build_dataset takes them.
+
+    Memory is bounded by days x dimension combinations, not by the row count.
+    Customer totals are trimmed to the top STREAM_TOP_CUSTOMERS per day and
+    country after every chunk, so a customer whose same-day sales straddle a
+    chunk boundary can be under-counted; the summed residuals of the trims
+    bound by how much.
+    """
+    sales_agg = web_agg = customers_agg = residuals_agg = sketches_agg = None
+    rows = 0
+    for chunk in read_csv_prefix(csv_path, size, parse_dates=["timestamp"], chunksize=STREAM_CHUNK_ROWS):
+        rows += len(chunk)
+        sales, web, customers, sketches = aggregate_events(apply_schema(preprocess(chunk)))
+        if sales_agg is None:
+            sales_agg, web_agg, customers_agg, sketches_agg = sales, web, customers, sketches
+        else:
+            # Chunks carry their own categories; the merged keys fall back to object until the end
+            sales_agg = sum_by_day(pd.concat([sales_agg, sales]), SALE_KEYS)
+            web_agg = sum_by_day(pd.concat([web_agg, web]), WEB_KEYS)
+            customers_agg = sum_by_day(pd.concat([customers_agg, customers]), ['country', 'customer_id'])
+            sketches_agg = tuple(
+                merge_sketches(pd.concat([old, new]), keys)
+                for old, new, keys in zip(sketches_agg, sketches, (CUSTOMER_SKETCH_KEYS, VISITOR_SKETCH_KEYS))
+            )
+        customers_agg, residuals = top_customers_per_day(customers_agg, STREAM_TOP_CUSTOMERS)
+        residuals_agg = residuals if residuals_agg is None else merge_residuals(residuals_agg, residuals)
+    if sales_agg is None:
+        raise ValueError(f"No rows in {csv_path}")
+    sales_agg = apply_cube_schema(sales_agg, SALE_KEYS)
+    web_agg = apply_cube_schema(web_agg, WEB_KEYS)
+    customers_agg = apply_cube_schema(customers_agg, ['country'])
+    residuals_agg = apply_cube_schema(residuals_agg, ['country'])
+    sketches_agg = (
+        apply_cube_schema(sketches_agg[0], CUSTOMER_SKETCH_KEYS),
+        apply_cube_schema(sketches_agg[1], VISITOR_SKETCH_KEYS),
+    )
+    logger.info(
+        f"Streamed {rows} rows into {len(sales_agg)} sale, {len(web_agg)} web "
+        f"and {len(customers_agg)} customer aggregate rows"
+    )
+    return sales_agg, web_agg, (customers_agg, residuals_agg), sketches_agg
+
+def is_aggregated(data: pd.DataFrame) -> bool:
+    """True for streaming-mode frames, which hold day-grain sums with a 'rows' count."""
+    return 'rows' in data.columns
+
+def event_count(data: pd.DataFrame) -> int:
+    return int(data['rows'].sum()) if is_aggregated(data) else int(data.shape[0])
+
+def moment_std(count: pd.Series, total: pd.Series, total_sq: pd.Series) -> pd.Series:
+    """Sample standard deviation from count, sum and sum of squares (NaN below 2 rows, like Series.std)."""
+    variance = (total_sq - total ** 2 / count) / (count - 1)
+    return variance.clip(lower=0).pow(0.5).where(count > 1)
+
+def moment_stats(moments: pd.DataFrame, measures: dict) -> pd.DataFrame:
+    """mean_<name>/std_<name> columns from summed 'rows', <column> and <column>_sq moments.
+
+    `measures` maps each output name to its cube column; the index is kept.
+    """
+    n = moments['rows']
+    stats = {}
+    for name, column in measures.items():
+        stats[f'mean_{name}'] = moments[column] / n
+        stats[f'std_{name}'] = moment_std(n, moments[column], moments[f'{column}_sq'])
+    return pd.DataFrame(stats, index=moments.index)
+
+def concat_events(old: pd.DataFrame, new: pd.DataFrame) -> pd.DataFrame:
+    """Append rows to a timestamp-sorted frame, keeping categorical columns and the sort order."""
+    widened = {}
+    for col in old.columns:
+        if isinstance(old[col].dtype, pd.CategoricalDtype):
+            added = pd.Index(new[col].dropna().unique()).difference(old[col].cat.categories)
+            widened[col] = old[col].cat.add_categories(added) if len(added) else old[col]
+    old = old.assign(**widened)
+    new = new.assign(**{col: new[col].astype(object).astype(old[col].dtype) for col in widened})
+    # Empty frames are left out: their dtypes would stop deciding the result's in pandas 3
+    merged = pd.concat([frame for frame in (old, new) if len(frame)] or [old])
+    if len(old) and len(new) and new.index.min() < old.index[-1]:
+        merged = merged.sort_index(kind='stable')
+    return merged
+
+def build_dataset(sales: pd.DataFrame, web: pd.DataFrame,
+                  columns: Tuple[str, ...], offset: int,
+                  sale_cube: Optional[pd.DataFrame] = None,
+                  web_cube: Optional[pd.DataFrame] = None,
+                  customers: Optional[Tuple[pd.DataFrame, pd.DataFrame]] = None,
+                  sketches: Optional[Tuple[pd.DataFrame, pd.DataFrame]] = None,
+                  rollups: Optional[Tuple[dict, dict]] = None,
+                  kpi_index: Optional[KpiIndex] = None) -> Dataset:
+    """Assemble a Dataset, building whichever aggregates are not given from the partitions.
+
+    `customers` is a (top customers, residuals) pair from top_customers_per_day,
+    `sketches` a (customer, visitor) pair from sketch_events, `rollups` a
+    (sale, web) pair from build_rollups.
+    """
+    day_grain = is_aggregated(sales)
+    if day_grain:
+        sale_cube, web_cube = sales, web
+    if sale_cube is None:
+        sale_cube = apply_cube_schema(aggregate_sales(sales), SALE_KEYS)
+    if web_cube is None:
+        web_cube = apply_cube_schema(aggregate_web(web), WEB_KEYS)
+    if customers is None:
+        customers = top_customers_per_day(aggregate_customers(sales), TOP_CUSTOMERS_PER_DAY)
+    customers, customer_residuals = customers
+    if sketches is None:
+        sketches = sketch_events(sales, web)
+    customer_sketch, visitor_sketch = sketches
+    if rollups is None:
+        rollups = build_rollups(sale_trend_measures(sale_cube)), build_rollups(web_trend_measures(web_cube))
+    sale_rollups, web_rollups = rollups
+    if kpi_index is None:
+        kpi_index = build_kpi_index(sale_cube, web_cube)
+    head = file_digest(DATA_CSV_PATH, min(offset, SOURCE_HEAD_BYTES))
+    # Derived from the ingested bytes, so every process serving the same data agrees on it
+    return Dataset(
+        version=f"{head[:12]}-{offset}",
+        sales=sales,
+        web=web,
+        day_grain=day_grain,
+        customers=customers,
+        customer_residuals=customer_residuals,
+        customer_sketch=customer_sketch,
+        visitor_sketch=visitor_sketch,
+        kpi_index=kpi_index,
+        sale_rollups=sale_rollups,
+        web_rollups=web_rollups,
+        sale_cube=sale_cube,
+        web_cube=web_cube,
+        columns=columns,
+        source_offset=offset,
+        source_head=head,
+    )
+
+def append_sketches(current: Dataset, sketches: Tuple[pd.DataFrame, pd.DataFrame]) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    return (
+        merge_sketches(concat_events(current.customer_sketch, sketches[0]), CUSTOMER_SKETCH_KEYS),
+        merge_sketches(concat_events(current.visitor_sketch, sketches[1]), VISITOR_SKETCH_KEYS),
+    )
+
+def append_rollups(current: Dataset, sale_cube: pd.DataFrame, web_cube: pd.DataFrame,
+                   new_sales: pd.DataFrame, new_web: pd.DataFrame) -> Tuple[dict, dict]:
+    """The rollups of `current` extended over the periods the new sale and web events touch."""
+    return (
+        extend_rollups(current.sale_rollups, sale_cube, sale_trend_measures,
+                       new_sales.index.min() if len(new_sales) else None),
+        extend_rollups(current.web_rollups, web_cube, web_trend_measures,
+                       new_web.index.min() if len(new_web) else None),
+    )
+
+def append_rows(current: Dataset, rows: pd.DataFrame, offset: int,
+                partitions: Optional[Tuple[pd.DataFrame, pd.DataFrame]] = None) -> Dataset:
+    """A new Dataset with preprocessed `rows` merged into `current` and its aggregates.
+
+    `partitions` are (sales, web) partitions that already hold `rows`, as
+    extend_shared_dataset maps them; otherwise `rows` are appended to the
+    current ones.
+    """
+    if DATA_LOAD_MODE == 'streaming':
+        sales, web, customers, sketches = aggregate_events(rows)
+        customers = sum_by_day(concat_events(current.customers, customers), ['country', 'customer_id'])
+        customers, residuals = top_customers_per_day(customers, STREAM_TOP_CUSTOMERS)
+        sale_cube = sum_by_day(concat_events(current.sales, sales), SALE_KEYS)
+        web_cube = sum_by_day(concat_events(current.web, web), WEB_KEYS)
+        return build_dataset(
+            sale_cube, web_cube, current.columns, offset,
+            customers=(customers, merge_residuals(current.customer_residuals, residuals)),
+            sketches=append_sketches(current, sketches),
+            rollups=append_rollups(current, sale_cube, web_cube, sales, web),
+            kpi_index=extend_kpi_index(current.kpi_index, sale_cube, web_cube, rows.index.min() if len(rows) else None),
+        )
+    new_sales, new_web = partition_events(rows)
+    if partitions is None:
+        partitions = concat_events(current.sales, new_sales), concat_events(current.web, new_web)
+    sales, web = partitions
+    customers = current.customers, current.customer_residuals
+    if len(new_sales):
+        # Customer totals of the days the new rows touch are ranked again from all of their rows
+        first_day = new_sales.index.min().normalize()
+        kept, residuals = top_customers_per_day(
+            aggregate_customers(sales.iloc[sales.index.searchsorted(first_day):]), TOP_CUSTOMERS_PER_DAY
+        )
+        customers = tuple(
+            concat_events(old.iloc[:old.index.searchsorted(first_day)], new)
+            for old, new in zip(customers, (kept, residuals))
+        )
+    sale_cube = sum_by_day(concat_events(current.sale_cube, aggregate_sales(new_sales)), SALE_KEYS)
+    web_cube = sum_by_day(concat_events(current.web_cube, aggregate_web(new_web)), WEB_KEYS)
+    return build_dataset(
+        sales, web, current.columns, offset,
+        sale_cube=sale_cube,
+        web_cube=web_cube,
+        customers=customers,
+        sketches=append_sketches(current, sketch_events(new_sales, new_web)),
+        rollups=append_rollups(current, sale_cube, web_cube, new_sales, new_web),
+        kpi_index=extend_kpi_index(current.kpi_index, sale_cube, web_cube, rows.index.min() if len(rows) else None),
+    )
+
+def read_preprocessed(size: int, mtime_ns: int) -> pd.DataFrame:
+    """The preprocessed frame for the first `size` bytes of the CSV, via the Parquet cache when fresh."""
+    data = read_cached_frame(DATA_CSV_PATH, DATA_CACHE_PATH, size)
+    if data is not None:
+        logger.info(f"Data loaded from cache {DATA_CACHE_PATH}")
+        return data
+    data = preprocess(read_csv_prefix(DATA_CSV_PATH, size, parse_dates=["timestamp"]))
+    before = data.memory_usage(deep=True)
+    apply_schema(data)
+    logger.info(f"Memory by column:\n{memory_report(before, data.memory_usage(deep=True)).to_string()}")
+    write_cached_frame(data, DATA_CSV_PATH, DATA_CACHE_PATH, size, mtime_ns)
+    logger.info("Data loaded successfully")
+    return data
+
+def load_dataset() -> Dataset:
+    columns = tuple(pd.read_csv(DATA_CSV_PATH, nrows=0, encoding='utf-8').columns)
+    # Only complete rows are parsed; anything past `size` is left to the watcher
+    mtime_ns = os.stat(DATA_CSV_PATH).st_mtime_ns
+    size = complete_size(DATA_CSV_PATH, len(columns))
+    if DATA_LOAD_MODE == 'streaming':
+        sales, web, customers, sketches = stream_aggregates(DATA_CSV_PATH, size)
+        logger.info("Data loaded successfully (streaming aggregates)")
+        return build_dataset(sales, web, columns, size, customers=customers, sketches=sketches)
+    if SHARED_DATASET_PATH:
+        sales, web = load_shared_partitions(size, mtime_ns)
+        logger.info(f"Data mapped from {SHARED_DATASET_PATH}")
+    else:
+        sales, web = partition_events(read_preprocessed(size, mtime_ns))
+    return build_dataset(sales, web, columns, size)
+
+def publish(new: Dataset) -> None:
+    global dataset
+    index_countries(new)
+    dataset = new
+    # Keys carry the version, so older entries could never be hit again
+    clear_response_cache()
+    logger.info(f"Published data version {new.version}")
+
+def refresh_dataset() -> bool:
+    """Ingest rows appended to DATA_CSV_PATH since the current version.
+
+    Only the new byte range is parsed, up to its last complete row (see
+    complete_size). A file that shrank or whose leading bytes changed was
+    replaced, and is reloaded in full, as is one whose last ingested row had no
+    newline and has since grown. Returns True if a new version was published.
+    """
+    with _publish_lock:
+        current = dataset
+        size = os.path.getsize(DATA_CSV_PATH)
+        if size == current.source_offset:
+            return False
+        if (size < current.source_offset
+                or file_digest(DATA_CSV_PATH, min(current.source_offset, SOURCE_HEAD_BYTES)) != current.source_head):
+            logger.info(f"{DATA_CSV_PATH} was replaced; reloading")
+            started = time.perf_counter()
+            publish(load_dataset())
+            LOAD_SECONDS.observe(('full',), time.perf_counter() - started)
+            return True
+        started = time.perf_counter()
+        with open(DATA_CSV_PATH, 'rb') as fh:
+            fh.seek(current.source_offset - 1)
+            last = fh.read(1)
+            block = fh.read(size - current.source_offset)
+        if last != b'\n' and not block.startswith(b'\n'):
+            # The version ended in a row without a newline, and that row has grown since
+            logger.info(f"The last row of {DATA_CSV_PATH} was extended; reloading")
+            publish(load_dataset())
+            LOAD_SECONDS.observe(('full',), time.perf_counter() - started)
+            return True
+        end = block.rfind(b'\n') + 1
+        if is_complete_row(block[end:], len(current.columns)):
+            end = len(block)
+        if not block[:end].strip():
+            # Only part of a row so far
+            return False
+        offset, partitions = current.source_offset + end, None
+        if SHARED_DATASET_PATH and DATA_LOAD_MODE != 'streaming':
+            offset, partitions = extend_shared_dataset(current.columns, offset)
+        rows = read_rows(current.columns, current.source_offset, offset)
+        logger.info(f"Ingesting {len(rows)} appended rows")
+        publish(append_rows(current, rows, offset, partitions))
+        LOAD_SECONDS.observe(('append',), time.perf_counter() - started)
+        return True
+
+def watch_source() -> None:
+    while not _reload_stop.wait(DATA_RELOAD_INTERVAL):
+        try:
+            refresh_dataset()
+        except Exception as e:
+            logger.error(f"Failed to ingest appended data: {str(e)}")
+
+def arrow_strings(data: pd.DataFrame) -> pd.DataFrame:
+    """Object string columns as Arrow strings: a few shared buffers instead of
+    one Python object per value, whose refcounts would dirty every page."""
+    columns = {name: data[name].astype(ARROW_STRING_TYPES[pa.string()])
+               for name in data.columns if data[name].dtype == object}
+    return data.assign(**columns) if columns else data
+
+def preload_dataset() -> Dataset:
+    """load_dataset() with every partition in fork-friendly buffers."""
+    loaded = load_dataset()
+    sales, web = arrow_strings(loaded.sales), arrow_strings(loaded.web)
+    return replace(loaded, sales=sales, web=web, customers=arrow_strings(loaded.customers))
 
 @app.on_event("startup")
 def load_data():
-    global df
     try:
-        df = pd.read_csv(DATA_CSV_PATH, parse_dates=["timestamp"], encoding='utf-8')
-        # Ensure numeric types
-        df['price'] = pd.to_numeric(df['price'], errors='coerce').fillna(0)
-        df['unit_cost'] = pd.to_numeric(df['unit_cost'], errors='coerce').fillna(0)
-        df['quantity'] = pd.to_numeric(df['quantity'], errors='coerce').fillna(0)
-        # Compute P&L
-        df['revenue'] = df['price'] * df['quantity']
-        df['cost'] = df['unit_cost'] * df['quantity']
-        df['profit'] = df['revenue'] - df['cost']
-        df['profit_margin'] = df['profit'] / df['revenue'].replace({0: 1})
-        # Optimize with index
-        df.set_index('timestamp', inplace=True)
-        logger.info("Data loaded successfully")
+        with _publish_lock:
+            started = time.perf_counter()
+            # Forked workers inherit the master's published dataset
+            if not _preloaded:
+                publish(load_dataset())
+                LOAD_SECONDS.observe(('full',), time.perf_counter() - started)
     except Exception as e:
         logger.error(f"Failed to load data: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to load data: {str(e)}")
+    if DATA_RELOAD_INTERVAL > 0:
+        _reload_stop.clear()
+        threading.Thread(target=watch_source, name="data-reload", daemon=True).start()
+
+@app.on_event("shutdown")
+def stop_reload():
+    _reload_stop.set()
+
+def parse_date(value, name: str) -> pd.Timestamp:
+    parsed = pd.to_datetime(value, errors='coerce')
+    if pd.isna(parsed):
+        raise ValueError(f"Invalid {name} format")
+    return parsed
+
+@dataclass(frozen=True)
+class CountryIndex:
+    """Row positions of a frame grouped by country code.
+
+    positions[offsets[c]:offsets[c + 1]] are the rows of category c in
+    ascending order, so the part inside a date slice is found by binary search.
+    """
+    categories: pd.Index
+    positions: np.ndarray
+    offsets: np.ndarray
+
+# id() of each published frame -> its CountryIndex, dropped with the frame
+_country_indexes = {}
+
+def build_country_index(frame: pd.DataFrame) -> CountryIndex:
+    codes = frame['country'].cat.codes.to_numpy()
+    positions = np.argsort(codes, kind='stable').astype(np.int32 if len(frame) < 2 ** 31 else np.int64)
+    # Rows without a country sort first and belong to no category
+    counts = np.bincount(codes[codes >= 0], minlength=len(frame['country'].cat.categories))
+    offsets = np.concatenate([[0], np.cumsum(counts)]) + int((codes < 0).sum())
+    return CountryIndex(frame['country'].cat.categories, positions, offsets)
+
+def index_countries(data: Dataset) -> None:
+    """Build the CountryIndex of every frame in `data` with a categorical country."""
+    frames = []
+    for value in vars(data).values():
+        frames.extend(value.values() if isinstance(value, dict) else [value])
+    for frame in frames:
+        if (isinstance(frame, pd.DataFrame) and 'country' in frame.columns
+                and isinstance(frame['country'].dtype, pd.CategoricalDtype) and id(frame) not in _country_indexes):
+            _country_indexes[id(frame)] = build_country_index(frame)
+            weakref.finalize(frame, _country_indexes.pop, id(frame), None)
+
+def country_rows(index: CountryIndex, countries: List[str], lo: int, hi: int) -> np.ndarray:
+    """Ascending positions in [lo, hi) of the rows in any of `countries`."""
+    codes = index.categories.get_indexer(pd.Index(countries).unique())
+    runs = []
+    for code in codes[codes >= 0]:
+        run = index.positions[index.offsets[code]:index.offsets[code + 1]]
+        runs.append(run[run.searchsorted(lo):run.searchsorted(hi)])
+    if not runs:
+        return index.positions[:0]
+    rows = np.concatenate(runs)
+    if len(runs) > 1:
+        rows.sort()
+    return rows
 
 # Utility: filter by date range and countries
 def filter_df(
@@ -53,519 +1339,1565 @@ def filter_df(
     countries: Optional[List[str]],
     product: Optional[str] = None
 ) -> pd.DataFrame:
+    started = time.perf_counter()
     try:
-        filtered = data.copy()
+        # The index is sorted at load, so the date window is one positional
+        # slice found by binary search; iloc returns a view, not a copy.
+        lo, hi = 0, len(data)
         if start_date:
-            start_date = pd.to_datetime(start_date, errors='coerce')
-            if pd.isna(start_date):
-                raise ValueError("Invalid start_date format")
-            filtered = filtered[filtered.index >= start_date]
+            start_date = parse_date(start_date, 'start_date')
+            lo = data.index.searchsorted(start_date, side='left')
         if end_date:
-            end_date = pd.to_datetime(end_date, errors='coerce')
-            if pd.isna(end_date):
-                raise ValueError("Invalid end_date format")
-            filtered = filtered[filtered.index <= end_date]
-        if countries:
-            filtered = filtered[filtered['country'].isin(countries)]
+            end_date = parse_date(end_date, 'end_date')
+            hi = data.index.searchsorted(end_date, side='right')
+        index = _country_indexes.get(id(data)) if countries else None
+        scanned = max(hi - lo, 0)
+        if index is not None:
+            # Union of the countries' position runs, cut to the date slice
+            filtered = data.iloc[country_rows(index, countries, lo, max(lo, hi))]
+            scanned = len(filtered)
+        else:
+            filtered = data.iloc[lo:max(lo, hi)]
+            # Remaining masks only scan the narrowed slice
+            if countries:
+                filtered = filtered[filtered['country'].isin(countries)]
         if product:
             filtered = filtered[filtered['product'] == product]
+        _stage_local.filter_seconds = getattr(_stage_local, 'filter_seconds', 0.0) + time.perf_counter() - started
+        _stage_local.rows_scanned = getattr(_stage_local, 'rows_scanned', 0) + scanned
         return filtered
     except Exception as e:
         logger.error(f"Error filtering data: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error filtering data: {str(e)}")
 
+def whole_days(start_date: Optional[datetime], end_date: Optional[datetime]):
+    """(start, end, first whole day, exclusive end of the last whole day) of a window."""
+    start = parse_date(start_date, 'start_date') if start_date else None
+    end = parse_date(end_date, 'end_date') if end_date else None
+    first_day = start.ceil('D') if start is not None else None
+    # Query dates have microsecond resolution, so a window ending at
+    # 23:59:59.999999 covers that whole day
+    last_day_end = (end + pd.Timedelta(1, 'us')).floor('D') if end is not None else None
+    return start, end, first_day, last_day_end
+
+def day_window(start_date, end_date):
+    """(start, end) of a window widened to the whole days it touches, the
+    finest window day-grain data can answer."""
+    start = parse_date(start_date, 'start_date').normalize() if start_date else None
+    end = parse_date(end_date, 'end_date').normalize() + pd.Timedelta(1, 'D') - pd.Timedelta(1, 'ns') if end_date else None
+    return start, end
+
+def cube_window(
+    data: Dataset,
+    cube: pd.DataFrame,
+    rows: pd.DataFrame,
+    aggregate,
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+    countries: Optional[List[str]]
+) -> pd.DataFrame:
+    """Day-grain cube rows covering exactly [start_date, end_date].
+
+    Whole days come straight from the cube. Partial days at either edge are
+    re-aggregated from the raw rows with `aggregate`, so results match a scan
+    of the rows. Without raw rows (streaming mode) the window is whole days.
+    """
+    if data.day_grain:
+        return filter_df(cube, *day_window(start_date, end_date), countries)
+    tick = pd.Timedelta(1, 'us')
+    start, end, first_day, last_day_end = whole_days(start_date, end_date)
+    if first_day is not None and last_day_end is not None and first_day >= last_day_end:
+        return aggregate(filter_df(rows, start, end, countries))
+    parts = [filter_df(cube, first_day, last_day_end - tick if last_day_end is not None else None, countries)]
+    if start is not None and start < first_day:
+        parts.append(aggregate(filter_df(rows, start, first_day - pd.Timedelta(1, 'ns'), countries)))
+    if end is not None and end >= last_day_end:
+        parts.append(aggregate(filter_df(rows, last_day_end, end, countries)))
+    parts = [part for part in parts if not part.empty]
+    if len(parts) < 2:
+        return parts[0] if parts else cube.iloc[:0]
+    return pd.concat(parts).sort_index(kind='stable')
+
+def sale_window(data: Dataset, start_date, end_date, countries) -> pd.DataFrame:
+    return cube_window(data, data.sale_cube, data.sales, aggregate_sales, start_date, end_date, countries)
+
+def web_window(data: Dataset, start_date, end_date, countries) -> pd.DataFrame:
+    return cube_window(data, data.web_cube, data.web, aggregate_web, start_date, end_date, countries)
+
+def customer_window(data: Dataset, start_date, end_date, countries) -> pd.DataFrame:
+    return cube_window(data, data.customers, data.sales, aggregate_customers, start_date, end_date, countries)
+
+def customer_sketch_window(data: Dataset, start_date, end_date, countries) -> pd.DataFrame:
+    return cube_window(data, data.customer_sketch, data.sales, lambda rows: hll_registers(rows, CUSTOMER_SKETCH_KEYS),
+                       start_date, end_date, countries)
+
+def visitor_sketch_window(data: Dataset, start_date, end_date, countries) -> pd.DataFrame:
+    return cube_window(data, data.visitor_sketch, data.web, lambda rows: hll_registers(rows, VISITOR_SKETCH_KEYS),
+                       start_date, end_date, countries)
+
+def kpi_window(data: Dataset, start_date, end_date, countries) -> pd.Series:
+    """KPI_MEASURES totals over [start_date, end_date] for the given countries.
+
+    Whole days are two lookups per country in the KpiIndex; partial days at
+    either edge are summed from the raw rows, as in cube_window.
+    """
+    index = data.kpi_index
+    edges = []
+    if data.day_grain:
+        start, end = day_window(start_date, end_date)
+        lo = index.days.searchsorted(start) if start is not None else 0
+        hi = index.days.searchsorted(end, side='right') if end is not None else len(index.days)
+    else:
+        start, end, first_day, last_day_end = whole_days(start_date, end_date)
+        if first_day is not None and last_day_end is not None and first_day >= last_day_end:
+            lo = hi = 0
+            edges.append((start, end))
+        else:
+            lo = index.days.searchsorted(first_day) if first_day is not None else 0
+            hi = index.days.searchsorted(last_day_end) if last_day_end is not None else len(index.days)
+            if start is not None and start < first_day:
+                edges.append((start, first_day - pd.Timedelta(1, 'ns')))
+            if end is not None and end >= last_day_end:
+                edges.append((last_day_end, end))
+    if countries:
+        rows = index.countries.get_indexer(pd.Index(countries).unique())
+        rows = rows[rows >= 0]
+    else:
+        rows = slice(None)
+    totals = (index.sums[rows, max(lo, hi)] - index.sums[rows, lo]).sum(axis=0)
+    for edge_start, edge_end in edges:
+        totals += kpi_totals(
+            filter_df(data.sales, edge_start, edge_end, countries),
+            filter_df(data.web, edge_start, edge_end, countries)
+        )
+    return pd.Series(totals, index=KPI_MEASURES)
+
+def rollup_window(data: Dataset, kind: str, granularity: str, start_date, end_date, countries) -> pd.DataFrame:
+    """Trend measures of a 'sale' or 'web' window summed per period.
+
+    Periods lying wholly inside the window come from the rollups; the partial
+    periods at either edge are summed from the day rollup, with partial days
+    taken from the raw rows as in cube_window, so results match a scan of the
+    rows. Only periods holding events are returned.
+    """
+    freq = TREND_GRANULARITIES[granularity]
+    if kind == 'sale':
+        rollups, rows, measures = data.sale_rollups, data.sales, sale_trend_measures
+    else:
+        rollups, rows = data.web_rollups, data.web
+        measures = lambda web: web_trend_measures(web.assign(rows=1))
+    if data.day_grain:
+        start, end = day_window(start_date, end_date)
+    else:
+        start = parse_date(start_date, 'start_date') if start_date else None
+        end = parse_date(end_date, 'end_date') if end_date else None
+    # Query dates have microsecond resolution, so a window ending at
+    # 23:59:59.999999 covers that whole day
+    tick = pd.Timedelta(1, 'us')
+    first = last = None
+    if start is not None:
+        first = start.to_period(freq)
+        first += int(start > first.start_time)
+    if end is not None:
+        last = end.to_period(freq)
+        last -= int(end + tick <= last.end_time)
+
+    def summed(lo, hi):
+        part = cube_window(data, rollups['day'], rows, measures, lo, hi, countries)
+        return part.set_axis(period_labels(part.index, freq))
+
+    if first is not None and last is not None and first > last:
+        parts = [summed(start, end)]
+    else:
+        parts = [filter_df(
+            rollups[granularity],
+            first.end_time.normalize() if first is not None else None,
+            last.end_time.normalize() if last is not None else None,
+            countries
+        )]
+        if start is not None and start < first.start_time:
+            parts.append(summed(start, first.start_time - pd.Timedelta(1, 'ns')))
+        if end is not None and end > last.end_time:
+            parts.append(summed((last + 1).start_time, end))
+    parts = [part for part in parts if not part.empty]
+    if not parts:
+        return rollups[granularity].iloc[:0].drop(columns='country')
+    return pd.concat(parts).drop(columns='country').groupby(level=0).sum()
+
+def residual_window(data: Dataset, start_date, end_date, countries) -> pd.DataFrame:
+    """Customer residuals of the whole days in a window; partial days are aggregated exactly."""
+    if data.day_grain:
+        return filter_df(data.customer_residuals, *day_window(start_date, end_date), countries)
+    _, _, first_day, last_day_end = whole_days(start_date, end_date)
+    if first_day is not None and last_day_end is not None and first_day >= last_day_end:
+        return data.customer_residuals.iloc[:0]
+    last_day = last_day_end - pd.Timedelta(1, 'us') if last_day_end is not None else None
+    return filter_df(data.customer_residuals, first_day, last_day, countries)
+
+def result_rows(result) -> int:
+    if isinstance(result, (pd.DataFrame, list)):
+        return len(result)
+    if isinstance(result, dict):
+        nested = [value for value in result.values() if isinstance(value, (pd.DataFrame, list))]
+        return sum(len(value) for value in nested) if nested else 1
+    return 0
+
+def instrumented(compute):
+    """Record filter_df vs aggregation time and rows scanned/returned for a compute function."""
+    endpoint = compute.__name__.removeprefix('compute_')
+
+    @functools.wraps(compute)
+    def wrapper(ctx, *args, **kwargs):
+        filter_before = getattr(_stage_local, 'filter_seconds', 0.0)
+        rows_before = getattr(_stage_local, 'rows_scanned', 0)
+        started = time.perf_counter()
+        result = compute(ctx, *args, **kwargs)
+        elapsed = time.perf_counter() - started
+        filter_seconds = getattr(_stage_local, 'filter_seconds', 0.0) - filter_before
+        STAGE_SECONDS.observe((endpoint, 'filter'), filter_seconds)
+        STAGE_SECONDS.observe((endpoint, 'aggregate'), max(elapsed - filter_seconds, 0.0))
+        record_stage(f'{endpoint}-filter', filter_seconds)
+        record_stage(f'{endpoint}-aggregate', max(elapsed - filter_seconds, 0.0))
+        ROWS_SCANNED.inc((endpoint,), getattr(_stage_local, 'rows_scanned', 0) - rows_before)
+        ROWS_RETURNED.inc((endpoint,), result_rows(result))
+        return result
+    return wrapper
+
+class QueryContext:
+    """One filter applied to one dataset version.
+
+    Each window is computed on first use and shared by every metric that reads
+    it, so /api/batch filters once however many metrics it returns.
+    """
+    def __init__(self, data: Dataset, start_date, end_date, country):
+        self.data = data
+        self.start_date = start_date
+        self.end_date = end_date
+        self.country = country
+
+    @functools.cached_property
+    def sale_window(self) -> pd.DataFrame:
+        return sale_window(self.data, self.start_date, self.end_date, self.country)
+
+    @functools.cached_property
+    def web_window(self) -> pd.DataFrame:
+        return web_window(self.data, self.start_date, self.end_date, self.country)
+
+    @functools.cached_property
+    def bounds(self) -> tuple:
+        """The (start, end) that selects this window from the partitions."""
+        if self.data.day_grain:
+            return day_window(self.start_date, self.end_date)
+        return self.start_date, self.end_date
+
+    @functools.cached_property
+    def sales(self) -> pd.DataFrame:
+        return filter_df(self.data.sales, *self.bounds, self.country)
+
+    @functools.cached_property
+    def web(self) -> pd.DataFrame:
+        return filter_df(self.data.web, *self.bounds, self.country)
+
+    @functools.cached_property
+    def customer_window(self) -> pd.DataFrame:
+        return customer_window(self.data, self.start_date, self.end_date, self.country)
+
+    @functools.cached_property
+    def customer_residuals(self) -> pd.DataFrame:
+        return residual_window(self.data, self.start_date, self.end_date, self.country)
+
+    @functools.cached_property
+    def kpis(self) -> pd.Series:
+        return kpi_window(self.data, self.start_date, self.end_date, self.country)
+
+    @functools.cached_property
+    def customer_sketch(self) -> pd.DataFrame:
+        return customer_sketch_window(self.data, self.start_date, self.end_date, self.country)
+
+    @functools.cached_property
+    def visitor_sketch(self) -> pd.DataFrame:
+        return visitor_sketch_window(self.data, self.start_date, self.end_date, self.country)
+
+# Media types negotiated through the Accept header; anything else gets the
+# default records JSON. Columnar JSON maps each column to a list of values;
+# NDJSON streams one row per line.
+COLUMNAR_JSON_TYPE = "application/vnd.pd-dashboard.columns+json"
+ARROW_STREAM_TYPE = "application/vnd.apache.arrow.stream"
+NDJSON_TYPE = "application/x-ndjson"
+RESPONSE_FORMATS = {COLUMNAR_JSON_TYPE: 'columnar', ARROW_STREAM_TYPE: 'arrow', NDJSON_TYPE: 'ndjson'}
+# Rows converted per NDJSON chunk, which bounds the Python objects alive at once
+NDJSON_CHUNK_ROWS = 1000
+# Header carrying the cursor of the next page of a paginated endpoint
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def response_format(request: Request) -> str:
+    """'json', 'columnar', 'arrow' or 'ndjson': the first supported type the client accepts."""
+    for media_range in request.headers.get('accept', '').split(','):
+        media_type = media_range.split(';')[0].strip().lower()
+        if media_type in RESPONSE_FORMATS:
+            return RESPONSE_FORMATS[media_type]
+    return 'json'
+
+def to_records(result):
+    """Endpoint results as plain JSON-ready structures, one dict per frame row."""
+    if isinstance(result, pd.DataFrame):
+        return result.to_dict(orient='records')
+    if isinstance(result, dict):
+        return {key: to_records(value) for key, value in result.items()}
+    return result
+
+def to_columns(result):
+    """Endpoint results with every frame as {column: values}.
+
+    With orjson the values stay numpy arrays, which it serializes without
+    building Python objects; other columns become lists.
+    """
+    if isinstance(result, pd.DataFrame):
+        columns = {}
+        for name, column in result.items():
+            if orjson is not None and column.dtype.kind in 'biufM':
+                columns[str(name)] = np.ascontiguousarray(column.to_numpy())
+            else:
+                columns[str(name)] = column.astype(object).where(column.notna(), None).tolist()
+        return columns
+    if isinstance(result, dict):
+        return {key: to_columns(value) for key, value in result.items()}
+    return result
+
+def json_default(value):
+    """Encode what the JSON encoders cannot: timestamps as ISO strings, anything else via str."""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+def columnar_json(result) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(to_columns(result), option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(to_columns(result), default=json_default).encode()
+
+def arrow_stream(result) -> bytes:
+    """One Arrow IPC stream; a dict of scalars becomes a single-row table."""
+    if isinstance(result, dict):
+        if any(isinstance(value, (dict, list, pd.DataFrame)) for value in result.values()):
+            raise HTTPException(status_code=406, detail="Nested results have no Arrow form; use JSON")
+        result = pd.DataFrame([result])
+    elif not isinstance(result, pd.DataFrame):
+        result = pd.DataFrame(result)
+    table = pa.Table.from_pandas(result, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def json_line(row: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(row, default=json_default) + b'\n'
+    return (json.dumps(row, default=json_default) + '\n').encode()
+
+def frame_lines(frame: pd.DataFrame, extra: Optional[dict] = None):
+    for lo in range(0, len(frame), NDJSON_CHUNK_ROWS):
+        chunk = frame.iloc[lo:lo + NDJSON_CHUNK_ROWS]
+        chunk = chunk.astype(object).where(chunk.notna(), None)
+        yield b''.join(json_line({**(extra or {}), **row}) for row in chunk.to_dict(orient='records'))
+
+def ndjson_lines(result):
+    """NDJSON for an endpoint result, produced NDJSON_CHUNK_ROWS rows at a time.
+
+    Frames yield one line per row. In a dict result each frame row is tagged
+    with a 'section' key naming its entry, and the scalar entries share one line.
+    """
+    if isinstance(result, pd.DataFrame):
+        yield from frame_lines(result)
+        return
+    if isinstance(result, list):
+        yield b''.join(json_line(row) for row in result)
+        return
+    scalars = {key: value for key, value in result.items() if not isinstance(value, (list, pd.DataFrame))}
+    if scalars:
+        yield json_line(scalars)
+    for key, value in result.items():
+        if isinstance(value, pd.DataFrame):
+            yield from frame_lines(value, {'section': key})
+        elif isinstance(value, list):
+            yield b''.join(json_line({'section': key, **row}) for row in value)
+
+def encode_cursor(version: str, offset: int) -> str:
+    token = json.dumps({'v': version, 'o': offset}).encode()
+    return base64.urlsafe_b64encode(token).decode().rstrip('=')
+
+def decode_cursor(cursor: str, version: str) -> int:
+    try:
+        token = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        offset = int(token['o'])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if token.get('v') != version or offset < 0:
+        # Pages of an older data version would not line up with this one
+        raise HTTPException(status_code=409, detail="Cursor refers to an older data version; start again")
+    return offset
+
+def paginate(rows, limit: Optional[int], cursor: Optional[str], version: str):
+    """(page, next cursor) for a frame whose row order is deterministic.
+
+    Without limit and cursor the rows are returned whole; a cursor without a
+    limit pages by DEFAULT_PAGE_SIZE. The cursor is None on the last page.
+    """
+    if limit is None and cursor is None:
+        return rows, None
+    limit = limit or DEFAULT_PAGE_SIZE
+    offset = decode_cursor(cursor, version) if cursor else 0
+    if not isinstance(rows, pd.DataFrame):
+        return rows, None
+    page = rows.iloc[offset:offset + limit]
+    return page, encode_cursor(version, offset + limit) if offset + limit < len(rows) else None
+
+def render(result, request: Request, next_cursor: Optional[str] = None):
+    """Serialize a compute result in the negotiated format, timing the work."""
+    started = time.perf_counter()
+    try:
+        return encode_result(result, request, next_cursor)
+    finally:
+        # Records JSON is encoded by FastAPI after this returns and NDJSON while
+        # streaming, so for those this only covers preparing the rows
+        endpoint = request.url.path.removeprefix('/api/')
+        STAGE_SECONDS.observe((endpoint, 'serialize'), time.perf_counter() - started)
+        record_stage(f'{endpoint}-serialize', time.perf_counter() - started)
+
+def encode_result(result, request: Request, next_cursor: Optional[str]):
+    fmt = response_format(request)
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else None
+    if fmt == 'arrow':
+        return Response(content=arrow_stream(result), media_type=ARROW_STREAM_TYPE, headers=headers)
+    if fmt == 'columnar':
+        return Response(content=columnar_json(result), media_type=COLUMNAR_JSON_TYPE, headers=headers)
+    if fmt == 'ndjson':
+        return StreamingResponse(ndjson_lines(result), media_type=NDJSON_TYPE, headers=headers)
+    if headers:
+        return JSONResponse(content=jsonable_encoder(to_records(result)), headers=headers)
+    return to_records(result)
+
+def response_size(result) -> int:
+    if isinstance(result, Response):
+        return len(result.body)
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(deep=True).sum())
+    if isinstance(result, dict):
+        return sum(response_size(value) for value in result.values())
+    return len(json.dumps(result, default=json_default))
+
+response_cache = TTLCache(maxsize=max(RESPONSE_CACHE_BYTES, 1), ttl=RESPONSE_CACHE_TTL, getsizeof=response_size)
+response_cache_stats = {'hits': 0, 'misses': 0}
+# cachetools caches are not thread-safe and sync handlers run in a threadpool
+_response_cache_lock = threading.Lock()
+
+def clear_response_cache() -> None:
+    with _response_cache_lock:
+        response_cache.clear()
+
+def cache_key_part(value):
+    """Canonical form of one query parameter, so equivalent filters share an entry.
+
+    Country lists are de-duplicated and sorted. Dates become the day when they
+    fall on midnight and a full timestamp otherwise; intra-day times still
+    change the result, so they are never truncated.
+    """
+    if isinstance(value, datetime):
+        value = pd.Timestamp(value)
+        return value.date().isoformat() if value == value.normalize() else value.isoformat()
+    if isinstance(value, (list, tuple)):
+        return tuple(sorted(set(value)))
+    return value
+
+# Parameters that pick a page of a result rather than change it
+PAGE_PARAMS = {'limit', 'cursor'}
+
+def cached_response(handler):
+    """Serve repeated calls of an endpoint from response_cache.
+
+    Entries are keyed by endpoint, data version and normalized parameters.
+    Results computed while a new version was published are not stored.
+    Requests for a page are not cached here: their handlers page from
+    cached_result instead, so every page reads one computed result.
+    """
+    @functools.wraps(handler)
+    def wrapper(**params):
+        trace = profile_trace.get()
+        if trace is not None and trace['sample']:
+            # Sample the thread doing the pandas work as well as the event loop
+            trace['threads']['handler'] = threading.get_ident()
+        if (RESPONSE_CACHE_BYTES <= 0 or trace is not None
+                or any(params.get(name) is not None for name in PAGE_PARAMS)):
+            # A profiled request always measures the real computation
+            return handler(**params)
+        version = dataset.version
+        # The request itself only contributes its negotiated format
+        key = (handler.__name__, version, tuple(sorted(
+            (name, response_format(value) if isinstance(value, Request) else cache_key_part(value))
+            for name, value in params.items() if name not in PAGE_PARAMS
+        )))
+        with _response_cache_lock:
+            result = response_cache.get(key)
+            response_cache_stats['hits' if result is not None else 'misses'] += 1
+        if isinstance(result, Response):
+            headers = {NEXT_CURSOR_HEADER: result.headers[NEXT_CURSOR_HEADER]} if NEXT_CURSOR_HEADER in result.headers else None
+            return Response(content=result.body, media_type=result.media_type, headers=headers)
+        if result is not None:
+            return result
+        result = handler(**params)
+        # A stream has no body to keep; it is produced again on the next call
+        if dataset.version == version and not isinstance(result, StreamingResponse):
+            with _response_cache_lock:
+                try:
+                    response_cache[key] = result
+                except ValueError:
+                    # Larger than the whole cache
+                    pass
+        return result
+    return wrapper
+
+def cached_result(compute, ctx: QueryContext):
+    """compute(ctx) through response_cache, keyed by the data version and filter alone.
+
+    Paginated endpoints page from this, so walking the pages of a result
+    computes it once whatever the limit and cursor.
+    """
+    if RESPONSE_CACHE_BYTES <= 0 or profile_trace.get() is not None:
+        return compute(ctx)
+    key = (compute.__name__, ctx.data.version, tuple(
+        cache_key_part(value) for value in (ctx.start_date, ctx.end_date, ctx.country)
+    ))
+    with _response_cache_lock:
+        result = response_cache.get(key)
+        response_cache_stats['hits' if result is not None else 'misses'] += 1
+    if result is not None:
+        return result
+    result = compute(ctx)
+    if dataset.version == ctx.data.version:
+        with _response_cache_lock:
+            try:
+                response_cache[key] = result
+            except ValueError:
+                # Larger than the whole cache
+                pass
+    return result
+
+def profile_mode(request: Request) -> Optional[str]:
+    """'timing' or 'sample' when the request asks for profiling and it is enabled."""
+    if not PROFILING_ENABLED:
+        return None
+    flag = request.query_params.get('profile') or request.headers.get('x-profile')
+    if not flag or flag.lower() in ('0', 'false'):
+        return None
+    return 'sample' if flag.lower() == 'sample' else 'timing'
+
+@app.middleware("http")
+async def request_profiling(request: Request, call_next):
+    """Attach a Server-Timing stage breakdown, and optionally a stack profile, to one request."""
+    mode = profile_mode(request)
+    if mode is None:
+        return await call_next(request)
+    trace = {'stages': [], 'sample': mode == 'sample', 'threads': {'loop': threading.get_ident()}}
+    token = profile_trace.set(trace)
+    sampler = None
+    if trace['sample']:
+        # The threads dict is shared, so the handler thread joins once it starts
+        sampler = StackSampler(trace['threads'], PROFILE_SAMPLE_INTERVAL)
+        sampler.start()
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        profile_trace.reset(token)
+        if sampler is not None:
+            sampler.stop()
+    stages = trace['stages'] + [('total', time.perf_counter() - started)]
+    response.headers['Server-Timing'] = ', '.join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in stages)
+    if sampler is not None:
+        path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{request.url.path.strip('/').replace('/', '_')}.folded")
+        sampler.dump(path)
+        response.headers['X-Profile-Dump'] = path
+    return response
+
+class AdmissionController:
+    """Weighted FIFO admission for compute-heavy requests on one event loop.
+
+    A request runs once its weight fits in the spare capacity and nobody is
+    queued ahead of it, so a heavy request at the head cannot be overtaken
+    forever. Weights above the capacity are clamped so they can still run alone.
+    """
+    def __init__(self, capacity: int, queue_limit: int):
+        self.capacity = max(capacity, 1)
+        self.queue_limit = queue_limit
+        self.in_use = 0
+        self.rejected = 0
+        self.waiters = collections.deque()
+
+    async def acquire(self, weight: int) -> bool:
+        """Wait for capacity; False when the queue is already full."""
+        if not self.waiters and self.in_use + weight <= self.capacity:
+            self.in_use += weight
+            return True
+        if len(self.waiters) >= self.queue_limit:
+            self.rejected += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append((weight, waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Admitted just as the client went away
+                self.release(weight)
+            else:
+                # _admit_waiters may already have dropped it from the queue
+                if (weight, waiter) in self.waiters:
+                    self.waiters.remove((weight, waiter))
+                self._admit_waiters()
+            raise
+        return True
+
+    def release(self, weight: int) -> None:
+        self.in_use -= weight
+        self._admit_waiters()
+
+    def _admit_waiters(self) -> None:
+        while self.waiters and self.in_use + self.waiters[0][0] <= self.capacity:
+            weight, waiter = self.waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_use += weight
+            waiter.set_result(None)
+
+admission = AdmissionController(COMPUTE_CAPACITY, COMPUTE_QUEUE_LIMIT)
+
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """Queue compute-heavy requests behind COMPUTE_CAPACITY; 503 when the queue is full."""
+    path = request.url.path
+    weight = min(ENDPOINT_WEIGHTS.get(path, 1), admission.capacity) if path.startswith('/api/') else 0
+    if weight == 0:
+        return await call_next(request)
+    if not await admission.acquire(weight):
+        return Response(
+            content=json.dumps({"detail": "Server busy, retry later"}),
+            status_code=503,
+            media_type="application/json",
+            headers={'Retry-After': str(COMPUTE_RETRY_AFTER)}
+        )
+    try:
+        return await call_next(request)
+    finally:
+        admission.release(weight)
+
+# Date query parameters canonicalized for ETags like cache_key_part does
+DATE_PARAMS = {'start_date', 'end_date'}
+# Endpoints whose body changes between identical requests get no ETag
+UNVERSIONED_PATHS = {'/api/cache'}
+
+def response_etag(request: Request, version: str) -> Optional[str]:
+    """Strong ETag for a GET from the data version, its normalized query and format.
+
+    None when a date does not parse; the endpoint then reports the error.
+    """
+    params = {}
+    for name, value in request.query_params.multi_items():
+        if name in DATE_PARAMS:
+            try:
+                value = cache_key_part(pd.Timestamp(value).to_pydatetime())
+            except ValueError:
+                return None
+        params.setdefault(name, set()).add(value)
+    query = json.dumps(sorted((name, sorted(values)) for name, values in params.items()))
+    key = f"{version}|{request.url.path}|{query}|{response_format(request)}"
+    digest = hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+    return f'"{digest}"'
+
+def etag_matches(header: str, etag: str) -> bool:
+    candidates = [tag.strip() for tag in header.split(',')]
+    return '*' in candidates or any(tag.removeprefix('W/') == etag for tag in candidates)
+
+# Registered after admission_control so it runs first: 304s never queue
+@app.middleware("http")
+async def conditional_get(request: Request, call_next):
+    """Answer If-None-Match with 304 before any handler work runs."""
+    if request.method != 'GET' or not request.url.path.startswith('/api/') or request.url.path in UNVERSIONED_PATHS:
+        return await call_next(request)
+    etag = response_etag(request, dataset.version)
+    if etag is None:
+        return await call_next(request)
+    if etag_matches(request.headers.get('if-none-match', ''), etag):
+        return Response(status_code=304, headers={'ETag': etag, 'Vary': 'Accept'})
+    response = await call_next(request)
+    if response.status_code == 200:
+        response.headers['ETag'] = etag
+        response.headers['Vary'] = 'Accept'
+    return response
+
+def route_label(scope) -> str:
+    """Path template of the route serving a request, or 'other'.
+
+    Responses produced by middleware (304s, 503s) never reach the router,
+    so their route is found by matching the request against app.routes.
+    """
+    route = scope.get('route')
+    if route is None:
+        route = next((candidate for candidate in app.routes if candidate.matches(scope)[0] == Match.FULL), None)
+    return route.path if route is not None else 'other'
+
+@app.middleware("http")
+async def request_metrics(request: Request, call_next):
+    """Latency and status counts per route, including 304s and 503s."""
+    started = time.perf_counter()
+    response = await call_next(request)
+    endpoint = route_label(request.scope)
+    REQUEST_SECONDS.observe((endpoint,), time.perf_counter() - started)
+    REQUESTS.inc((endpoint, str(response.status_code)))
+    return response
+
+def process_rss_bytes() -> Optional[int]:
+    try:
+        with open('/proc/self/statm') as fh:
+            return int(fh.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+def scalar_metric(name: str, help_text: str, value, kind: str = 'gauge') -> List[str]:
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {value}"]
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics_text():
+    data = dataset
+    with _response_cache_lock:
+        hits, misses = response_cache_stats['hits'], response_cache_stats['misses']
+        cache_bytes = response_cache.currsize
+    lines = []
+    for metric in (REQUEST_SECONDS, REQUESTS, STAGE_SECONDS, ROWS_SCANNED, ROWS_RETURNED, LOAD_SECONDS):
+        lines += metric.expose()
+    lines += scalar_metric('pd_dashboard_cache_hits_total', 'Response cache hits.', hits, 'counter')
+    lines += scalar_metric('pd_dashboard_cache_misses_total', 'Response cache misses.', misses, 'counter')
+    lines += scalar_metric('pd_dashboard_cache_hit_ratio', 'Response cache hits over lookups.', hits / (hits + misses) if hits + misses else 0)
+    lines += scalar_metric('pd_dashboard_cache_bytes', 'Approximate size of the cached responses.', cache_bytes)
+    lines += scalar_metric('pd_dashboard_dataset_events', 'Events in the published dataset.', event_count(data.sales) + event_count(data.web))
+    lines += scalar_metric('pd_dashboard_dataset_source_bytes', 'Bytes of the CSV ingested.', data.source_offset)
+    lines += scalar_metric('pd_dashboard_admission_in_use', 'Compute capacity units held.', admission.in_use)
+    lines += scalar_metric('pd_dashboard_admission_queued', 'Requests waiting for compute capacity.', len(admission.waiters))
+    lines += scalar_metric('pd_dashboard_admission_rejected_total', 'Requests turned away with 503.', admission.rejected, 'counter')
+    rss = process_rss_bytes()
+    if rss is not None:
+        lines += scalar_metric('process_resident_memory_bytes', 'Resident memory of this worker.', rss)
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4")
+
+# Enable CORS for frontend. Added after the other middleware so it stays
+# outermost and 304 answers carry the CORS headers too.
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["ETag", NEXT_CURSOR_HEADER, "Server-Timing", "X-Profile-Dump"],
+)
+
+@app.get("/api/cache")
+def get_cache_stats():
+    with _response_cache_lock:
+        return {
+            "hits": response_cache_stats['hits'],
+            "misses": response_cache_stats['misses'],
+            "entries": len(response_cache),
+            "bytes": response_cache.currsize,
+            "max_bytes": RESPONSE_CACHE_BYTES,
+            "ttl_seconds": RESPONSE_CACHE_TTL
+        }
+
 @app.get("/api/countries")
+@cached_response
 def get_countries() -> List[str]:
     try:
-        return sorted(df['country'].dropna().unique().tolist())
+        data = dataset
+        countries = pd.concat([data.sales['country'], data.web['country']]).dropna()
+        return sorted(countries.unique().tolist())
     except Exception as e:
         logger.error(f"Error fetching countries: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error fetching countries: {str(e)}")
 
+@instrumented
+def compute_sales(ctx: QueryContext):
+    filtered = ctx.sale_window
+    if filtered.empty:
+        return []
+    grouped = (
+        filtered
+        .reset_index()
+        .groupby(['country', 'product'], observed=True)
+        .agg(
+            sales_count=('quantity', 'sum'),
+            revenue=('revenue', 'sum'),
+            profit=('profit', 'sum')
+        )
+        .reset_index()
+    )
+    return grouped
+
 @app.get("/api/sales")
+@cached_response
 def get_sales(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     country: Optional[List[str]] = Query(None)
 ):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, country)
-        if filtered.empty:
-            return []
-        grouped = (
-            filtered
-            .reset_index()
-            .groupby(['country', 'product'])
-            .agg(
-                sales_count=('quantity', 'sum'),
-                revenue=('revenue', 'sum'),
-                profit=('profit', 'sum')
-            )
-            .reset_index()
-        )
-        return grouped.to_dict(orient='records')
+        result = compute_sales(QueryContext(dataset, start_date, end_date, country))
     except Exception as e:
         logger.error(f"Error in sales endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing sales data: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_web_events(ctx: QueryContext):
+    filtered = ctx.web
+    if filtered.empty:
+        return []
+    target_urls = ['/request-demo', '/promotional-event', '/ai-assistant']
+    events = filtered[filtered['url'].isin(target_urls)]
+    grouped = events.reset_index().groupby(['country', 'url'], observed=True)
+    counts = grouped['rows'].sum() if is_aggregated(events) else grouped.size()
+    grouped = counts.reset_index(name='count')
+    return grouped
 
 @app.get("/api/web_events")
+@cached_response
 def get_web_events(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     country: Optional[List[str]] = Query(None)
 ):
     try:
-        web_df = df[df['event_type'] == 'web']
-        filtered = filter_df(web_df, start_date, end_date, country)
-        if filtered.empty:
-            return []
-        target_urls = ['/request-demo', '/promotional-event', '/ai-assistant']
-        events = filtered[filtered['url'].isin(target_urls)]
-        grouped = events.reset_index().groupby(['country', 'url']).size().reset_index(name='count')
-        return grouped.to_dict(orient='records')
+        result = compute_web_events(QueryContext(dataset, start_date, end_date, country))
     except Exception as e:
         logger.error(f"Error in web_events endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing web events: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_metrics(ctx: QueryContext):
+    kpis = ctx.kpis
+    return {
+        "total_sales": int(round(kpis['sales'])),
+        "total_revenue": float(kpis['revenue']),
+        "total_profit": float(kpis['profit']),
+        "demo_requests": int(round(kpis['demo_requests'])),
+        "promo_requests": int(round(kpis['promo_requests'])),
+        "ai_requests": int(round(kpis['ai_requests']))
+    }
 
 @app.get("/api/metrics")
+@cached_response
 def get_metrics(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     country: Optional[List[str]] = Query(None)
 ):
     try:
-        filtered = filter_df(df, start_date, end_date, country)
-        if filtered.empty:
-            return {
-                "total_sales": 0,
-                "total_revenue": 0.0,
-                "total_profit": 0.0,
-                "demo_requests": 0,
-                "promo_requests": 0,
-                "ai_requests": 0
-            }
-        sales = filtered[filtered['event_type'] == 'sale']
-        web = filtered[filtered['event_type'] == 'web']
-        return {
-            "total_sales": int(sales.shape[0]),
-            "total_revenue": float(sales['revenue'].sum()),
-            "total_profit": float(sales['profit'].sum()),
-            "demo_requests": int(web[web['url'] == '/request-demo'].shape[0]),
-            "promo_requests": int(web[web['url'] == '/promotional-event'].shape[0]),
-            "ai_requests": int(web[web['url'] == '/ai-assistant'].shape[0])
-        }
+        result = compute_metrics(QueryContext(dataset, start_date, end_date, country))
     except Exception as e:
         logger.error(f"Error in metrics endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing metrics: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_stats(ctx: QueryContext):
+    windows = {
+        'sale': ctx.sale_window,
+        'web': ctx.web_window,
+    }
+    moments = pd.DataFrame([
+        # Web events carry no price/quantity; preprocess fills those with 0
+        window.reindex(columns=['rows', 'price', 'price_sq', 'quantity', 'quantity_sq'], fill_value=0).sum()
+        for window in windows.values()
+    ], index=pd.Index(list(windows), name='event_type'))
+    moments = moments[moments['rows'] > 0]
+    if moments.empty:
+        return []
+    stats = moment_stats(moments, {'price': 'price', 'quantity': 'quantity'}).round(2).reset_index()
+    return stats
 
 @app.get("/api/stats")
+@cached_response
 def get_stats(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     country: Optional[List[str]] = Query(None)
 ):
     try:
-        filtered = filter_df(df, start_date, end_date, country)
-        if filtered.empty:
-            return []
-        stats = (
-            filtered
-            .reset_index()
-            .groupby('event_type')
-            .agg(
-                mean_price=('price', 'mean'),
-                std_price=('price', 'std'),
-                mean_quantity=('quantity', 'mean'),
-                std_quantity=('quantity', 'std')
-            )
-            .round(2)
-            .reset_index()
-        )
-        return stats.to_dict(orient='records')
+        result = compute_stats(QueryContext(dataset, start_date, end_date, country))
     except Exception as e:
         logger.error(f"Error in stats endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing stats: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_software_sales(ctx: QueryContext):
+    kpis = ctx.kpis
+    return {
+        "software_sales_count": int(round(kpis['software_sales'])),
+        "software_revenue": float(kpis['software_revenue'])
+    }
 
 @app.get("/api/software_sales")
+@cached_response
 def get_software_sales(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     country: Optional[List[str]] = Query(None)
 ):
     try:
-        products = ["AI Assistant", "Smart Prototype", "Analytics Suite"]
-        sales_df = df[(df['event_type'] == 'sale') & df['product'].isin(products)]
-        filtered = filter_df(sales_df, start_date, end_date, country)
-        if filtered.empty:
-            return {"software_sales_count": 0, "software_revenue": 0.0}
-        return {
-            "software_sales_count": int(filtered.shape[0]),
-            "software_revenue": float(filtered['revenue'].sum())
-        }
+        result = compute_software_sales(QueryContext(dataset, start_date, end_date, country))
     except Exception as e:
         logger.error(f"Error in software_sales endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing software sales: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_conversion_funnel(ctx: QueryContext):
+    kpis = ctx.kpis
+    web_count = int(round(kpis['web_visits']))
+    sales_count = int(round(kpis['sales']))
+    return {
+        "web_visits": web_count,
+        "demo_requests": int(round(kpis['demo_requests'])),
+        "sales": sales_count,
+        "conversion_rate": float(sales_count / web_count * 100) if web_count > 0 else 0
+    }
 
 @app.get("/api/conversion_funnel")
+@cached_response
 def get_conversion_funnel(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     country: Optional[List[str]] = Query(None)
 ):
     try:
-        filtered = filter_df(df, start_date, end_date, country)
-        if filtered.empty:
-            return {"web_visits": 0, "demo_requests": 0, "sales": 0, "conversion_rate": 0.0}
-        visits = filtered[filtered['event_type'] == 'web']
-        demos = visits[visits['url'] == '/request-demo']
-        sales = filtered[filtered['event_type'] == 'sale']
-        web_count = int(visits.shape[0])
-        sales_count = int(sales.shape[0])
-        return {
-            "web_visits": web_count,
-            "demo_requests": int(demos.shape[0]),
-            "sales": sales_count,
-            "conversion_rate": float(sales_count / web_count * 100) if web_count > 0 else 0
-        }
+        result = compute_conversion_funnel(QueryContext(dataset, start_date, end_date, country))
     except Exception as e:
         logger.error(f"Error in conversion_funnel endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing conversion funnel: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_trends(ctx: QueryContext, granularity: str = 'month'):
+    sums = rollup_window(ctx.data, 'sale', granularity, ctx.start_date, ctx.end_date, ctx.country)
+    if sums.empty:
+        logger.info("No sales data found for the specified filters")
+        return []
+    labels = period_range(sums.index.min(), sums.index.max(), TREND_GRANULARITIES[granularity])
+    return sums.reindex(labels, fill_value=0).reset_index()
+
+def check_granularity(granularity: str) -> None:
+    if granularity not in TREND_GRANULARITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown granularity: {granularity} (expected one of {', '.join(TREND_GRANULARITIES)})"
+        )
 
 @app.get("/api/trends")
+@cached_response
 def get_trends(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
-    country: Optional[List[str]] = Query(None)
+    country: Optional[List[str]] = Query(None),
+    granularity: str = Query('month')
 ):
+    check_granularity(granularity)
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, country)
-        if filtered.empty:
-            logger.info("No sales data found for the specified filters")
-            return []
-        grouped = (
-            filtered
-            .resample('M')
-            .agg(
-                revenue=('revenue', 'sum'),
-                profit=('profit', 'sum')
-            )
-            .fillna(0)
-            .reset_index()
-        )
-        return grouped.to_dict(orient='records')
+        result = compute_trends(QueryContext(dataset, start_date, end_date, country), granularity)
     except Exception as e:
         logger.error(f"Error in trends endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing trends: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_sales_by_channel(ctx: QueryContext):
+    filtered = ctx.sale_window
+    if filtered.empty:
+        return []
+    grouped = (
+        filtered
+        .reset_index()
+        .groupby(['product', 'channel'], observed=True)
+        .agg(
+            sales_count=('quantity', 'sum'),
+            revenue=('revenue', 'sum')
+        )
+        .reset_index()
+    )
+    return grouped
 
 @app.get("/api/sales_by_channel")
+@cached_response
 def get_sales_by_channel(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     country: Optional[List[str]] = Query(None)
 ):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, country)
-        if filtered.empty:
-            return []
-        grouped = (
-            filtered
-            .reset_index()
-            .groupby(['product', 'channel'])
-            .agg(
-                sales_count=('quantity', 'sum'),
-                revenue=('revenue', 'sum')
-            )
-            .reset_index()
-        )
-        return grouped.to_dict(orient='records')
+        result = compute_sales_by_channel(QueryContext(dataset, start_date, end_date, country))
     except Exception as e:
         logger.error(f"Error in sales_by_channel endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing sales by channel: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_profit_margin(ctx: QueryContext):
+    filtered = ctx.sale_window
+    if filtered.empty:
+        return []
+    grouped = filtered.reset_index().groupby(['country', 'product'], observed=True)
+    if is_aggregated(filtered):
+        sums = grouped[['profit_margin', 'rows']].sum()
+        grouped = (sums['profit_margin'] / sums['rows']).rename('profit_margin').reset_index()
+    else:
+        grouped = grouped.agg(profit_margin=('profit_margin', 'mean')).reset_index()
+    return grouped
 
 @app.get("/api/profit_margin")
+@cached_response
 def get_profit_margin(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     country: Optional[List[str]] = Query(None)
 ):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, country)
-        if filtered.empty:
-            return []
-        grouped = (
-            filtered
-            .reset_index()
-            .groupby(['country', 'product'])
-            .agg(
-                profit_margin=('profit_margin', 'mean')
-            )
-            .reset_index()
-        )
-        return grouped.to_dict(orient='records')
+        result = compute_profit_margin(QueryContext(dataset, start_date, end_date, country))
     except Exception as e:
         logger.error(f"Error in profit_margin endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing profit margin: {str(e)}")
+    return render(result, request)
+
+def customer_totals(rows: pd.DataFrame) -> pd.DataFrame:
+    return (
+        rows
+        .reset_index()
+        .groupby(['customer_id', 'country'], observed=True)
+        .agg(
+            sales_count=('quantity', 'sum'),
+            revenue=('revenue', 'sum')
+        )
+        .reset_index()
+    )
+
+@instrumented
+def compute_top_customers(ctx: QueryContext, n: int = 5):
+    window = ctx.customer_window
+    if window.empty:
+        return []
+    cells = ctx.customer_residuals.reset_index()
+    cells = cells[cells['residual'] > 0]
+    if cells.empty:
+        # Nobody with revenue was left out of the window's partial totals, so they are exact
+        top = customer_totals(window).nlargest(n, 'revenue')
+        return top.assign(revenue_error=0.0) if ctx.data.day_grain else top
+    # A candidate's total is short by at most the residuals of the days it
+    # was left out of; a customer never kept by at most its country's residuals
+    kept = window.reset_index().merge(cells, on=['timestamp', 'country'], how='left')
+    candidates = (
+        kept
+        .groupby(['customer_id', 'country'], observed=True)
+        .agg(
+            sales_count=('quantity', 'sum'),
+            revenue=('revenue', 'sum'),
+            covered=('residual', 'sum'),
+            covered_days=('residual', 'count')
+        )
+        .reset_index()
+    )
+    slack = cells.groupby('country', observed=True)['residual'].agg(['sum', 'count'])
+    country = pd.Index(candidates['country'].astype(object))
+    missed_days = slack['count'].reindex(country, fill_value=0).to_numpy() - candidates['covered_days'].to_numpy()
+    error = slack['sum'].reindex(country, fill_value=0).to_numpy() - candidates['covered'].to_numpy()
+    candidates['revenue_error'] = np.where(missed_days > 0, np.maximum(error, 0), 0.0)
+    candidates = candidates.drop(columns=['covered', 'covered_days'])
+    top = candidates.nlargest(n, 'revenue')
+    rest = candidates.drop(top.index)
+    bound = max(slack['sum'].max(), (rest['revenue'] + rest['revenue_error']).max() if len(rest) else 0)
+    settled = len(top) == n and top['revenue'].min() > bound
+    if ctx.data.day_grain:
+        # Streaming mode keeps no rows to recount from: report the bound instead
+        return top
+    if not settled:
+        return customer_totals(ctx.sales).nlargest(n, 'revenue')
+    if not (top['revenue_error'] > 0).any():
+        return top.drop(columns='revenue_error')
+    # The top N are known; only their own rows are summed again
+    rows = ctx.sales
+    return customer_totals(rows[rows['customer_id'].isin(top['customer_id'])]).nlargest(n, 'revenue')
 
 @app.get("/api/top_customers")
+@cached_response
 def get_top_customers(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
-    country: Optional[List[str]] = Query(None)
+    country: Optional[List[str]] = Query(None),
+    n: int = Query(5, ge=1, le=1000)
 ):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, country)
-        if filtered.empty:
-            return []
-        grouped = (
-            filtered
-            .reset_index()
-            .groupby(['customer_id', 'country'])
-            .agg(
-                sales_count=('quantity', 'sum'),
-                revenue=('revenue', 'sum')
-            )
-            .reset_index()
-            .nlargest(5, 'revenue')
-        )
-        return grouped.to_dict(orient='records')
+        result = compute_top_customers(QueryContext(dataset, start_date, end_date, country), n)
     except Exception as e:
         logger.error(f"Error in top_customers endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing top customers: {str(e)}")
+    return render(result, request)
+
+def distinct_counts(sketch: pd.DataFrame, name: str) -> dict:
+    """Merge the sketch rows of a window into total and per-country distinct counts."""
+    m = 1 << HLL_PRECISION
+    relative_error = round(1.04 / m ** 0.5, 4)
+    if sketch.empty:
+        return {name: 0, "relative_error": relative_error, "by_country": []}
+    codes, countries = pd.factorize(sketch['country'], sort=True)
+    register = sketch['register'].to_numpy().astype(np.int64)
+    rank = sketch['rank'].to_numpy()
+    # Rows without a country (code -1) only count towards the total
+    located = codes >= 0
+    keys, ranks = max_ranks(codes[located] * m + register[located], rank[located])
+    by_country = hll_estimate(keys // m, ranks, len(countries))
+    keys, ranks = max_ranks(register, rank)
+    total = hll_estimate(np.zeros(len(keys), dtype=np.int64), ranks, 1)[0]
+    return {
+        name: int(round(total)),
+        "relative_error": relative_error,
+        "by_country": pd.DataFrame({'country': countries, name: np.rint(by_country).astype('int64')})
+    }
+
+@instrumented
+def compute_unique_customers(ctx: QueryContext, product: Optional[str] = None):
+    sketch = ctx.customer_sketch
+    if product:
+        sketch = sketch[sketch['product'] == product]
+    return distinct_counts(sketch, 'unique_customers')
+
+@app.get("/api/unique_customers")
+@cached_response
+def get_unique_customers(
+    request: Request,
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    country: Optional[List[str]] = Query(None),
+    product: Optional[str] = Query(None)
+):
+    try:
+        result = compute_unique_customers(QueryContext(dataset, start_date, end_date, country), product)
+    except Exception as e:
+        logger.error(f"Error in unique_customers endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing unique customers: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_unique_visitors(ctx: QueryContext):
+    return distinct_counts(ctx.visitor_sketch, 'unique_visitors')
+
+@app.get("/api/unique_visitors")
+@cached_response
+def get_unique_visitors(
+    request: Request,
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    country: Optional[List[str]] = Query(None)
+):
+    try:
+        result = compute_unique_visitors(QueryContext(dataset, start_date, end_date, country))
+    except Exception as e:
+        logger.error(f"Error in unique_visitors endpoint: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error processing unique visitors: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_web_trends(ctx: QueryContext, granularity: str = 'week'):
+    sums = rollup_window(ctx.data, 'web', granularity, ctx.start_date, ctx.end_date, ctx.country)
+    if sums.empty:
+        logger.info("No web events found for the specified filters")
+        return []
+    if not sums[list(WEB_TREND_URLS)].to_numpy().any():
+        logger.info("No target web events found for the specified filters")
+        return []
+    # Every period the window spans, labelled like the rollups
+    first = parse_date(ctx.start_date, 'start_date') if ctx.start_date else sums.index.min()
+    last = parse_date(ctx.end_date, 'end_date') if ctx.end_date else sums.index.max()
+    labels = period_range(first, last, TREND_GRANULARITIES[granularity])
+    return sums[list(WEB_TREND_URLS)].reindex(labels, fill_value=0).astype('int64').reset_index()
 
 @app.get("/api/web_trends")
+@cached_response
 def get_web_trends(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
-    country: Optional[List[str]] = Query(None)
+    country: Optional[List[str]] = Query(None),
+    granularity: str = Query('week')
 ):
+    check_granularity(granularity)
     try:
-        web_df = df[df['event_type'] == 'web']
-        filtered = filter_df(web_df, start_date, end_date, country)
-        if filtered.empty:
-            logger.info("No web events found for the specified filters")
-            return []
-        target_urls = ['/request-demo', '/promotional-event', '/ai-assistant']
-        events = filtered[filtered['url'].isin(target_urls)]
-        if events.empty:
-            logger.info("No target web events found for the specified filters")
-            return []
-        # Resample and create a standardized output
-        date_range = pd.date_range(
-            start=start_date or filtered.index.min(),
-            end=end_date or filtered.index.max(),
-            freq='W'
-        )
-        grouped = (
-            events
-            .groupby([pd.Grouper(freq='W'), 'url'])
-            .size()
-            .unstack(fill_value=0)
-            .reindex(date_range, fill_value=0)
-            .reset_index()
-            .rename(columns={'index': 'timestamp'})
-        )
-        # Ensure all target URLs are present
-        for url in target_urls:
-            col_name = url
-            if col_name not in grouped.columns:
-                grouped[col_name] = 0
-        # Standardize column names
-        grouped = grouped.rename(columns={
-            '/request-demo': 'request_demo',
-            '/promotional-event': 'promotional_event',
-            '/ai-assistant': 'ai_assistant'
-        })
-        return grouped.to_dict(orient='records')
+        result = compute_web_trends(QueryContext(dataset, start_date, end_date, country), granularity)
     except Exception as e:
         logger.error(f"Error in web_trends endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing web trends: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_sales_stats(ctx: QueryContext):
+    filtered = ctx.sale_window
+    if filtered.empty:
+        logger.info("No sales data found for the specified filters in sales_stats")
+        return []
+    # Ensure job_type exists and handle missing values
+    job_type = filtered['job_type']
+    if 'Unknown' not in job_type.cat.categories:
+        job_type = job_type.cat.add_categories('Unknown')
+    filtered = filtered.assign(job_type=job_type.fillna('Unknown'))
+    moments = (
+        filtered
+        .groupby(['country', 'product', 'job_type'], observed=True)
+        [['rows', 'quantity', 'quantity_sq', 'revenue', 'revenue_sq', 'profit', 'profit_sq']]
+        .sum()
+    )
+    stats = moment_stats(
+        moments, {'sales_count': 'quantity', 'revenue': 'revenue', 'profit': 'profit'}
+    ).fillna(0).round(2).reset_index()
+    return stats
 
 @app.get("/api/sales_stats")
+@cached_response
 def get_sales_stats(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
-    country: Optional[List[str]] = Query(None)
+    country: Optional[List[str]] = Query(None),
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = Query(None)
 ):
     try:
-        sales_df = df[df['event_type'] == 'sale'].copy()
-        filtered = filter_df(sales_df, start_date, end_date, country)
-        if filtered.empty:
-            logger.info("No sales data found for the specified filters in sales_stats")
-            return []
-        # Ensure job_type exists and handle missing values
-        filtered['job_type'] = filtered.get('job_type', 'Unknown').fillna('Unknown')
-        stats = (
-            filtered
-            .reset_index()
-            .groupby(['country', 'product', 'job_type'])
-            .agg(
-                mean_sales_count=('quantity', lambda x: x.mean() if len(x) > 0 else 0),
-                std_sales_count=('quantity', lambda x: x.std() if len(x) > 1 else 0),
-                mean_revenue=('revenue', lambda x: x.mean() if len(x) > 0 else 0),
-                std_revenue=('revenue', lambda x: x.std() if len(x) > 1 else 0),
-                mean_profit=('profit', lambda x: x.mean() if len(x) > 0 else 0),
-                std_profit=('profit', lambda x: x.std() if len(x) > 1 else 0)
-            )
-            .round(2)
-            .reset_index()
-        )
-        return stats.to_dict(orient='records')
+        ctx = QueryContext(dataset, start_date, end_date, country)
+        result = cached_result(compute_sales_stats, ctx)
     except Exception as e:
         logger.error(f"Error in sales_stats endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing sales stats: {str(e)}")
+    result, next_cursor = paginate(result, limit, cursor, ctx.data.version)
+    return render(result, request, next_cursor)
+
+def code_groups(*codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Sorted unique combinations of categorical code arrays and each row's group.
+
+    Returns (group codes, one column per input; group number per row). Groups
+    sort like a categorical groupby: by code, column by column.
+    """
+    key = np.zeros(len(codes[0]), dtype=np.int64)
+    for column in codes:
+        key = key * (int(column.max(initial=0)) + 1) + column
+    keys, inverse = np.unique(key, return_inverse=True)
+    groups = []
+    for column in reversed(codes):
+        width = int(column.max(initial=0)) + 1
+        groups.append(keys % width)
+        keys = keys // width
+    return np.column_stack(groups[::-1]), inverse
+
+def group_sums(inverse: np.ndarray, values: pd.Series, groups: int) -> np.ndarray:
+    return np.bincount(inverse, weights=np.nan_to_num(values.to_numpy(dtype='float64')), minlength=groups)
+
+@instrumented
+def compute_salesperson_performance(ctx: QueryContext):
+    filtered = ctx.sale_window
+    if filtered.empty:
+        return []
+    # Define targets
+    YEARLY_TARGET = 120000  # $120,000 per salesperson per year
+    MONTHLY_TARGET = YEARLY_TARGET / 12  # Approx $10,000 per month
+    # Rows with a missing salesperson drop out, as in a groupby
+    ids = filtered['salesperson_id'].cat.codes.to_numpy()
+    names = filtered['salesperson_name'].cat.codes.to_numpy()
+    keep = (ids >= 0) & (names >= 0)
+    if not keep.any():
+        return []
+    filtered = filtered[keep]
+    ids, names = ids[keep], names[keep]
+    # Salesperson x month matrix of revenue and quantity, built from the window in one pass
+    people, person = code_groups(ids, names)
+    month = filtered.index.year.to_numpy() * 12 + filtered.index.month.to_numpy()
+    month = month - month.min()
+    n_months = int(month.max()) + 1
+    cell = person * n_months + month
+    size = len(people) * n_months
+    shape = (len(people), n_months)
+    monthly_revenue = group_sums(cell, filtered['revenue'], size).reshape(shape)
+    monthly_sales = group_sums(cell, filtered['quantity'], size).reshape(shape)
+    # A month counts for a salesperson once it holds any sale
+    active = (np.bincount(cell, minlength=size) > 0).reshape(shape)
+    active_months = active.sum(axis=1)
+
+    def month_moments(matrix):
+        mean = np.where(active, matrix, 0).sum(axis=1) / active_months
+        deviations = np.where(active, matrix - mean[:, None], 0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt((deviations ** 2).sum(axis=1) / (active_months - 1))
+        # One active month has no spread to report
+        return mean.round(2), np.where(active_months > 1, std, 0).round(2)
+
+    mean_sales, std_sales = month_moments(monthly_sales)
+    mean_revenue, std_revenue = month_moments(monthly_revenue)
+    latest = n_months - 1 - active[:, ::-1].argmax(axis=1)
+    latest_revenue = monthly_revenue[np.arange(len(people)), latest]
+    # Totals per salesperson and country over the whole window; rows without
+    # a country still count towards the monthly figures above
+    countries = filtered['country'].cat.codes.to_numpy()
+    located = countries >= 0
+    if not located.any():
+        return []
+    filtered, person = filtered[located], person[located]
+    groups, group = code_groups(ids[located], names[located], countries[located])
+    owner = person[np.unique(group, return_index=True)[1]]
+    revenue = group_sums(group, filtered['revenue'], len(groups))
+    return pd.DataFrame({
+        'salesperson_id': filtered['salesperson_id'].cat.categories[groups[:, 0]],
+        'salesperson_name': filtered['salesperson_name'].cat.categories[groups[:, 1]],
+        'country': filtered['country'].cat.categories[groups[:, 2]],
+        'sales_count': np.rint(group_sums(group, filtered['quantity'], len(groups))).astype('int64'),
+        'revenue': revenue,
+        'profit': group_sums(group, filtered['profit'], len(groups)),
+        'yearly_target_achieved': (revenue / YEARLY_TARGET * 100).round(2),
+        'monthly_target_achieved': (latest_revenue / MONTHLY_TARGET * 100).round(2)[owner],
+        'mean_monthly_sales': mean_sales[owner],
+        'std_monthly_sales': std_sales[owner],
+        'mean_monthly_revenue': mean_revenue[owner],
+        'std_monthly_revenue': std_revenue[owner],
+    })
 
 @app.get("/api/salesperson_performance")
+@cached_response
 def get_salesperson_performance(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     country: Optional[List[str]] = Query(None)
 ):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, country)
-        if filtered.empty:
-            return []
-        # Define targets
-        YEARLY_TARGET = 120000  # $120,000 per salesperson per year
-        MONTHLY_TARGET = YEARLY_TARGET / 12  # Approx $10,000 per month
-        # Aggregate by salesperson
-        grouped = (
-            filtered
-            .reset_index()
-            .groupby(['salesperson_id', 'salesperson_name', 'country'])
-            .agg(
-                sales_count=('quantity', 'sum'),
-                revenue=('revenue', 'sum'),
-                profit=('profit', 'sum')
-            )
-            .reset_index()
-        )
-        # Calculate yearly target achievement
-        grouped['yearly_target_achieved'] = (grouped['revenue'] / YEARLY_TARGET * 100).round(2)
-        # Calculate monthly statistics
-        filtered['month'] = filtered.index.to_period('M')
-        monthly = (
-            filtered
-            .reset_index()
-            .groupby(['salesperson_id', 'salesperson_name', 'month'])
-            .agg(
-                monthly_sales_count=('quantity', 'sum'),
-                monthly_revenue=('revenue', 'sum')
-            )
-            .reset_index()
-        )
-        monthly['monthly_target_achieved'] = (monthly['monthly_revenue'] / MONTHLY_TARGET * 100).round(2)
-        # Compute mean and std for monthly sales
-        monthly_stats = (
-            monthly
-            .groupby(['salesperson_id', 'salesperson_name'])
-            .agg(
-                mean_monthly_sales=('monthly_sales_count', 'mean'),
-                std_monthly_sales=('monthly_sales_count', 'std'),
-                mean_monthly_revenue=('monthly_revenue', 'mean'),
-                std_monthly_revenue=('monthly_revenue', 'std')
-            )
-            .round(2)
-            .reset_index()
-        )
-        # Merge monthly data (latest month for target, stats for mean/std)
-        latest_month = monthly.groupby('salesperson_id')['month'].max().reset_index()
-        monthly_latest = monthly.merge(latest_month, on=['salesperson_id', 'month'])
-        grouped = grouped.merge(
-            monthly_latest[['salesperson_id', 'monthly_target_achieved']],
-            on='salesperson_id',
-            how='left'
-        ).merge(
-            monthly_stats[['salesperson_id', 'mean_monthly_sales', 'std_monthly_sales',
-                          'mean_monthly_revenue', 'std_monthly_revenue']],
-            on='salesperson_id',
-            how='left'
-        ).fillna({
-            'monthly_target_achieved': 0,
-            'mean_monthly_sales': 0,
-            'std_monthly_sales': 0,
-            'mean_monthly_revenue': 0,
-            'std_monthly_revenue': 0
-        })
-        return grouped.to_dict(orient='records')
+        result = compute_salesperson_performance(QueryContext(dataset, start_date, end_date, country))
     except Exception as e:
         logger.error(f"Error in salesperson_performance endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing salesperson performance: {str(e)}")
+    return render(result, request)
+
+@instrumented
+def compute_salesperson_comparison(ctx: QueryContext):
+    filtered = ctx.sale_window
+    if filtered.empty:
+        return {"individuals": [], "team": [], "team_stats": []}
+    # Define targets
+    YEARLY_TARGET = 120000  # $120,000 per salesperson per year
+    TEAM_YEARLY_TARGET = YEARLY_TARGET * 10  # 10 salespersons
+    # Group by year and salesperson
+    filtered = filtered.assign(year=filtered.index.year)
+    individual = (
+        filtered
+        .reset_index()
+        .groupby(['year', 'salesperson_id', 'salesperson_name', 'country'], observed=True)
+        .agg(
+            sales_count=('quantity', 'sum'),
+            revenue=('revenue', 'sum'),
+            profit=('profit', 'sum')
+        )
+        .reset_index()
+    )
+    individual['yearly_target_achieved'] = (individual['revenue'] / YEARLY_TARGET * 100).round(2)
+    # Team performance
+    team = (
+        filtered
+        .reset_index()
+        .groupby('year')
+        .agg(
+            team_sales_count=('quantity', 'sum'),
+            team_revenue=('revenue', 'sum'),
+            team_profit=('profit', 'sum')
+        )
+        .reset_index()
+    )
+    team['team_target_achieved'] = (team['team_revenue'] / TEAM_YEARLY_TARGET * 100).round(2)
+    # Team statistics (mean and std per year)
+    team_stats = (
+        filtered
+        .reset_index()
+        .groupby(['year', 'salesperson_id'], observed=True)
+        .agg(
+            sales_count=('quantity', 'sum'),
+            revenue=('revenue', 'sum')
+        )
+        .reset_index()
+        .groupby('year')
+        .agg(
+            mean_team_sales=('sales_count', 'mean'),
+            std_team_sales=('sales_count', 'std'),
+            mean_team_revenue=('revenue', 'mean'),
+            std_team_revenue=('revenue', 'std')
+        )
+        .round(2)
+        .reset_index()
+    )
+    return {
+        "individuals": individual,
+        "team": team,
+        "team_stats": team_stats
+    }
 
 @app.get("/api/salesperson_comparison")
+@cached_response
 def get_salesperson_comparison(
+    request: Request,
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
-    country: Optional[List[str]] = Query(None)
+    country: Optional[List[str]] = Query(None),
+    limit: Optional[int] = Query(None, ge=1),
+    cursor: Optional[str] = Query(None)
 ):
     try:
-        sales_df = df[df['event_type'] == 'sale']
-        filtered = filter_df(sales_df, start_date, end_date, country)
-        if filtered.empty:
-            return {"individuals": [], "team": [], "team_stats": []}
-        # Define targets
-        YEARLY_TARGET = 120000  # $120,000 per salesperson per year
-        TEAM_YEARLY_TARGET = YEARLY_TARGET * 10  # 10 salespersons
-        # Group by year and salesperson
-        filtered['year'] = filtered.index.year
-        individual = (
-            filtered
-            .reset_index()
-            .groupby(['year', 'salesperson_id', 'salesperson_name', 'country'])
-            .agg(
-                sales_count=('quantity', 'sum'),
-                revenue=('revenue', 'sum'),
-                profit=('profit', 'sum')
-            )
-            .reset_index()
-        )
-        individual['yearly_target_achieved'] = (individual['revenue'] / YEARLY_TARGET * 100).round(2)
-        # Team performance
-        team = (
-            filtered
-            .reset_index()
-            .groupby('year')
-            .agg(
-                team_sales_count=('quantity', 'sum'),
-                team_revenue=('revenue', 'sum'),
-                team_profit=('profit', 'sum')
-            )
-            .reset_index()
-        )
-        team['team_target_achieved'] = (team['team_revenue'] / TEAM_YEARLY_TARGET * 100).round(2)
-        # Team statistics (mean and std per year)
-        team_stats = (
-            filtered
-            .reset_index()
-            .groupby(['year', 'salesperson_id'])
-            .agg(
-                sales_count=('quantity', 'sum'),
-                revenue=('revenue', 'sum')
-            )
-            .reset_index()
-            .groupby('year')
-            .agg(
-                mean_team_sales=('sales_count', 'mean'),
-                std_team_sales=('sales_count', 'std'),
-                mean_team_revenue=('revenue', 'mean'),
-                std_team_revenue=('revenue', 'std')
-            )
-            .round(2)
-            .reset_index()
-        )
-        return {
-            "individuals": individual.to_dict(orient='records'),
-            "team": team.to_dict(orient='records'),
-            "team_stats": team_stats.to_dict(orient='records')
-        }
+        ctx = QueryContext(dataset, start_date, end_date, country)
+        result = cached_result(compute_salesperson_comparison, ctx)
     except Exception as e:
         logger.error(f"Error in salesperson_comparison endpoint: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error processing salesperson comparison: {str(e)}")
+    # Only the per-salesperson rows grow with the filter; each page repeats the team rows
+    individuals, next_cursor = paginate(result['individuals'], limit, cursor, ctx.data.version)
+    return render({**result, 'individuals': individuals}, request, next_cursor)
+
+# Metrics served by /api/batch, by the name of their own endpoint
+METRICS = {
+    'sales': compute_sales,
+    'web_events': compute_web_events,
+    'metrics': compute_metrics,
+    'stats': compute_stats,
+    'software_sales': compute_software_sales,
+    'conversion_funnel': compute_conversion_funnel,
+    'trends': compute_trends,
+    'sales_by_channel': compute_sales_by_channel,
+    'profit_margin': compute_profit_margin,
+    'top_customers': compute_top_customers,
+    'unique_customers': compute_unique_customers,
+    'unique_visitors': compute_unique_visitors,
+    'web_trends': compute_web_trends,
+    'sales_stats': compute_sales_stats,
+    'salesperson_performance': compute_salesperson_performance,
+    'salesperson_comparison': compute_salesperson_comparison,
+}
+
+@app.get("/api/batch")
+@cached_response
+def get_batch(
+    request: Request,
+    metric: List[str] = Query(...),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    country: Optional[List[str]] = Query(None)
+):
+    unknown = sorted(set(metric) - METRICS.keys())
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown metrics: {', '.join(unknown)}")
+    ctx = QueryContext(dataset, start_date, end_date, country)
+    results = {}
+    for name in dict.fromkeys(metric):
+        try:
+            results[name] = METRICS[name](ctx)
+        except Exception as e:
+            logger.error(f"Error in batch metric {name}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error processing {name}: {str(e)}")
+    return render(results, request)
+
+def run_worker(sock: socket.socket) -> None:
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, signal.SIG_DFL)
+    server = uvicorn.Server(uvicorn.Config(app, log_level="info"))
+    server.run(sockets=[sock])
+
+def fork_worker(sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(sock)
+        finally:
+            os._exit(0)
+    return pid
+
+def serve(host: str, port: int, workers: int) -> None:
+    """Load and preprocess the data once, then fork `workers` uvicorn processes.
+
+    The workers share the listening socket and inherit the published dataset
+    copy-on-write: numeric columns, categorical codes and Arrow strings are
+    flat buffers that stay shared. Appending rows to inherited partitions would
+    copy them into every worker, so with live reload on, memory mode maps a
+    shared dataset next to DATA_CACHE_PATH unless SHARED_DATASET_PATH names
+    one. Workers that die are replaced, with a growing delay while they keep
+    dying soon after starting, and serve() exits with status 1 once
+    WORKER_MAX_FAILURES in a row have; SIGTERM/SIGINT stop them all.
+    """
+    global _preloaded, SHARED_DATASET_PATH
+    if DATA_RELOAD_INTERVAL > 0 and DATA_LOAD_MODE != 'streaming' and not SHARED_DATASET_PATH:
+        SHARED_DATASET_PATH = f"{os.path.splitext(DATA_CACHE_PATH)[0]}.arrow"
+        logger.info(f"Sharing the dataset across workers through {SHARED_DATASET_PATH}")
+    started = time.perf_counter()
+    with _publish_lock:
+        publish(preload_dataset())
+    _preloaded = True
+    logger.info(f"Preloaded data in {time.perf_counter() - started:.1f}s; forking {workers} workers")
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    # Keep the collector from touching (and so copying) the inherited objects
+    gc.collect()
+    gc.freeze()
+    children = {fork_worker(sock): time.monotonic() for _ in range(workers)}
+    stopping = threading.Event()
+    failures = 0
+
+    def stop(signum, frame):
+        stopping.set()
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        pid, status = os.wait()
+        started = children.pop(pid)
+        if stopping.is_set():
+            continue
+        # Workers dying young most likely cannot start at all; back off rather than fork in a loop
+        failures = failures + 1 if time.monotonic() - started < WORKER_MIN_UPTIME else 0
+        if failures >= WORKER_MAX_FAILURES:
+            logger.error(f"Worker {pid} exited with status {status}; {failures} workers in a row "
+                         f"died within {WORKER_MIN_UPTIME:g}s of starting, stopping")
+            stop(None, None)
+            continue
+        delay = min(WORKER_RESTART_DELAY * 2 ** (failures - 1), WORKER_RESTART_MAX_DELAY) if failures else 0.0
+        logger.error(f"Worker {pid} exited with status {status}; starting a replacement in {delay:g}s")
+        # A stop signal cuts the wait short
+        if not stopping.wait(delay):
+            children[fork_worker(sock)] = time.monotonic()
+    sock.close()
+    if failures >= WORKER_MAX_FAILURES:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    if SERVER_WORKERS > 1:
+        serve(SERVER_HOST, SERVER_PORT, SERVER_WORKERS)
+    else:
+        uvicorn.run(app, host=SERVER_HOST, port=SERVER_PORT)
\ No newline at end of file
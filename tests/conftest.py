@@ -0,0 +1,68 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+os.environ.setdefault("DATA_RELOAD_INTERVAL", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import api_server  # noqa: E402
+
+COUNTRIES = ["DE", "FR", "US"]
+PRODUCTS = ["AI Assistant", "Smart Prototype", "Analytics Suite", "Consulting"]
+URLS = ["/", "/request-demo", "/promotional-event", "/ai-assistant", "/pricing"]
+
+
+def make_events(count: int, seed: int = 0, start: str = "2024-02-01", days: int = 30) -> pd.DataFrame:
+    """Raw CSV rows like generate_logs.py writes, with few enough customers to repeat."""
+    rng = np.random.default_rng(seed)
+    sale = rng.random(count) < 0.4
+    timestamps = pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days * 86400, count), unit="s")
+    customers = np.array([f"c{i:03d}" for i in range(40)])
+    return pd.DataFrame({
+        "timestamp": timestamps.strftime("%Y-%m-%d %H:%M:%S"),
+        "event_type": np.where(sale, "sale", "web"),
+        "country": rng.choice(COUNTRIES, count),
+        "product": np.where(sale, rng.choice(PRODUCTS, count), ""),
+        "price": np.where(sale, rng.choice([99, 249, 499], count), ""),
+        "unit_cost": np.where(sale, rng.uniform(10, 90, count).round(2).astype(str), ""),
+        "quantity": np.where(sale, rng.integers(1, 20, count).astype(str), ""),
+        "channel": np.where(sale, rng.choice(["retail", "online"], count), ""),
+        "job_type": rng.choice(["Engineer", "Manager"], count),
+        "url": np.where(sale, "", rng.choice(URLS, count)),
+        "status": np.where(sale, "", rng.choice(["200", "404"], count)),
+        "user_agent": np.where(sale, "", "Mozilla/5.0"),
+        "customer_id": rng.choice(customers, count),
+        "salesperson_id": np.where(sale, rng.choice(["s1", "s2"], count), ""),
+        "salesperson_name": np.where(sale, rng.choice(["Ann", "Bob"], count), ""),
+    })
+
+
+def event_lines(events: pd.DataFrame) -> bytes:
+    return events.to_csv(index=False, header=False).encode("utf-8")
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    """Point api_server at a CSV in tmp_path and return a loader for it.
+
+    `load(events, mode=...)` writes the header and rows, loads them as the
+    server would at startup and returns the published Dataset.
+    """
+    csv_path = tmp_path / "events.csv"
+    monkeypatch.setattr(api_server, "DATA_CSV_PATH", str(csv_path))
+    monkeypatch.setattr(api_server, "DATA_CACHE_PATH", str(tmp_path / "events.parquet"))
+    monkeypatch.setattr(api_server, "SHARED_DATASET_PATH", "")
+    monkeypatch.setattr(api_server, "DATA_LOAD_MODE", "memory")
+
+    def load(events: pd.DataFrame, mode: str = "memory", trailing_newline: bool = True):
+        monkeypatch.setattr(api_server, "DATA_LOAD_MODE", mode)
+        content = events.to_csv(index=False).encode("utf-8")
+        csv_path.write_bytes(content if trailing_newline else content.rstrip(b"\n"))
+        api_server.publish(api_server.load_dataset())
+        return api_server.dataset
+
+    load.path = csv_path
+    return load
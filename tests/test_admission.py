@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+from api_server import AdmissionController
+from conftest import make_events
+
+
+async def settle():
+    for _ in range(3):
+        await asyncio.sleep(0)
+
+
+def test_weights_share_the_capacity():
+    async def scenario():
+        admission = AdmissionController(capacity=3, queue_limit=4)
+        assert await admission.acquire(2)
+        queued = asyncio.ensure_future(admission.acquire(2))
+        await settle()
+        assert not queued.done() and admission.in_use == 2
+        admission.release(2)
+        await settle()
+        assert queued.result() and admission.in_use == 2
+        admission.release(2)
+        assert admission.in_use == 0
+    asyncio.run(scenario())
+
+
+def test_light_requests_do_not_overtake_the_queue():
+    async def scenario():
+        admission = AdmissionController(capacity=3, queue_limit=4)
+        assert await admission.acquire(2)
+        heavy = asyncio.ensure_future(admission.acquire(2))
+        light = asyncio.ensure_future(admission.acquire(1))
+        await settle()
+        # The light request would fit, but the heavy one is ahead of it
+        assert not heavy.done() and not light.done()
+        admission.release(2)
+        await settle()
+        assert heavy.done() and light.done() and admission.in_use == 3
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_rejected():
+    async def scenario():
+        admission = AdmissionController(capacity=1, queue_limit=1)
+        assert await admission.acquire(1)
+        queued = asyncio.ensure_future(admission.acquire(1))
+        await settle()
+        assert not await admission.acquire(1)
+        assert admission.rejected == 1
+        admission.release(1)
+        await settle()
+        assert queued.result()
+    asyncio.run(scenario())
+
+
+def test_cancelled_after_being_dequeued():
+    async def scenario():
+        admission = AdmissionController(capacity=1, queue_limit=4)
+        assert await admission.acquire(1)
+        waiter = asyncio.ensure_future(admission.acquire(1))
+        await settle()
+        waiter.cancel()
+        # Releasing before the cancelled task runs drops its future from the queue
+        admission.release(1)
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert admission.in_use == 0 and not admission.waiters
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def busy_client(source, monkeypatch):
+    source(make_events(300))
+    api_server.clear_response_cache()
+    busy = AdmissionController(capacity=1, queue_limit=0)
+    busy.in_use = 1
+    monkeypatch.setattr(api_server, "admission", busy)
+    with TestClient(api_server.app) as client:
+        yield client
+
+
+def test_busy_server_answers_503_with_retry_after(busy_client):
+    response = busy_client.get("/api/sales_stats")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(api_server.COMPUTE_RETRY_AFTER)
+    assert api_server.admission.rejected == 1
+
+
+def test_weightless_endpoints_bypass_admission(busy_client):
+    assert api_server.ENDPOINT_WEIGHTS["/api/countries"] == 0
+    assert busy_client.get("/api/countries").status_code == 200
+    assert busy_client.get("/metrics").status_code == 200
+    assert api_server.admission.rejected == 0
@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+
+import api_server
+from conftest import event_lines, make_events
+
+
+def append_events(source, events):
+    with open(source.path, "ab") as fh:
+        fh.write(event_lines(events))
+    assert api_server.refresh_dataset()
+    return api_server.dataset
+
+
+@pytest.fixture(params=["memory", "streaming"])
+def appended(request, source):
+    """A Dataset loaded from some events, then appended overlapping days, later days and a new country."""
+    source(make_events(600, start="2024-01-20", days=40), mode=request.param)
+    late = make_events(200, seed=1, start="2024-02-25", days=10)
+    late.loc[late.index[::7], "country"] = "JP"
+    return append_events(source, late)
+
+
+def test_rollups_match_a_rebuild(appended):
+    for kind, measures in (("sale", api_server.sale_trend_measures), ("web", api_server.web_trend_measures)):
+        rollups = getattr(appended, f"{kind}_rollups")
+        rebuilt = api_server.build_rollups(measures(getattr(appended, f"{kind}_cube")))
+        for name in api_server.TREND_GRANULARITIES:
+            pd.testing.assert_frame_equal(rollups[name], rebuilt[name])
+
+
+def test_kpi_index_matches_a_rebuild(appended):
+    index = appended.kpi_index
+    rebuilt = api_server.build_kpi_index(appended.sale_cube, appended.web_cube)
+    assert index.days.equals(rebuilt.days)
+    assert sorted(index.countries) == list(rebuilt.countries)
+    # Same totals row by row, wherever each country's row ended up; the last row has no country
+    rows = [*index.countries.get_indexer(rebuilt.countries), len(index.countries)]
+    assert (index.sums[rows] == rebuilt.sums).all()
@@ -0,0 +1,42 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+from conftest import make_events
+
+FILTER = {"country": ["DE", "FR"], "start_date": "2024-02-05", "end_date": "2024-02-20T12:00:00"}
+
+
+@pytest.fixture
+def client(source):
+    source(make_events(3000))
+    api_server.clear_response_cache()
+    with TestClient(api_server.app) as client:
+        yield client
+
+
+@pytest.mark.parametrize("params", [{}, FILTER], ids=["all", "filtered"])
+def test_batch_matches_single_endpoints(client, params):
+    response = client.get("/api/batch", params={**params, "metric": list(api_server.METRICS)})
+    assert response.status_code == 200
+    batch = response.json()
+    assert list(batch) == list(api_server.METRICS)
+    for name, result in batch.items():
+        single = client.get(f"/api/{name}", params=params)
+        assert single.status_code == 200, name
+        assert result == single.json(), name
+
+
+def test_repeated_metrics_are_returned_once(client):
+    batch = client.get("/api/batch", params={"metric": ["stats", "trends", "stats"]}).json()
+    assert list(batch) == ["stats", "trends"]
+
+
+def test_unknown_metrics_are_rejected(client):
+    response = client.get("/api/batch", params={"metric": ["stats", "nope", "also_nope"]})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown metrics: also_nope, nope"
+
+
+def test_metric_is_required(client):
+    assert client.get("/api/batch").status_code == 422
@@ -0,0 +1,64 @@
+"""The Parquet cache of the preprocessed CSV: reused while the source matches, rebuilt otherwise."""
+import os
+
+import pandas as pd
+import pytest
+
+import api_server
+from conftest import make_events
+
+
+@pytest.fixture
+def parses(source, monkeypatch):
+    """Load events once, then count CSV parses done by later loads."""
+    source(make_events(500))
+    calls = []
+    preprocess = api_server.preprocess
+
+    def counted(data):
+        calls.append(len(data))
+        return preprocess(data)
+    monkeypatch.setattr(api_server, "preprocess", counted)
+    return calls
+
+
+def test_unchanged_csv_is_read_from_the_cache(source, parses):
+    cached = api_server.read_cached_frame(str(source.path), api_server.DATA_CACHE_PATH, os.path.getsize(source.path))
+    assert cached is not None
+    data = api_server.load_dataset()
+    assert parses == []
+    pd.testing.assert_frame_equal(data.sales, api_server.dataset.sales)
+    pd.testing.assert_frame_equal(data.web, api_server.dataset.web)
+
+
+def test_touched_csv_keeps_the_cache(source, parses):
+    stat = os.stat(source.path)
+    os.utime(source.path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    api_server.load_dataset()
+    assert parses == []
+
+
+def test_changed_content_rebuilds_the_cache(source, parses):
+    content = source.path.read_bytes()
+    # Same size, different bytes: only the digest tells them apart
+    source.path.write_bytes(content.replace(b"Engineer", b"Engineeq", 1))
+    data = api_server.load_dataset()
+    assert len(parses) == 1
+    assert "Engineeq" in set(data.sales["job_type"].astype(str)) | set(data.web["job_type"].astype(str))
+    # The rebuilt cache serves the next load
+    api_server.load_dataset()
+    assert len(parses) == 1
+
+
+def test_schema_version_bump_rebuilds_the_cache(parses, monkeypatch):
+    monkeypatch.setattr(api_server, "CACHE_SCHEMA_VERSION", api_server.CACHE_SCHEMA_VERSION + 1)
+    api_server.load_dataset()
+    assert len(parses) == 1
+
+
+def test_unreadable_cache_is_rebuilt(parses):
+    with open(api_server.DATA_CACHE_PATH, "wb") as fh:
+        fh.write(b"not parquet")
+    data = api_server.load_dataset()
+    assert len(parses) == 1
+    assert len(data.sales) + len(data.web) == 500
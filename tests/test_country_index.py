@@ -0,0 +1,50 @@
+"""filter_df through the country index against the date slice and isin mask."""
+import pandas as pd
+import pytest
+
+import api_server
+from conftest import make_events
+
+COUNTRIES = [["DE"], ["FR", "DE"], ["US", "US"], ["XX"], ["XX", "FR"], []]
+WINDOWS = [
+    (None, None),
+    ("2024-02-03T13:30:00", "2024-02-17T08:15:00"),
+    ("2024-02-10T06:00:00", "2024-02-10T06:00:00"),
+    # Empty date slices: reversed, and entirely after the data
+    ("2024-02-20T00:00:00", "2024-02-10T00:00:00"),
+    ("2025-01-01T00:00:00", None),
+]
+
+
+@pytest.fixture
+def data(source):
+    events = make_events(3000)
+    # Some rows have no country and belong to no index run
+    events.loc[events.index[::30], "country"] = ""
+    return source(events)
+
+
+def frames(data):
+    return {
+        name: frame for name, frame in vars(data).items()
+        if isinstance(frame, pd.DataFrame) and id(frame) in api_server._country_indexes
+    }
+
+
+@pytest.mark.parametrize("window", WINDOWS)
+@pytest.mark.parametrize("countries", COUNTRIES)
+def test_index_matches_isin(data, monkeypatch, window, countries):
+    start, end = (pd.Timestamp(value) if value else None for value in window)
+    indexed = {name: api_server.filter_df(frame, start, end, countries) for name, frame in frames(data).items()}
+    assert {"sales", "web", "sale_cube", "web_cube"} <= indexed.keys()
+    monkeypatch.setattr(api_server, "_country_indexes", {})
+    for name, rows in indexed.items():
+        expected = api_server.filter_df(getattr(data, name), start, end, countries)
+        pd.testing.assert_frame_equal(rows, expected, obj=name)
+
+
+def test_rows_without_country_are_never_selected(data):
+    missing = data.sales["country"].isna()
+    assert missing.any()
+    rows = api_server.filter_df(data.sales, None, None, list(data.sales["country"].cat.categories))
+    assert len(rows) == (~missing).sum()
@@ -0,0 +1,98 @@
+"""The Dashboard's one-pass snapshot against its panel functions fed independently filtered rows."""
+import io
+import json
+import os
+from datetime import datetime
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from conftest import make_events
+
+pytest.importorskip("streamlit")
+pytest.importorskip("plotly")
+pytest.importorskip("pycountry")
+
+DASHBOARD = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PythonStreamlit-main", "Dashboard.py")
+FILTERS = [
+    (None, None, []),
+    (datetime(2024, 2, 5, 10), datetime(2024, 2, 20, 18), ["DE", "FR"]),
+    (datetime(2024, 2, 10), datetime(2024, 2, 10, 12), ["US"]),
+    (datetime(2024, 2, 1), datetime(2024, 3, 1), ["XX"]),
+    (datetime(2025, 1, 1), None, []),
+]
+
+
+@pytest.fixture(scope="module")
+def dashboard():
+    """The Dashboard's configuration and data functions, without the page that renders them."""
+    with open(DASHBOARD, encoding="utf-8") as fh:
+        source = fh.read()
+    imports = source[:source.index("# --- Configuration & Styles ---")]
+    functions = source[source.index("# --- Configuration ---"):source.index("# --- Helpers ---")]
+    namespace = {"__file__": DASHBOARD, "__name__": "dashboard"}
+    exec(compile(imports + functions, DASHBOARD, "exec"), namespace)
+    return SimpleNamespace(**namespace)
+
+
+@pytest.fixture(scope="module")
+def df(dashboard):
+    raw = pd.read_csv(io.StringIO(make_events(3000).to_csv(index=False)), parse_dates=["timestamp"])
+    return dashboard.apply_schema(dashboard.preprocess(raw))
+
+
+def panels(dash, df, start, end, countries):
+    """Every panel computed from rows selected with plain boolean masks."""
+    mask = np.ones(len(df), dtype=bool)
+    if start:
+        mask &= df.index >= start
+    if end:
+        mask &= df.index <= end
+    if countries:
+        mask &= df["country"].isin(countries).to_numpy()
+    filtered = df[mask]
+    sales = filtered[filtered["event_type"] == "sale"]
+    web = filtered[filtered["event_type"] == "web"]
+    events = web[web["url"].isin(dash.TARGET_URLS)]
+    url_counts = events["url"].value_counts()
+    return {
+        "sales": dash.get_sales(dash.group_country_product(sales)),
+        "web_events": dash.get_web_events(web, events),
+        "metrics": dash.get_metrics(sales, url_counts),
+        "stats": dash.get_stats(filtered),
+        "software_sales": dash.get_software_sales(sales),
+        "conversion_funnel": dash.get_conversion_funnel(sales, web, url_counts),
+        "trends": dash.get_trends(sales),
+        "sales_by_channel": dash.get_sales_by_channel(sales),
+        "profit_margin": dash.get_profit_margin(dash.group_country_product(sales)),
+        "top_customers": dash.get_top_customers(sales),
+        "web_trends": dash.get_web_trends(web, events, start, end),
+        "sales_stats": dash.get_sales_stats(sales),
+        "salesperson_performance": dash.get_salesperson_performance(sales),
+        "salesperson_comparison": dash.get_salesperson_comparison(sales),
+    }
+
+
+def encoded(value) -> str:
+    # NaN encodes as NaN on both sides, so missing spreads compare equal
+    return json.dumps(value, default=str, sort_keys=True)
+
+
+@pytest.mark.parametrize("indexed", [False, True], ids=["isin", "country-index"])
+@pytest.mark.parametrize("start, end, countries", FILTERS)
+def test_snapshot_matches_panels(dashboard, df, indexed, start, end, countries):
+    country_index = dashboard.build_country_index(df) if indexed else None
+    snapshot = dashboard.compute_dashboard_snapshot(df, start, end, countries, country_index=country_index)
+    expected = panels(dashboard, df, start, end, countries)
+    assert snapshot.keys() == expected.keys()
+    for name, value in expected.items():
+        assert encoded(snapshot[name]) == encoded(value), name
+
+
+def test_unfiltered_panels_have_rows(dashboard, df):
+    snapshot = dashboard.compute_dashboard_snapshot(df, None, None, [])
+    for name, value in snapshot.items():
+        assert value, name
+    assert snapshot["metrics"]["total_sales"] == (df["event_type"] == "sale").sum()
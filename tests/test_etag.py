@@ -0,0 +1,80 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+from conftest import event_lines, make_events
+
+
+@pytest.fixture
+def client(source, monkeypatch):
+    events = make_events(800)
+    source(events[:600])
+    api_server.clear_response_cache()
+    calls = []
+    compute = api_server.compute_sales_stats
+
+    def counted(ctx):
+        calls.append(ctx)
+        return compute(ctx)
+    counted.__name__ = compute.__name__
+    monkeypatch.setattr(api_server, "compute_sales_stats", counted)
+    # Nothing cached, so every 200 runs the handler
+    monkeypatch.setattr(api_server, "RESPONSE_CACHE_BYTES", 0)
+    with TestClient(api_server.app) as client:
+        client.calls = calls
+        client.appended = event_lines(events[600:])
+        client.path = source.path
+        yield client
+
+
+def test_matching_tag_is_answered_without_the_handler(client):
+    first = client.get("/api/sales_stats")
+    etag = first.headers["ETag"]
+    assert len(client.calls) == 1
+    response = client.get("/api/sales_stats", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert not response.content
+    assert len(client.calls) == 1
+    # Weak and listed tags match too
+    assert client.get("/api/sales_stats", headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+
+
+def test_tag_covers_the_normalized_query(client):
+    tag = client.get("/api/sales_stats", params={"country": ["DE", "FR"], "start_date": "2024-02-03"}).headers["ETag"]
+    same = client.get("/api/sales_stats", params={"country": ["FR", "DE"], "start_date": "2024-02-03T00:00:00"})
+    assert same.headers["ETag"] == tag
+    other = client.get("/api/sales_stats", params={"country": "DE", "start_date": "2024-02-03"})
+    assert other.headers["ETag"] != tag
+
+
+def test_accept_changes_the_tag(client):
+    json_tag = client.get("/api/sales_stats").headers["ETag"]
+    response = client.get("/api/sales_stats", headers={"Accept": api_server.COLUMNAR_JSON_TYPE})
+    assert response.headers["ETag"] != json_tag
+    assert "Accept" in response.headers["Vary"]
+    stale = client.get("/api/sales_stats", headers={"Accept": api_server.COLUMNAR_JSON_TYPE, "If-None-Match": json_tag})
+    assert stale.status_code == 200
+
+
+def test_publish_changes_the_tag(client):
+    etag = client.get("/api/sales_stats").headers["ETag"]
+    with open(client.path, "ab") as fh:
+        fh.write(client.appended)
+    assert api_server.refresh_dataset()
+    response = client.get("/api/sales_stats", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_cache_endpoint_is_not_tagged(client):
+    response = client.get("/api/cache")
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+    assert client.get("/api/cache", headers={"If-None-Match": "*"}).status_code == 200
+
+
+def test_errors_are_not_tagged(client):
+    response = client.get("/api/trends", params={"granularity": "fortnight"})
+    assert response.status_code == 400
+    assert "ETag" not in response.headers
@@ -0,0 +1,122 @@
+"""Cube, rollup and top-N answers against plain pandas over the raw rows."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import api_server
+from conftest import make_events
+
+# Windows cutting days at both edges, inside one day, open-ended and whole days
+WINDOWS = [
+    ("2024-02-03T13:30:00", "2024-02-17T08:15:00"),
+    ("2024-02-10T06:00:00", "2024-02-10T18:00:00"),
+    (None, "2024-02-05T12:00:00"),
+    ("2024-02-25T22:00:00", None),
+    ("2024-02-01T00:00:00", "2024-02-29T23:59:59.999999"),
+]
+COUNTRIES = [None, ["DE", "FR"]]
+
+
+@pytest.fixture
+def loaded(source, monkeypatch):
+    """(Dataset, raw rows read with plain pandas); few customers are kept per day, so top-N has residuals."""
+    monkeypatch.setattr(api_server, "TOP_CUSTOMERS_PER_DAY", 2)
+    events = make_events(4000)
+    # Rows right on midnight, where whole days and partial edges meet
+    midnight = events.index[::40]
+    events.loc[midnight, "timestamp"] = events.loc[midnight, "timestamp"].str[:10] + " 00:00:00"
+    data = source(events)
+    raw = pd.read_csv(source.path, parse_dates=["timestamp"]).set_index("timestamp").sort_index()
+    raw["revenue"] = raw["price"] * raw["quantity"]
+    raw["profit"] = raw["revenue"] - raw["unit_cost"] * raw["quantity"]
+    return data, raw
+
+
+def raw_window(raw, event_type, window, countries):
+    start, end = (pd.Timestamp(value) if value else None for value in window)
+    rows = raw[raw["event_type"] == event_type]
+    if start is not None:
+        rows = rows[rows.index >= start]
+    if end is not None:
+        rows = rows[rows.index <= end]
+    if countries:
+        rows = rows[rows["country"].isin(countries)]
+    return rows
+
+
+def context(data, window, countries):
+    return api_server.QueryContext(data, *window, countries)
+
+
+@pytest.mark.parametrize("window", WINDOWS)
+@pytest.mark.parametrize("countries", COUNTRIES)
+def test_cube_windows(loaded, window, countries):
+    data, raw = loaded
+    ctx = context(data, window, countries)
+    sales = raw_window(raw, "sale", window, countries)
+    got = ctx.sale_window.groupby(["country", "product"], observed=True)[["rows", "quantity", "revenue", "profit"]].sum()
+    expected = sales.groupby(["country", "product"]).agg(
+        rows=("revenue", "size"), quantity=("quantity", "sum"), revenue=("revenue", "sum"), profit=("profit", "sum")
+    )
+    got.index = got.index.set_levels([level.astype(object) for level in got.index.levels])
+    pd.testing.assert_frame_equal(got, expected, check_dtype=False, check_index_type=False)
+    web = raw_window(raw, "web", window, countries)
+    got = ctx.web_window.groupby("url", observed=True)["rows"].sum()
+    expected = web.groupby("url").size()
+    assert got.to_dict() == expected.to_dict()
+
+
+@pytest.mark.parametrize("window", WINDOWS)
+@pytest.mark.parametrize("countries", COUNTRIES)
+def test_kpis(loaded, window, countries):
+    data, raw = loaded
+    metrics = api_server.compute_metrics(context(data, window, countries))
+    sales = raw_window(raw, "sale", window, countries)
+    web = raw_window(raw, "web", window, countries)
+    assert metrics["total_sales"] == len(sales)
+    assert metrics["total_revenue"] == pytest.approx(sales["revenue"].sum())
+    assert metrics["total_profit"] == pytest.approx(sales["profit"].sum())
+    assert metrics["demo_requests"] == (web["url"] == "/request-demo").sum()
+
+
+@pytest.mark.parametrize("window", WINDOWS)
+@pytest.mark.parametrize("countries", COUNTRIES)
+def test_top_customers(loaded, window, countries):
+    data, raw = loaded
+    top = api_server.compute_top_customers(context(data, window, countries), 5)
+    totals = raw_window(raw, "sale", window, countries).groupby(["customer_id", "country"])["revenue"].sum()
+    expected = totals.nlargest(5)
+    if expected.empty:
+        assert len(top) == 0
+        return
+    assert top["revenue"].tolist() == pytest.approx(expected.tolist())
+    # Ties may pick other customers, but each one's revenue is its full total
+    for row in top.itertuples():
+        assert row.revenue == pytest.approx(totals[(row.customer_id, row.country)])
+
+
+@pytest.mark.parametrize("window", WINDOWS)
+@pytest.mark.parametrize("countries", COUNTRIES)
+@pytest.mark.parametrize("granularity", list(api_server.TREND_GRANULARITIES))
+def test_trend_rollups(loaded, window, countries, granularity):
+    data, raw = loaded
+    freq = api_server.TREND_GRANULARITIES[granularity]
+    ctx = context(data, window, countries)
+
+    def by_period(rows, columns):
+        labels = rows.index.to_period(freq).end_time.normalize()
+        return rows[columns].groupby(labels).sum()
+
+    sales = by_period(raw_window(raw, "sale", window, countries), ["revenue", "profit"])
+    trends = api_server.compute_trends(ctx, granularity)
+    got = trends.set_index("timestamp") if len(trends) else pd.DataFrame(columns=["revenue", "profit"])
+    np.testing.assert_allclose(got.reindex(sales.index).to_numpy(dtype=float), sales.to_numpy(dtype=float))
+    assert not got.drop(sales.index).to_numpy().any()
+
+    web = raw_window(raw, "web", window, countries)
+    web = web.assign(**{name: web["url"] == url for name, url in api_server.WEB_TREND_URLS.items()})
+    visits = by_period(web, list(api_server.WEB_TREND_URLS))
+    trends = api_server.compute_web_trends(ctx, granularity)
+    got = trends.set_index("timestamp") if len(trends) else pd.DataFrame(columns=visits.columns)
+    assert got.reindex(visits.index).fillna(0).astype(int).equals(visits.astype(int))
+    assert not got.drop(visits.index).to_numpy().any()
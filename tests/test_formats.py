@@ -0,0 +1,72 @@
+import json
+
+import pyarrow as pa
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+from conftest import make_events
+
+NDJSON = {"Accept": "application/x-ndjson"}
+
+
+@pytest.fixture
+def client(source):
+    source(make_events(2000))
+    api_server.clear_response_cache()
+    with TestClient(api_server.app) as client:
+        yield client
+
+
+def lines(response):
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+@pytest.mark.parametrize("path", ["/api/trends", "/api/web_trends"])
+def test_ndjson_trends_match_json(client, path):
+    rows = lines(client.get(path, headers=NDJSON))
+    expected = client.get(path).json()
+    assert rows
+    assert rows == expected
+
+
+def test_ndjson_batch_serializes_timestamps(client):
+    rows = lines(client.get("/api/batch", params={"metric": ["trends", "sales_stats"]}, headers=NDJSON))
+    trends = [row for row in rows if row.get("section") == "trends"]
+    assert trends
+    assert len(rows) > len(trends)
+
+
+def test_columnar_json_matches_records(client):
+    records = client.get("/api/trends").json()
+    response = client.get("/api/trends", headers={"Accept": api_server.COLUMNAR_JSON_TYPE})
+    assert response.status_code == 200
+    columns = response.json()
+    assert list(columns) == list(records[0])
+    assert [dict(zip(columns, row)) for row in zip(*columns.values())] == records
+
+
+def test_columnar_json_fallback_matches_orjson(client, monkeypatch):
+    result = api_server.compute_trends(api_server.QueryContext(api_server.dataset, None, None, None))
+    encoded = json.loads(api_server.columnar_json(result))
+    monkeypatch.setattr(api_server, "orjson", None)
+    assert json.loads(api_server.columnar_json(result)) == encoded
+
+
+def test_arrow_stream_round_trips(client):
+    records = client.get("/api/trends").json()
+    response = client.get("/api/trends", headers={"Accept": api_server.ARROW_STREAM_TYPE})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith(api_server.ARROW_STREAM_TYPE)
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.num_rows == len(records)
+    assert pa.types.is_timestamp(table.schema.field("timestamp").type)
+    frame = table.to_pandas()
+    assert frame["timestamp"].dt.strftime("%Y-%m-%dT%H:%M:%S").tolist() == [row["timestamp"] for row in records]
+
+
+def test_arrow_rejects_nested_results(client):
+    response = client.get("/api/batch", params={"metric": "trends"}, headers={"Accept": api_server.ARROW_STREAM_TYPE})
+    assert response.status_code == 406
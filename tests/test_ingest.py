@@ -0,0 +1,83 @@
+import os
+import warnings
+
+import pytest
+
+import api_server
+from conftest import event_lines, make_events
+
+
+def event_total(data) -> int:
+    return len(data.sales) + len(data.web)
+
+
+def append(path, content: bytes) -> None:
+    with open(path, "ab") as fh:
+        fh.write(content)
+
+
+def test_last_row_without_newline_is_loaded(source):
+    events = make_events(200)
+    data = source(events, trailing_newline=False)
+    assert event_total(data) == len(events)
+    assert data.source_offset == os.path.getsize(source.path)
+    assert not api_server.refresh_dataset()
+
+
+def test_cache_is_reused_without_final_newline(source, monkeypatch):
+    source(make_events(200), trailing_newline=False)
+
+    def rebuilt(*args):
+        pytest.fail("the Parquet cache was rebuilt for an unchanged CSV")
+    monkeypatch.setattr(api_server, "write_cached_frame", rebuilt)
+    assert event_total(api_server.load_dataset()) == 200
+
+
+def test_rows_appended_after_missing_newline(source):
+    events = make_events(300)
+    source(events[:200], trailing_newline=False)
+    append(source.path, b"\n" + event_lines(events[200:250]).rstrip(b"\n"))
+    assert api_server.refresh_dataset()
+    assert event_total(api_server.dataset) == 250
+    append(source.path, b"\n" + event_lines(events[250:]))
+    assert api_server.refresh_dataset()
+    assert event_total(api_server.dataset) == len(events)
+
+
+def test_partly_written_row_waits(source):
+    events = make_events(300)
+    lines = event_lines(events[200:])
+    source(events[:200])
+    append(source.path, lines[:30])
+    assert not api_server.refresh_dataset()
+    assert event_total(api_server.load_dataset()) == 200
+    append(source.path, lines[30:])
+    assert api_server.refresh_dataset()
+    assert event_total(api_server.dataset) == len(events)
+
+
+def test_grown_last_row_reloads(source):
+    events = make_events(300)
+    lines = event_lines(events[200:])
+    # Every field is there, but the writer had not finished the last one
+    cut = lines.index(b"\n") - 1
+    source(events[:200])
+    append(source.path, lines[:cut])
+    api_server.publish(api_server.load_dataset())
+    assert event_total(api_server.dataset) == 201
+    append(source.path, lines[cut:])
+    assert api_server.refresh_dataset()
+    assert event_total(api_server.dataset) == len(events)
+
+
+
+def test_concat_events_skips_empty_frames(source):
+    sales = source(make_events(200)).sales
+    # Empty frames as an empty parse hands them over: every column object
+    empty = sales.iloc[:0].astype(object)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", FutureWarning)
+        assert api_server.concat_events(sales, empty).equals(sales)
+        merged = api_server.concat_events(empty, sales)
+    assert len(merged) == len(sales)
+    assert (merged.dtypes == sales.dtypes).all()
@@ -0,0 +1,45 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+from conftest import make_events
+
+
+@pytest.fixture
+def client(source, monkeypatch):
+    source(make_events(500))
+    api_server.clear_response_cache()
+    monkeypatch.setattr(api_server.REQUESTS, "values", {})
+    with TestClient(api_server.app) as client:
+        yield client
+
+
+def request_count(client, endpoint, status):
+    sample = f'pd_dashboard_requests_total{{endpoint="{endpoint}",status="{status}"}} '
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith(sample):
+            return float(line[len(sample):])
+    return 0
+
+
+def test_not_modified_is_counted_under_its_route(client):
+    etag = client.get("/api/sales_stats").headers["ETag"]
+    response = client.get("/api/sales_stats", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert request_count(client, "/api/sales_stats", 304) == 1
+    assert request_count(client, "other", 304) == 0
+
+
+def test_rejection_is_counted_under_its_route(client, monkeypatch):
+    busy = api_server.AdmissionController(capacity=1, queue_limit=0)
+    busy.in_use = 1
+    monkeypatch.setattr(api_server, "admission", busy)
+    response = client.get("/api/sales_stats")
+    assert response.status_code == 503
+    assert request_count(client, "/api/sales_stats", 503) == 1
+    assert request_count(client, "other", 503) == 0
+
+
+def test_unknown_paths_stay_other(client):
+    assert client.get("/api/nope").status_code == 404
+    assert request_count(client, "other", 404) == 1
@@ -0,0 +1,42 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+from conftest import make_events
+
+
+@pytest.fixture
+def client(source, monkeypatch):
+    source(make_events(3000))
+    api_server.clear_response_cache()
+    calls = []
+    compute = api_server.compute_sales_stats
+
+    def counted(ctx):
+        calls.append(ctx)
+        return compute(ctx)
+    counted.__name__ = compute.__name__
+    monkeypatch.setattr(api_server, "compute_sales_stats", counted)
+    with TestClient(api_server.app) as client:
+        client.calls = calls
+        yield client
+
+
+def test_pages_share_one_computation(client):
+    whole = client.get("/api/sales_stats").json()
+    pages, params = [], {"limit": 7}
+    while True:
+        response = client.get("/api/sales_stats", params=params)
+        pages += response.json()
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params = {"limit": 7, "cursor": response.headers["X-Next-Cursor"]}
+    assert pages == whole
+    assert len(whole) > 7
+    assert len(client.calls) == 1
+
+
+def test_page_size_is_not_part_of_the_key(client):
+    first = client.get("/api/sales_stats", params={"limit": 3}).json()
+    assert client.get("/api/sales_stats", params={"limit": 5}).json()[:3] == first
+    assert len(client.calls) == 1
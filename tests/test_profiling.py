@@ -0,0 +1,58 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+from conftest import make_events
+
+
+@pytest.fixture
+def client(source, monkeypatch, tmp_path):
+    source(make_events(500))
+    api_server.clear_response_cache()
+    monkeypatch.setattr(api_server, "PROFILE_DIR", str(tmp_path / "profiles"))
+    with TestClient(api_server.app) as client:
+        yield client
+
+
+def stages(response) -> dict:
+    timings = {}
+    for entry in response.headers["Server-Timing"].split(","):
+        name, duration = entry.strip().split(";dur=")
+        timings[name] = float(duration)
+    return timings
+
+
+def test_no_header_when_profiling_is_disabled(client, monkeypatch):
+    monkeypatch.setattr(api_server, "PROFILING_ENABLED", False)
+    response = client.get("/api/sales_by_channel", params={"profile": "1"}, headers={"X-Profile": "1"})
+    assert response.status_code == 200
+    assert "Server-Timing" not in response.headers
+
+
+@pytest.mark.parametrize("flag", [None, "0", "false"])
+def test_no_header_unless_asked(client, monkeypatch, flag):
+    monkeypatch.setattr(api_server, "PROFILING_ENABLED", True)
+    response = client.get("/api/sales_by_channel", params={"profile": flag} if flag else {})
+    assert "Server-Timing" not in response.headers
+
+
+@pytest.mark.parametrize("ask", [{"params": {"profile": "1"}}, {"headers": {"X-Profile": "1"}}], ids=["query", "header"])
+def test_stage_breakdown(client, monkeypatch, ask):
+    monkeypatch.setattr(api_server, "PROFILING_ENABLED", True)
+    # A cached answer would hide the stages, so profiled requests always compute
+    client.get("/api/sales_by_channel")
+    timings = stages(client.get("/api/sales_by_channel", **ask))
+    assert {"sales_by_channel-filter", "sales_by_channel-aggregate", "total"} <= timings.keys()
+    assert all(duration >= 0 for duration in timings.values())
+    assert timings["total"] >= timings["sales_by_channel-aggregate"]
+
+
+def test_sample_writes_a_stack_profile(client, monkeypatch):
+    monkeypatch.setattr(api_server, "PROFILING_ENABLED", True)
+    response = client.get("/api/sales_by_channel", params={"profile": "sample"})
+    assert "total" in stages(response)
+    path = response.headers["X-Profile-Dump"]
+    assert os.path.dirname(path) == api_server.PROFILE_DIR
+    assert os.path.exists(path)
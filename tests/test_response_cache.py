@@ -0,0 +1,76 @@
+from datetime import datetime
+
+import pytest
+from fastapi.testclient import TestClient
+
+import api_server
+from api_server import cache_key_part
+from conftest import event_lines, make_events
+
+
+def test_key_parts_are_canonical():
+    assert cache_key_part(datetime(2024, 2, 3)) == "2024-02-03"
+    assert cache_key_part(datetime(2024, 2, 3, 0, 0, 1)) == "2024-02-03T00:00:01"
+    assert cache_key_part(["US", "DE", "US"]) == ("DE", "US")
+    assert cache_key_part(("FR",)) == ("FR",)
+    assert cache_key_part(None) is None
+    assert cache_key_part("week") == "week"
+
+
+@pytest.fixture
+def client(source, monkeypatch):
+    events = make_events(800)
+    source(events[:600])
+    api_server.clear_response_cache()
+    calls = []
+    compute = api_server.compute_metrics
+
+    def counted(ctx):
+        calls.append(ctx)
+        return compute(ctx)
+    counted.__name__ = compute.__name__
+    monkeypatch.setattr(api_server, "compute_metrics", counted)
+    with TestClient(api_server.app) as client:
+        client.calls = calls
+        client.appended = event_lines(events[600:])
+        client.path = source.path
+        yield client
+
+
+def test_equivalent_filters_share_an_entry(client):
+    hits = client.get("/api/cache").json()["hits"]
+    first = client.get("/api/metrics", params={"country": ["FR", "DE"], "start_date": "2024-02-03"})
+    again = client.get("/api/metrics", params={"country": ["DE", "FR", "DE"], "start_date": "2024-02-03T00:00:00"})
+    assert again.json() == first.json()
+    assert len(client.calls) == 1
+    stats = client.get("/api/cache").json()
+    assert stats["entries"] == 1 and stats["hits"] == hits + 1
+
+
+def test_different_filters_and_formats_get_their_own_entries(client):
+    client.get("/api/metrics", params={"start_date": "2024-02-03"})
+    # An intra-day time changes the result, so it is never truncated to the day
+    client.get("/api/metrics", params={"start_date": "2024-02-03T06:00:00"})
+    client.get("/api/metrics", params={"start_date": "2024-02-03", "country": "DE"})
+    client.get("/api/metrics", params={"start_date": "2024-02-03"}, headers={"Accept": api_server.COLUMNAR_JSON_TYPE})
+    assert len(client.calls) == 4
+    assert client.get("/api/cache").json()["entries"] == 4
+
+
+def test_publish_invalidates_the_cache(client):
+    before = client.get("/api/metrics").json()
+    assert client.get("/api/cache").json()["entries"] == 1
+    with open(client.path, "ab") as fh:
+        fh.write(client.appended)
+    assert api_server.refresh_dataset()
+    assert client.get("/api/cache").json()["entries"] == 0
+    after = client.get("/api/metrics").json()
+    assert len(client.calls) == 2
+    assert after["total_sales"] > before["total_sales"]
+
+
+def test_disabled_cache_always_computes(client, monkeypatch):
+    monkeypatch.setattr(api_server, "RESPONSE_CACHE_BYTES", 0)
+    client.get("/api/metrics")
+    client.get("/api/metrics")
+    assert len(client.calls) == 2
@@ -0,0 +1,104 @@
+"""compute_salesperson_performance against the groupby-and-merge version it replaced."""
+import numpy as np
+import pandas as pd
+import pytest
+
+import api_server
+from conftest import make_events
+
+YEARLY_TARGET = 120000
+MONTHLY_TARGET = YEARLY_TARGET / 12
+
+WINDOWS = [
+    (None, None),
+    ("2024-02-10T06:00:00", "2024-04-03T12:00:00"),
+    ("2024-03-05T00:00:00", "2024-03-20T00:00:00"),
+]
+COUNTRIES = [None, ["DE"], ["FR", "US"]]
+
+
+def merged_performance(filtered: pd.DataFrame) -> pd.DataFrame:
+    """The implementation before the salesperson x month matrix."""
+    grouped = (
+        filtered.reset_index()
+        .groupby(['salesperson_id', 'salesperson_name', 'country'], observed=True)
+        .agg(sales_count=('quantity', 'sum'), revenue=('revenue', 'sum'), profit=('profit', 'sum'))
+        .reset_index()
+    )
+    grouped['yearly_target_achieved'] = (grouped['revenue'] / YEARLY_TARGET * 100).round(2)
+    filtered = filtered.assign(month=filtered.index.to_period('M'))
+    monthly = (
+        filtered.reset_index()
+        .groupby(['salesperson_id', 'salesperson_name', 'month'], observed=True)
+        .agg(monthly_sales_count=('quantity', 'sum'), monthly_revenue=('revenue', 'sum'))
+        .reset_index()
+    )
+    monthly['monthly_target_achieved'] = (monthly['monthly_revenue'] / MONTHLY_TARGET * 100).round(2)
+    monthly_stats = (
+        monthly.groupby(['salesperson_id', 'salesperson_name'], observed=True)
+        .agg(
+            mean_monthly_sales=('monthly_sales_count', 'mean'),
+            std_monthly_sales=('monthly_sales_count', 'std'),
+            mean_monthly_revenue=('monthly_revenue', 'mean'),
+            std_monthly_revenue=('monthly_revenue', 'std'),
+        )
+        .round(2)
+        .reset_index()
+    )
+    latest_month = monthly.groupby('salesperson_id', observed=True)['month'].max().reset_index()
+    monthly_latest = monthly.merge(latest_month, on=['salesperson_id', 'month'])
+    return grouped.merge(
+        monthly_latest[['salesperson_id', 'monthly_target_achieved']], on='salesperson_id', how='left'
+    ).merge(
+        monthly_stats[['salesperson_id', 'mean_monthly_sales', 'std_monthly_sales',
+                       'mean_monthly_revenue', 'std_monthly_revenue']],
+        on='salesperson_id', how='left'
+    ).fillna({
+        'monthly_target_achieved': 0, 'mean_monthly_sales': 0, 'std_monthly_sales': 0,
+        'mean_monthly_revenue': 0, 'std_monthly_revenue': 0,
+    })
+
+
+@pytest.fixture
+def data(source):
+    events = make_events(3000, days=90)
+    sale = events["event_type"] == "sale"
+    # One name per salesperson, as the old merges on salesperson_id assumed
+    names = {"s1": "Ann", "s2": "Bob", "s3": "Cid"}
+    # s3 sells in a single month only, and s2 skips March entirely
+    events.loc[sale & (events.index % 25 == 0), "salesperson_id"] = "s3"
+    events.loc[sale & (events["salesperson_id"] == "s3"), "timestamp"] = "2024-02-14 10:00:00"
+    march = events["timestamp"].str.startswith("2024-03")
+    events.loc[sale & march & (events["salesperson_id"] == "s2"), "salesperson_id"] = "s1"
+    events.loc[sale, "salesperson_name"] = events.loc[sale, "salesperson_id"].map(names)
+    events = events.sort_values("timestamp", kind="stable")
+    return source(events)
+
+
+def normalized(frame: pd.DataFrame) -> pd.DataFrame:
+    frame = frame.astype({name: str for name in ('salesperson_id', 'salesperson_name', 'country')})
+    return frame.sort_values(['salesperson_id', 'country'], ignore_index=True)
+
+
+@pytest.mark.parametrize("window", WINDOWS)
+@pytest.mark.parametrize("countries", COUNTRIES)
+def test_matches_merge_implementation(data, window, countries):
+    start, end = (pd.Timestamp(value) if value else None for value in window)
+    ctx = api_server.QueryContext(data, start, end, countries)
+    expected = merged_performance(ctx.sale_window)
+    actual = api_server.compute_salesperson_performance(ctx)
+    assert len(expected)
+    actual, expected = normalized(actual), normalized(expected)
+    assert list(actual.columns) == list(expected.columns)
+    assert actual.groupby('salesperson_id')['salesperson_name'].nunique().eq(1).all()
+    for name in expected.columns:
+        if expected[name].dtype == object:
+            assert actual[name].tolist() == expected[name].tolist(), name
+        else:
+            np.testing.assert_allclose(actual[name].to_numpy(float), expected[name].to_numpy(float),
+                                       rtol=1e-9, atol=1e-6, err_msg=name)
+
+
+def test_empty_window(data):
+    ctx = api_server.QueryContext(data, pd.Timestamp("2030-01-01"), None, None)
+    assert api_server.compute_salesperson_performance(ctx) == []
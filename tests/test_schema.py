@@ -0,0 +1,65 @@
+"""Column dtypes after apply_schema, from the CSV and from the Parquet cache."""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import api_server
+from conftest import make_events
+
+
+def assert_schema(data: pd.DataFrame) -> None:
+    for name in api_server.CATEGORY_COLUMNS:
+        assert isinstance(data[name].dtype, pd.CategoricalDtype), name
+    for name in api_server.FLOAT32_COLUMNS:
+        assert data[name].dtype == np.float32, name
+    # Summed columns keep full precision
+    for name in ("revenue", "cost", "profit"):
+        assert data[name].dtype == np.float64, name
+    assert data["status"].dtype == pd.Int16Dtype()
+    assert isinstance(data.index, pd.DatetimeIndex) and data.index.is_monotonic_increasing
+
+
+@pytest.fixture
+def preprocessed(source):
+    def load(events):
+        source(events)
+        return api_server.read_preprocessed(os.path.getsize(source.path), os.stat(source.path).st_mtime_ns)
+    return load
+
+
+@pytest.mark.parametrize("cached", [False, True], ids=["csv", "cache"])
+def test_schema(preprocessed, cached, monkeypatch):
+    events = make_events(500)
+    data = preprocessed(events)
+    if cached:
+        monkeypatch.setattr(api_server, "preprocess", lambda raw: pytest.fail("parsed the CSV again"))
+        data = api_server.read_preprocessed(os.path.getsize(api_server.DATA_CSV_PATH),
+                                            os.stat(api_server.DATA_CSV_PATH).st_mtime_ns)
+    assert_schema(data)
+    assert data["quantity"].dtype == np.int32
+    sales = data[data["event_type"] == "sale"]
+    raw = events[events["event_type"] == "sale"]
+    assert sales["quantity"].sum() == raw["quantity"].astype(int).sum()
+    assert set(data["status"].dropna()) == {200, 404}
+    assert data["status"].isna().sum() == len(sales)
+
+
+def test_fractional_quantities_stay_float(preprocessed):
+    events = make_events(200)
+    sale = events.index[events["event_type"] == "sale"][0]
+    events.loc[sale, "quantity"] = "1.5"
+    data = preprocessed(events)
+    assert_schema(data)
+    assert data["quantity"].dtype == np.float64
+    assert data["quantity"].sum() == pytest.approx(pd.to_numeric(events["quantity"]).sum())
+
+
+def test_unparseable_status_is_missing(preprocessed):
+    events = make_events(200)
+    web = events.index[events["event_type"] == "web"]
+    events.loc[web[:3], "status"] = "n/a"
+    data = preprocessed(events)
+    assert_schema(data)
+    assert data["status"].isna().sum() == (events["event_type"] == "sale").sum() + 3
@@ -0,0 +1,43 @@
+import os
+import time
+
+import pytest
+
+import api_server
+from conftest import make_events
+
+
+@pytest.fixture
+def forks(source, monkeypatch):
+    """serve() with workers that exit right away; returns the fork times."""
+    source(make_events(100))
+    monkeypatch.setattr(api_server, "_preloaded", False)
+    monkeypatch.setattr(api_server.signal, "signal", lambda *args: None)
+    monkeypatch.setattr(api_server.gc, "freeze", lambda: None)
+    monkeypatch.setattr(api_server, "WORKER_RESTART_DELAY", 0.05)
+    monkeypatch.setattr(api_server, "WORKER_MAX_FAILURES", 4)
+    started = []
+
+    def failing_worker(sock):
+        started.append(time.monotonic())
+        pid = os.fork()
+        if pid == 0:
+            os._exit(3)
+        return pid
+    monkeypatch.setattr(api_server, "fork_worker", failing_worker)
+    return started
+
+
+def test_serve_gives_up_on_workers_that_cannot_start(forks):
+    with pytest.raises(SystemExit) as exited:
+        api_server.serve("127.0.0.1", 0, 2)
+    assert exited.value.code == 1
+    # Two workers, then a replacement for each of the first three to die
+    assert len(forks) == 5
+
+
+def test_replacements_back_off(forks):
+    with pytest.raises(SystemExit):
+        api_server.serve("127.0.0.1", 0, 1)
+    gaps = [later - earlier for earlier, later in zip(forks, forks[1:])]
+    assert gaps[0] >= 0.05 and gaps[1] >= 0.1 and gaps[2] >= 0.2
@@ -0,0 +1,101 @@
+import glob
+import os
+
+import pytest
+
+import api_server
+from conftest import event_lines, make_events
+
+
+@pytest.fixture
+def shared(source, tmp_path, monkeypatch):
+    monkeypatch.setattr(api_server, "SHARED_DATASET_PATH", str(tmp_path / "events.arrow"))
+    return source
+
+
+def segments():
+    return glob.glob(f"{api_server.SHARED_DATASET_PATH}.*.seg")
+
+
+def is_mapped(frame) -> bool:
+    # Columns read from the memory map are read-only; copies are not
+    return not frame["revenue"].to_numpy().flags.writeable
+
+
+def append(path, events) -> None:
+    with open(path, "ab") as fh:
+        fh.write(event_lines(events))
+    assert api_server.refresh_dataset()
+
+
+def assert_matches_rebuild(data) -> None:
+    expected = api_server.build_dataset(*api_server.partition_events(
+        api_server.read_rows(data.columns, len(",".join(data.columns)) + 1, data.source_offset)
+    ), data.columns, data.source_offset)
+    assert len(data.sales) == len(expected.sales) and len(data.web) == len(expected.web)
+    assert data.sales.index.is_monotonic_increasing and data.web.index.is_monotonic_increasing
+    assert (data.sales["revenue"].to_numpy() == expected.sales["revenue"].to_numpy()).all()
+    assert (data.sales["country"].astype(str).to_numpy() == expected.sales["country"].astype(str).to_numpy()).all()
+    assert (data.web["url"].astype(str).to_numpy() == expected.web["url"].astype(str).to_numpy()).all()
+
+
+def test_appends_go_to_segments(shared):
+    events = make_events(600)
+    shared(events[:400])
+    base = os.stat(api_server.SHARED_DATASET_PATH)
+    append(shared.path, events[400:])
+    data = api_server.dataset
+    # The base file is left alone; only the appended rows are written
+    assert os.stat(api_server.SHARED_DATASET_PATH).st_mtime_ns == base.st_mtime_ns
+    assert segments() == [api_server.segment_path(data.source_offset - len(event_lines(events[400:])))]
+    assert_matches_rebuild(data)
+
+
+def test_other_workers_map_the_segment(shared):
+    events = make_events(600)
+    shared(events[:400])
+    with open(shared.path, "ab") as fh:
+        fh.write(event_lines(events[400:]))
+    size = api_server.complete_size(str(shared.path), len(events.columns))
+    covered, _ = api_server.extend_shared_dataset(api_server.dataset.columns, size)
+    assert covered == size
+    written = os.stat(segments()[0]).st_mtime_ns
+    # A worker behind the files maps them as they are, and ingests up to their end
+    covered, (sales, web) = api_server.extend_shared_dataset(api_server.dataset.columns, size - 1)
+    assert covered == size and len(sales) + len(web) == len(events)
+    assert api_server.refresh_dataset()
+    assert api_server.dataset.source_offset == size
+    assert os.stat(segments()[0]).st_mtime_ns == written
+
+
+def test_segments_are_compacted(shared, monkeypatch):
+    monkeypatch.setattr(api_server, "SHARED_MAX_SEGMENTS", 2)
+    events = make_events(1000)
+    shared(events[:400])
+    for lo in range(400, 800, 200):
+        append(shared.path, events[lo:lo + 200])
+    assert len(segments()) == 2
+    append(shared.path, events[800:])
+    data = api_server.dataset
+    assert segments() == []
+    assert is_mapped(data.sales)
+    assert_matches_rebuild(data)
+
+
+def test_restart_maps_base_and_segments(shared):
+    events = make_events(600)
+    shared(events[:400])
+    append(shared.path, events[400:])
+    data = api_server.load_dataset()
+    assert len(segments()) == 1
+    assert_matches_rebuild(data)
+
+
+def test_replaced_source_drops_segments(shared):
+    events = make_events(600)
+    shared(events[:400])
+    append(shared.path, events[400:])
+    data = shared(make_events(300, seed=2))
+    assert segments() == []
+    assert is_mapped(data.sales)
+    assert_matches_rebuild(data)
@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+import api_server
+from conftest import make_events
+
+INTRA_DAY = ("2024-02-10T06:00:00", "2024-02-10T18:00:00")
+WHOLE_DAY = ("2024-02-10T00:00:00", "2024-02-10T23:59:59.999999")
+
+
+def assert_same(result, expected):
+    if isinstance(result, pd.DataFrame):
+        pd.testing.assert_frame_equal(result, expected)
+    elif isinstance(result, dict):
+        assert result.keys() == expected.keys()
+        for key in result:
+            assert_same(result[key], expected[key])
+    else:
+        assert result == expected
+
+
+def run(data, name, window, country=None):
+    return api_server.METRICS[name](api_server.QueryContext(data, *window, country))
+
+
+@pytest.mark.parametrize("name", [
+    name for name in api_server.METRICS if name not in ("unique_customers", "unique_visitors")
+])
+@pytest.mark.parametrize("country", [None, ["DE", "US"]])
+def test_streaming_window_selects_whole_days(source, name, country):
+    data = source(make_events(3000), mode="streaming")
+    assert_same(run(data, name, INTRA_DAY, country), run(data, name, WHOLE_DAY, country))
+
+
+def test_streaming_top_customers_within_a_day(source):
+    data = source(make_events(3000), mode="streaming")
+    assert len(run(data, "top_customers", INTRA_DAY)) == 5
+
+
+@pytest.mark.parametrize("name", ["unique_customers", "unique_visitors"])
+def test_streaming_unique_counts_within_a_day(source, name):
+    data = source(make_events(3000), mode="streaming")
+    counts = run(data, name, INTRA_DAY)
+    assert_same(counts, run(data, name, WHOLE_DAY))
+    assert counts[name] > 0